@@ -0,0 +1,281 @@
+import json
+import threading
+import time
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Sequence
+
+from llama_index.core.callbacks import CBEventType, EventPayload
+from llama_index.core.callbacks.base_handler import BaseCallbackHandler
+from llama_index.core.instrumentation.event_handlers import BaseEventHandler
+from llama_index.core.instrumentation.events import BaseEvent
+from llama_index.core.instrumentation.events.llm import (
+    LLMChatEndEvent,
+    LLMChatInProgressEvent,
+    LLMChatStartEvent,
+    LLMCompletionEndEvent,
+    LLMCompletionInProgressEvent,
+    LLMCompletionStartEvent,
+)
+from llama_index.core.instrumentation.events.retrieval import RetrievalEndEvent, RetrievalStartEvent
+from llama_index.core.llms import ChatMessage
+
+
+@dataclass
+class LLMCallMetrics:
+    """Token counts and latencies of one LLM call."""
+    prompt_tokens: int = 0
+    generated_tokens: int = 0
+    time_to_first_token: float = 0.0
+    inter_token_latency: float = 0.0
+    generation_time: float = 0.0
+
+
+@dataclass
+class IterationMetrics:
+    """One ReAct iteration: the agent's LLM call and the tool it called."""
+    llm: LLMCallMetrics
+    tool: Optional[str] = None
+    tool_time: float = 0.0
+    retrieval_time: float = 0.0
+    # LLM calls made by the tool, e.g. the answer synthesis of the vector search
+    tool_llm_calls: List[LLMCallMetrics] = field(default_factory=list)
+
+
+@dataclass
+class TurnMetrics:
+    """All ReAct iterations of one user message."""
+    turn: int
+    timestamp: float
+    user_message: str
+    total_time: float = 0.0
+    iterations: List[IterationMetrics] = field(default_factory=list)
+
+    @property
+    def llm_calls(self) -> List[LLMCallMetrics]:
+        return [call for iteration in self.iterations for call in [iteration.llm, *iteration.tool_llm_calls]]
+
+    @property
+    def prompt_tokens(self) -> int:
+        return sum(call.prompt_tokens for call in self.llm_calls)
+
+    @property
+    def generated_tokens(self) -> int:
+        return sum(call.generated_tokens for call in self.llm_calls)
+
+    @property
+    def retrieval_time(self) -> float:
+        return sum(iteration.retrieval_time for iteration in self.iterations)
+
+    @property
+    def tool_time(self) -> float:
+        return sum(iteration.tool_time for iteration in self.iterations)
+
+    @property
+    def answer(self) -> LLMCallMetrics:
+        """Metrics of the LLM call that streamed the final answer."""
+        return self.iterations[-1].llm if self.iterations else LLMCallMetrics()
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            **asdict(self),
+            "num_iterations": len(self.iterations),
+            "prompt_tokens": self.prompt_tokens,
+            "generated_tokens": self.generated_tokens,
+            "retrieval_time": self.retrieval_time,
+            "tool_time": self.tool_time,
+        }
+
+
+class AgentMetricsRecorder:
+    """
+    Records per turn and per ReAct iteration token counts and latencies of the agent.
+
+    LLM calls and retrievals are taken from the llama_index instrumentation events, tool calls from the
+    FUNCTION_CALL callback events. Prompt and generated tokens are counted with the model's tokenizer.
+    Every finished turn is appended to a JSONL file.
+
+    Args:
+        tokenizer: Tokenizer of the chat model
+        messages_to_prompt: Function formatting chat messages to the prompt the LLM gets
+        output_path: JSONL file to append the turns to
+    """
+
+    def __init__(self, tokenizer: Any, messages_to_prompt: Callable[[Sequence[ChatMessage]], str], output_path: Path):
+        self.tokenizer = tokenizer
+        self.messages_to_prompt = messages_to_prompt
+        self.output_path = output_path
+        self.output_path.parent.mkdir(parents=True, exist_ok=True)
+
+        self.event_handler = _InstrumentationEventHandler(recorder=self)
+        self.callback_handler = _ToolCallbackHandler(self)
+        self.turns: List[TurnMetrics] = []
+
+        self._lock = threading.Lock()
+        self._turn: Optional[TurnMetrics] = None
+        self._turn_start = 0.0
+        self._reset_calls()
+
+    def _reset_calls(self) -> None:
+        # chat calls of completion LLMs are nested completion calls, only the outermost call is recorded
+        self._llm_depth = 0
+        self._llm_call: Optional[LLMCallMetrics] = None
+        self._llm_kind: Optional[type] = None
+        self._llm_start = 0.0
+        self._token_times: List[float] = []
+        self._tools: Dict[str, float] = {}
+        self._retrievals: List[float] = []
+
+    def count_tokens(self, text: str) -> int:
+        return len(self.tokenizer.encode(text, add_special_tokens=False))
+
+    def start_turn(self, user_message: str) -> None:
+        """Start recording a turn, call it before sending the message to the agent."""
+        with self._lock:
+            self._turn = TurnMetrics(turn=len(self.turns) + 1, timestamp=time.time(), user_message=user_message)
+            self._turn_start = time.perf_counter()
+            self._reset_calls()
+
+    def end_turn(self) -> Optional[TurnMetrics]:
+        """Finish the turn after the response was streamed and append it to the JSONL file."""
+        with self._lock:
+            turn, self._turn = self._turn, None
+        if turn is None:
+            return None
+
+        turn.total_time = time.perf_counter() - self._turn_start
+        self.turns.append(turn)
+        with open(self.output_path, "a") as f:
+            f.write(json.dumps(turn.to_dict()) + "\n")
+        return turn
+
+    def _current_iteration(self) -> Optional[IterationMetrics]:
+        return self._turn.iterations[-1] if self._turn is not None and self._turn.iterations else None
+
+    def handle_event(self, event: BaseEvent) -> None:
+        now = time.perf_counter()
+        with self._lock:
+            if self._turn is None:
+                return
+
+            if isinstance(event, (LLMChatStartEvent, LLMCompletionStartEvent)):
+                self._llm_depth += 1
+                if self._llm_depth == 1:
+                    self._llm_call = LLMCallMetrics()
+                    self._llm_kind = type(event)
+                    self._llm_start = now
+                    self._token_times = []
+                    iteration = self._current_iteration()
+                    if self._tools and iteration is not None:
+                        iteration.tool_llm_calls.append(self._llm_call)
+                    else:
+                        self._turn.iterations.append(IterationMetrics(llm=self._llm_call))
+                # the (nested) completion prompt is exactly what the model gets
+                if isinstance(event, LLMCompletionStartEvent):
+                    self._llm_call.prompt_tokens = self.count_tokens(event.prompt)
+                elif self._llm_depth == 1:
+                    self._llm_call.prompt_tokens = self.count_tokens(self.messages_to_prompt(event.messages))
+
+            elif isinstance(event, (LLMChatInProgressEvent, LLMCompletionInProgressEvent)):
+                if self._llm_call is not None and self._llm_kind is _START_EVENTS[type(event)] and event.response.delta:
+                    self._token_times.append(now)
+
+            elif isinstance(event, (LLMChatEndEvent, LLMCompletionEndEvent)):
+                self._llm_depth = max(0, self._llm_depth - 1)
+                if self._llm_depth == 0 and self._llm_call is not None:
+                    call = self._llm_call
+                    if event.response is None:
+                        response = ""
+                    elif isinstance(event, LLMChatEndEvent):
+                        response = event.response.message.content
+                    else:
+                        response = event.response.text
+                    call.generated_tokens = self.count_tokens(response or "")
+                    call.generation_time = now - self._llm_start
+                    # not streamed calls get the whole response at once
+                    first_token_time = self._token_times[0] if self._token_times else now
+                    call.time_to_first_token = first_token_time - self._llm_start
+                    if len(self._token_times) > 1:
+                        call.inter_token_latency = (self._token_times[-1] - self._token_times[0]) / (len(self._token_times) - 1)
+                    self._llm_call = None
+
+            elif isinstance(event, RetrievalStartEvent):
+                self._retrievals.append(now)
+
+            elif isinstance(event, RetrievalEndEvent):
+                iteration = self._current_iteration()
+                if self._retrievals and iteration is not None:
+                    iteration.retrieval_time += now - self._retrievals.pop()
+
+    def tool_started(self, event_id: str, tool_name: str) -> None:
+        with self._lock:
+            iteration = self._current_iteration()
+            if iteration is not None:
+                iteration.tool = tool_name
+                self._tools[event_id] = time.perf_counter()
+
+    def tool_finished(self, event_id: str) -> None:
+        with self._lock:
+            iteration = self._current_iteration()
+            start_time = self._tools.pop(event_id, None)
+            if iteration is not None and start_time is not None:
+                iteration.tool_time += time.perf_counter() - start_time
+
+    def summary(self, turn: TurnMetrics) -> str:
+        """Markdown summary of the turn and the average of all turns so far."""
+        answer = turn.answer
+        tokens_per_second = 1 / answer.inter_token_latency if answer.inter_token_latency > 0 else 0.0
+        lines = [
+            f"Response: {answer.time_to_first_token:.2f} s to first token, {tokens_per_second:.2f} tokens/s ({answer.generated_tokens} tokens)",
+            f"Agent: {len(turn.iterations)} iterations, {turn.prompt_tokens} prompt tokens, {turn.generated_tokens} generated tokens, "
+            f"retrieval {turn.retrieval_time:.2f} s, tools {turn.tool_time:.2f} s, total {turn.total_time:.2f} s",
+        ]
+        for i, iteration in enumerate(turn.iterations, 1):
+            tool = f", {iteration.tool} {iteration.tool_time:.2f} s" if iteration.tool else ""
+            lines.append(f"- Iteration {i}: {iteration.llm.prompt_tokens} prompt tokens, {iteration.llm.generated_tokens} generated, "
+                         f"{iteration.llm.time_to_first_token:.2f} s to first token{tool}")
+        if len(self.turns) > 1:
+            mean_ttft = sum(t.answer.time_to_first_token for t in self.turns) / len(self.turns)
+            mean_iterations = sum(len(t.iterations) for t in self.turns) / len(self.turns)
+            mean_total = sum(t.total_time for t in self.turns) / len(self.turns)
+            lines.append(f"Average of {len(self.turns)} turns: {mean_ttft:.2f} s to first token, {mean_iterations:.1f} iterations, {mean_total:.2f} s total")
+        return "\n".join(lines)
+
+
+_START_EVENTS = {LLMChatInProgressEvent: LLMChatStartEvent, LLMCompletionInProgressEvent: LLMCompletionStartEvent}
+
+
+class _InstrumentationEventHandler(BaseEventHandler):
+    """Forwards llama_index instrumentation events to the recorder."""
+    recorder: Any = None
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "AgentMetricsEventHandler"
+
+    def handle(self, event: BaseEvent, **kwargs: Any) -> None:
+        self.recorder.handle_event(event)
+
+
+class _ToolCallbackHandler(BaseCallbackHandler):
+    """Forwards tool call callback events to the recorder."""
+
+    def __init__(self, recorder: AgentMetricsRecorder):
+        super().__init__(event_starts_to_ignore=[], event_ends_to_ignore=[])
+        self.recorder = recorder
+
+    def on_event_start(self, event_type: CBEventType, payload: Optional[Dict[str, Any]] = None, event_id: str = "",
+                       parent_id: str = "", **kwargs: Any) -> str:
+        if event_type == CBEventType.FUNCTION_CALL and payload is not None:
+            self.recorder.tool_started(event_id, payload[EventPayload.TOOL].name)
+        return event_id
+
+    def on_event_end(self, event_type: CBEventType, payload: Optional[Dict[str, Any]] = None, event_id: str = "", **kwargs: Any) -> None:
+        if event_type == CBEventType.FUNCTION_CALL:
+            self.recorder.tool_finished(event_id)
+
+    def start_trace(self, trace_id: Optional[str] = None) -> None:
+        pass
+
+    def end_trace(self, trace_id: Optional[str] = None, trace_map: Optional[Dict[str, List[str]]] = None) -> None:
+        pass
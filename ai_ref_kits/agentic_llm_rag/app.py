@@ -1,32 +1,40 @@
 
 import argparse
+import hashlib
 import io
+import json
 import logging
+import re
 import sys
 import time
 import warnings
 from io import StringIO
 from pathlib import Path
-from typing import Tuple
+from typing import Any, Dict, Optional, Tuple
 
 import gradio as gr
 import nest_asyncio
 import openvino.properties as props
 import openvino.properties.hint as hints
 import openvino.properties.streams as streams
+import openvino_genai as ov_genai
 import requests
 from llama_index.core import PromptTemplate
 from llama_index.core import SimpleDirectoryReader
-from llama_index.core import VectorStoreIndex, Settings
+from llama_index.core import StorageContext, VectorStoreIndex, Settings, load_index_from_storage
 from llama_index.core.agent import ReActAgent
 from llama_index.core.agent import ReActChatFormatter
 from llama_index.core.callbacks import CallbackManager
-from llama_index.core.llms import MessageRole
+from llama_index.core.instrumentation import get_dispatcher
+from llama_index.core.llms import ChatMessage, MessageRole
 from llama_index.core.tools import FunctionTool
 from llama_index.core.tools import QueryEngineTool, ToolMetadata
 from llama_index.embeddings.huggingface_openvino import OpenVINOEmbedding
 from llama_index.llms.openvino_genai import OpenVINOGenAILLM
+from transformers import AutoTokenizer
 
+from agent_metrics import AgentMetricsRecorder
+from intent_router import Intent, IntentRouter
 from system_prompt import react_system_header_str
 # Agent tools
 from tools import PaintCalculator, ShoppingCart
@@ -44,10 +52,82 @@ ov_config = {
     props.cache_dir(): ""
 }
 
+# e.g. 600 sq ft, 1000 square feet, 250 sqft
+AREA_PATTERN = r"(\d+(?:\.\d+)?)\s*(?:sq\.?\s*f(?:ee)?t|sqft|square\s*f(?:ee|oo)t|ft2|ft²)"
+# e.g. $30, 25 dollars
+PRICE_PATTERN = r"\$\s*(\d+(?:\.\d+)?)|(\d+(?:\.\d+)?)\s*(?:\$|dollars?|usd)"
+
+VECTOR_SEARCH_METADATA = ToolMetadata(
+    name="vector_search",
+    description="""            
+            Use this tool for ANY question about paint products, recommendations, prices, or technical specifications.
+            
+            WHEN TO USE:
+            - User asks about paint types, brands, or products
+            - User needs price information before adding to cart
+            - User needs recommendations based on their project
+            - User has technical questions about painting
+            
+            EXAMPLES:
+            - "What paint is best for kitchen cabinets?"
+            - "How much does AwesomePainter Interior Acrylic Latex cost?"
+            - "What supplies do I need for painting my living room?"
+            """,
+)
+
+
+def setup_llm(llm_model_path: Path, device: str, prefix_caching: bool = True, kv_cache_size: int = 2) -> OpenVINOGenAILLM:
+    """
+    Sets up the LLM using OpenVINO GenAI.
+
+    With prefix caching, KV cache blocks of previous prompts are kept and reused when a new prompt starts
+    with the same tokens. Every agent iteration and turn starts with the same ReAct system prompt and tool
+    descriptions, so only the part after them (conversation and reasoning steps) needs prefill.
+
+    Args:
+        llm_model_path: Path to the LLM model
+        device: Target device for inference ("CPU", "GPU", etc.)
+        prefix_caching: Whether to reuse the KV cache of common prompt prefixes
+        kv_cache_size: Size of the KV cache in GB, used with prefix caching
+
+    Returns:
+        The LLM
+    """
+    config = dict(ov_config)
+    # prefix caching runs on the continuous batching backend, which doesn't support NPU
+    if prefix_caching and "NPU" in device:
+        log.warning("Prefix caching is not supported on NPU, it's disabled")
+        prefix_caching = False
+    if prefix_caching:
+        scheduler_config = ov_genai.SchedulerConfig()
+        scheduler_config.enable_prefix_caching = True
+        scheduler_config.cache_size = kv_cache_size
+        config["scheduler_config"] = scheduler_config
+
+    try:
+        llm = OpenVINOGenAILLM(model_path=str(llm_model_path), config=config, device=device)
+    except RuntimeError as e:
+        if not prefix_caching:
+            raise
+        log.warning(f"Prefix caching is not available on {device} ({e}), it's disabled")
+        llm = OpenVINOGenAILLM(model_path=str(llm_model_path), config=ov_config, device=device)
+
+    # change number of tokens to be generated in one step
+    llm._streamer.tokens_len = 1
+
+    llm.config.max_new_tokens = 500
+    llm.config.do_sample = False
+    llm.config.temperature = 0.1
+    llm.config.top_p = 0.8
+
+    return llm
+
+
 def setup_models(
     llm_model_path: Path,
     embedding_model_path: Path,
-    device: str) -> Tuple[OpenVINOGenAILLM, OpenVINOEmbedding]:
+    device: str,
+    prefix_caching: bool = True) -> Tuple[OpenVINOGenAILLM, OpenVINOEmbedding]:
     """
     Sets up LLM and embedding models using OpenVINO.
     
@@ -55,6 +135,7 @@ def setup_models(
         llm_model_path: Path to the LLM model
         embedding_model_path: Path to the embedding model
         device: Target device for inference ("CPU", "GPU", etc.)
+        prefix_caching: Whether the LLM reuses the KV cache of common prompt prefixes
         
     Returns:
         Tuple of (llm, embedding) models
@@ -70,18 +151,7 @@ def setup_models(
         sys.exit(1)
 
     # Load LLM model locally    
-    llm = OpenVINOGenAILLM(
-        model_path=str(llm_model_path),
-        config=ov_config,
-        device=device
-    )
-    # change number of tokens to be generated in one step
-    llm._streamer.tokens_len = 1
-
-    llm.config.max_new_tokens = 500
-    llm.config.do_sample = False
-    llm.config.temperature = 0.1
-    llm.config.top_p = 0.8
+    llm = setup_llm(llm_model_path, device, prefix_caching)
 
     # Load the embedding model locally
     embedding = OpenVINOEmbedding(model_id_or_path=str(embedding_model_path), device=device)
@@ -162,12 +232,128 @@ def setup_tools()-> Tuple[FunctionTool, FunctionTool, FunctionTool, FunctionTool
     return paint_cost_calculator, add_to_cart_tool, get_cart_items_tool, clear_cart_tool, paint_gallons_calculator
 
 
-def load_documents(text_example_en_path: Path) -> VectorStoreIndex:
+def parse_area(message: str) -> Optional[float]:
     """
-    Loads documents from the given path
+    Finds the area in square feet in the message
+
+    Args:
+        message: The user message
+
+    Returns:
+        The area or None if the message doesn't contain exactly one, or the area is ambiguous
+    """
+    # 1,000 sq ft -> 1000 sq ft
+    message = re.sub(r"(?<=\d),(?=\d{3})", "", message.lower())
+    areas = re.findall(AREA_PATTERN, message)
+    if len(areas) != 1:
+        return None
+    # e.g. "2 rooms of 300 sq ft each" needs the agent to multiply the area
+    if re.search(r"\b(?:each|every|times|rooms|walls|x)\b|\dx\b|×", message):
+        return None
+    # any other number than the area and the price could change the result
+    if re.search(r"\d", re.sub(PRICE_PATTERN, "", re.sub(AREA_PATTERN, "", message))):
+        return None
+    return float(areas[0])
+
+
+def parse_price(message: str) -> Optional[float]:
+    """
+    Finds the price in dollars in the message
+
+    Args:
+        message: The user message
+
+    Returns:
+        The price or None if the message doesn't contain any
+    """
+    match = re.search(PRICE_PATTERN, message.lower())
+    return float(match.group(1) or match.group(2)) if match else None
+
+
+def format_cart(cart_items: list) -> str:
+    if not cart_items:
+        return "Your shopping cart is empty. 🎨 What would you like to paint?"
+    lines = [f"- {item['quantity']} x {item['product_name']}: ${item['total_price']:.2f}" for item in cart_items]
+    total = sum(item["total_price"] for item in cart_items)
+    return "Here's what's in your cart:\n" + "\n".join(lines) + f"\n\nTotal: ${total:.2f}. Is there anything else you need for your project? 🖌️"
+
+
+def setup_intent_router(embedding: OpenVINOEmbedding, paint_cost_calculator: FunctionTool, get_cart_items_tool: FunctionTool,
+                        paint_gallons_calculator: FunctionTool, threshold: float) -> IntentRouter:
+    """
+    Sets up the router answering simple structured requests with the tools directly, without the agent.
+    Only read-only tools are routed, the ones changing the cart always go through the agent
+
+    Args:
+        embedding: Embedding model to classify the messages with
+        paint_cost_calculator: Tool calculating the paint cost
+        get_cart_items_tool: Tool returning the cart items
+        paint_gallons_calculator: Tool calculating the number of gallons
+        threshold: Minimum similarity of the message to the intent to use the fast path
+
+    Returns:
+        The intent router
+    """
+    def parse_gallons_arguments(message: str) -> Optional[Dict[str, Any]]:
+        area = parse_area(message)
+        return {"area": area} if area is not None else None
+
+    def parse_cost_arguments(message: str) -> Optional[Dict[str, Any]]:
+        area, price = parse_area(message), parse_price(message)
+        if area is None or price is None:
+            return None
+        return {"area": area, "price_per_gallon": price, "add_paint_supply_costs": "suppl" in message.lower()}
+
+    intents = [
+        Intent(get_cart_items_tool,
+               ["show me what's in my cart", "what is in my shopping cart?", "view my cart", "show my cart"],
+               format_response=lambda output, arguments: format_cart(output)),
+        Intent(paint_gallons_calculator,
+               ["how many gallons of paint do I need to cover 600 sq ft?", "how much paint do I need for 1000 square feet?",
+                "gallons needed for 250 sqft"],
+               parse_arguments=parse_gallons_arguments,
+               format_response=lambda output, arguments: f"You need {output} gallons of paint to cover {arguments['area']:g} sq ft. "
+                                                         f"Would you like to add them to your cart? 🎨"),
+        Intent(paint_cost_calculator,
+               ["how much does it cost to paint 500 sq ft with paint for $30 per gallon?", "paint cost for 800 square feet at $25 a gallon",
+                "what is the cost of paint for 300 sqft if a gallon is 40 dollars, with supplies?"],
+               parse_arguments=parse_cost_arguments,
+               format_response=lambda output, arguments: f"Painting {arguments['area']:g} sq ft costs ${output:.2f}"
+                                                         f"{' including $50 for painting supplies' if arguments['add_paint_supply_costs'] else ''}. "
+                                                         f"Would you like to add the paint to your cart? 🖌️"),
+    ]
+    return IntentRouter(embedding, intents, threshold=threshold)
+
+
+def get_file_hash(file_path: Path) -> str:
+    """
+    Computes the SHA-256 hash of the file content
+
+    Args:
+        file_path: Path to the file
+
+    Returns:
+        Hex digest of the hash
+    """
+    sha256 = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(2 ** 20), b""):
+            sha256.update(block)
+    return sha256.hexdigest()
+
+
+def load_documents(text_example_en_path: Path, index_dir: Path, embedding_model_name: str) -> VectorStoreIndex:
+    """
+    Loads documents from the given path into the index persisted in index_dir
+
+    The index is stored with a manifest of the hashes of the indexed files and the ids of their documents.
+    On startup only new and changed files are read and embedded, documents of changed and removed files
+    are deleted from the index. The index is rebuilt if it was built with another embedding model.
     
     Args:
-        text_example_en_path: Path to the document to load
+        text_example_en_path: Path to the document or a directory with documents to load
+        index_dir: Directory to persist the index to
+        embedding_model_name: Name of the embedding model, the stored vectors are valid only for it
         
     Returns:
         VectorStoreIndex for the loaded documents
@@ -180,10 +366,52 @@ def load_documents(text_example_en_path: Path) -> VectorStoreIndex:
         with open(text_example_en_path, "wb") as f:
             f.write(content.read())
 
-    reader = SimpleDirectoryReader(input_files=[text_example_en_path])
-    documents = reader.load_data()
-    index = VectorStoreIndex.from_documents(documents)
-
+    if text_example_en_path.is_dir():
+        file_paths = sorted(path for path in text_example_en_path.rglob("*") if path.is_file())
+    else:
+        file_paths = [text_example_en_path]
+    file_hashes = {str(path.resolve()): get_file_hash(path) for path in file_paths}
+
+    manifest_path = index_dir / "manifest.json"
+    manifest = {"embedding_model": embedding_model_name, "files": {}}
+    if manifest_path.exists():
+        with open(manifest_path) as f:
+            stored_manifest = json.load(f)
+        if stored_manifest.get("embedding_model") == embedding_model_name:
+            manifest = stored_manifest
+        else:
+            log.info("The index was built with another embedding model, it will be rebuilt")
+
+    # file path: {"hash": file hash, "doc_ids": ids of the file's documents in the index}
+    indexed_files: Dict[str, Dict] = manifest["files"]
+    if indexed_files:
+        index = load_index_from_storage(StorageContext.from_defaults(persist_dir=str(index_dir)))
+    else:
+        index = VectorStoreIndex([])
+
+    # drop documents of removed and changed files
+    outdated_files = [file_path for file_path, entry in indexed_files.items() if file_hashes.get(file_path) != entry["hash"]]
+    for file_path in outdated_files:
+        for doc_id in indexed_files.pop(file_path)["doc_ids"]:
+            index.delete_ref_doc(doc_id, delete_from_docstore=True)
+
+    changed_files = [Path(file_path) for file_path in file_hashes if file_path not in indexed_files]
+    if changed_files or outdated_files:
+        start_time = time.perf_counter()
+        documents = SimpleDirectoryReader(input_files=changed_files, filename_as_id=True).load_data() if changed_files else []
+        for document in documents:
+            index.insert(document)
+        for file_path in changed_files:
+            doc_ids = [document.doc_id for document in documents if Path(document.metadata["file_path"]).resolve() == file_path]
+            indexed_files[str(file_path)] = {"hash": file_hashes[str(file_path)], "doc_ids": doc_ids}
+
+        index_dir.mkdir(parents=True, exist_ok=True)
+        index.storage_context.persist(persist_dir=str(index_dir))
+        with open(manifest_path, "w") as f:
+            json.dump(manifest, f, indent=2)
+        log.info(f"Indexed {len(changed_files)} new or changed files in {time.perf_counter() - start_time:.1f}s")
+
+    log.info(f"Loaded the index of {len(indexed_files)} files from {index_dir}")
     return index
 
 def custom_handle_reasoning_failure(callback_manager: CallbackManager, exception: Exception):
@@ -197,12 +425,14 @@ def custom_handle_reasoning_failure(callback_manager: CallbackManager, exception
     return "Hmm...I didn't quite that. Could you please rephrase your question to be simpler?"
 
 
-def run_app(agent: ReActAgent, public_interface: bool = False) -> None:
+def run_app(agent: ReActAgent, metrics_recorder: AgentMetricsRecorder, intent_router: IntentRouter, public_interface: bool = False) -> None:
     """
     Launches the application with the specified agent and interface settings.
     
     Args:
         agent: The ReActAgent instance configured with tools
+        metrics_recorder: Recorder of the agent's token counts and latencies
+        intent_router: Router answering simple structured requests without the agent
         public_interface: Whether to launch with a public-facing Gradio interface
     """
     class Capturing(list):
@@ -278,7 +508,7 @@ def run_app(agent: ReActAgent, public_interface: bool = False) -> None:
         1. Captures the agent's thought process
         2. Formats the thought process into readable logs
         3. Streams the agent's response token by token
-        4. Tracks performance metrics for thought process and response generation
+        4. Records token counts and latencies of every agent iteration and summarizes them
         5. Updates the shopping cart display
         
         Args:
@@ -296,8 +526,22 @@ def run_app(agent: ReActAgent, public_interface: bool = False) -> None:
         if not isinstance(log_history, list):
             log_history = []
 
-        # Capture time for thought process
-        start_thought_time = time.time()
+        # simple requests like viewing the cart don't need the agent's reasoning
+        routed = intent_router.route(chat_history[-1][0])
+        if routed is not None:
+            chat_history[-1][1] = routed.response
+            # the agent needs the exchange for follow-up questions
+            agent.memory.put(ChatMessage(role=MessageRole.USER, content=chat_history[-1][0]))
+            agent.memory.put(ChatMessage(role=MessageRole.ASSISTANT, content=routed.response))
+            log_history.append("### ⚡ Fast Path")
+            routed_log = (f"Called {routed.intent}({', '.join(f'{k}={v}' for k, v in routed.arguments.items())}) directly "
+                          f"(similarity {routed.similarity:.2f}) in {routed.time * 1000:.0f} ms\n{intent_router.stats.summary()}")
+            log.info(routed_log)
+            log_history.append(routed_log)
+            yield chat_history, "\n".join(log_history), update_cart_display()
+            return
+
+        metrics_recorder.start_turn(chat_history[-1][0])
 
         # Capture the thought process output
         with Capturing() as output:
@@ -317,19 +561,13 @@ def run_app(agent: ReActAgent, public_interface: bool = False) -> None:
                 formatted_output.append("\n📋 **Result:**\n" + line.split("Observation:", 1)[1])
             else:
                 formatted_output.append(line)
-        end_thought_time = time.time()
-        thought_process_time = end_thought_time - start_thought_time
 
         # After response is complete, show the captured logs in the log area
         log_entries = "\n".join(formatted_output)
         log_history.append("### 🤔 Agent's Thought Process")
-        thought_process_log = f"Thought Process Time: {thought_process_time:.2f} seconds"
-        log_history.append(f"{log_entries}\n{thought_process_log}")
+        log_history.append(log_entries)
         cart_content = update_cart_display() # update shopping cart
-        yield chat_history, "\n".join(log_history), cart_content  # Yield after the thought process time is captured
-
-        # Now capture response generation time
-        start_response_time = time.time()
+        yield chat_history, "\n".join(log_history), cart_content  # Yield after the thought process is captured
 
         # Gradually yield the response from the agent to the chat
         # Quick fix for agent occasionally repeating the first word of its repsponse
@@ -346,17 +584,12 @@ def run_app(agent: ReActAgent, public_interface: bool = False) -> None:
             yield chat_history, "\n".join(log_history), cart_content  # Ensure log_history is a string
             if i <= 2: i += 1
 
-        end_response_time = time.time()
-        response_time = end_response_time - start_response_time
-
-        # Log tokens per second along with the device information
-        tokens = len(chat_history[-1][1].split(" ")) * 4 / 3  # Convert words to approx token count
-        response_log = f"Response Time: {response_time:.2f} seconds ({tokens / response_time:.2f} tokens/s)"
-
-        log.info(response_log)
-
-        # Append the response time to log history
-        log_history.append(response_log)
+        # Token counts and latencies of all agent iterations, they're also appended to the JSONL log
+        turn = metrics_recorder.end_turn()
+        if turn is not None:
+            response_log = metrics_recorder.summary(turn) + "\n" + intent_router.stats.summary()
+            log.info(response_log)
+            log_history.append(response_log)
         yield chat_history, "\n".join(log_history), cart_content  # Join logs into a string for display
 
     def _reset_chat()-> tuple[str, list, str, str]:
@@ -499,19 +732,29 @@ def run_app(agent: ReActAgent, public_interface: bool = False) -> None:
     run()
 
 
-def run(chat_model: Path, embedding_model: Path, rag_pdf: Path, device: str, public_interface: bool = False):
+def run(chat_model: Path, embedding_model: Path, rag_pdf: Path, device: str, public_interface: bool = False,
+        metrics_log: Path = Path("logs/agent_metrics.jsonl"), prefix_caching: bool = True, index_dir: Path = Path("storage"),
+        router_threshold: float = 0.85):
     """
     Initializes and runs the agentic rag solution
     
     Args:
         chat_model: Path to the LLM chat model
         embedding_model: Path to the embedding model
-        rag_pdf: Path to the PDF file for RAG functionality
+        rag_pdf: Path to the PDF file (or a directory of files) for RAG functionality
         device: Target device for model inference ("CPU", "GPU", "GPU.1")
         public_interface: Whether to expose a public-facing interface
+        metrics_log: Path to the JSONL file with token counts and latencies of every turn
+        prefix_caching: Whether the LLM reuses the KV cache of the system prompt and tool descriptions
+        index_dir: Directory to persist the RAG index to
+        router_threshold: Minimum similarity of a message to a structured intent to call the tool without the agent
     """
     # Load models and embedding based on parsed arguments
-    llm, embedding = setup_models(chat_model, embedding_model, device)
+    llm, embedding = setup_models(chat_model, embedding_model, device, prefix_caching)
+
+    # Record token counts and latencies of LLM calls, retrievals and tool calls
+    metrics_recorder = AgentMetricsRecorder(AutoTokenizer.from_pretrained(chat_model), llm.messages_to_prompt, metrics_log)
+    get_dispatcher().add_event_handler(metrics_recorder.event_handler)
 
     Settings.embed_model = embedding
     Settings.llm = llm
@@ -520,29 +763,10 @@ def run(chat_model: Path, embedding_model: Path, rag_pdf: Path, device: str, pub
     paint_cost_calculator, add_to_cart_tool, get_cart_items_tool, clear_cart_tool, paint_gallons_calculator = setup_tools()
     
     text_example_en_path = Path(rag_pdf)
-    index = load_documents(text_example_en_path)
+    index = load_documents(text_example_en_path, index_dir, embedding_model.name)
     log.info(f"loading in {index}")
  
-    vector_tool = QueryEngineTool(
-        index.as_query_engine(streaming=True),
-        metadata=ToolMetadata(
-            name="vector_search",
-            description="""            
-            Use this tool for ANY question about paint products, recommendations, prices, or technical specifications.
-            
-            WHEN TO USE:
-            - User asks about paint types, brands, or products
-            - User needs price information before adding to cart
-            - User needs recommendations based on their project
-            - User has technical questions about painting
-            
-            EXAMPLES:
-            - "What paint is best for kitchen cabinets?"
-            - "How much does AwesomePainter Interior Acrylic Latex cost?"
-            - "What supplies do I need for painting my living room?"
-            """,
-        ),
-    )
+    vector_tool = QueryEngineTool(index.as_query_engine(streaming=True), metadata=VECTOR_SEARCH_METADATA)
     
     nest_asyncio.apply()
  
@@ -553,6 +777,7 @@ def run(chat_model: Path, embedding_model: Path, rag_pdf: Path, device: str, pub
         max_iterations=5,  # Set a max_iterations value
         handle_reasoning_failure_fn=custom_handle_reasoning_failure,
         verbose=True,
+        callback_manager=CallbackManager([metrics_recorder.callback_handler]),
         react_chat_formatter=ReActChatFormatter.from_defaults(
             observation_role=MessageRole.TOOL   
         ),
@@ -560,7 +785,8 @@ def run(chat_model: Path, embedding_model: Path, rag_pdf: Path, device: str, pub
     react_system_prompt = PromptTemplate(react_system_header_str)
     agent.update_prompts({"agent_worker:system_prompt": react_system_prompt})  
     agent.reset()                     
-    run_app(agent, public_interface)
+    intent_router = setup_intent_router(embedding, paint_cost_calculator, get_cart_items_tool, paint_gallons_calculator, router_threshold)
+    run_app(agent, metrics_recorder, intent_router, public_interface)
 
 
 if __name__ == "__main__":
@@ -569,9 +795,13 @@ if __name__ == "__main__":
     parser.add_argument("--chat_model", type=str, default="model/qwen2-7B-INT4", help="Path to the chat model directory")
     parser.add_argument("--embedding_model", type=str, default="model/bge-large-FP32", help="Path to the embedding model directory")
     parser.add_argument("--rag_pdf", type=str, default="data/test_painting_llm_rag.pdf", help="Path to a RAG PDF file with additional knowledge the chatbot can rely on.")    
+    parser.add_argument("--index_dir", type=str, default="storage", help="Directory to persist the RAG index to, only new or changed documents are embedded on startup")
     parser.add_argument("--device", type=str, default="AUTO:GPU,CPU", help="Device for inferencing (CPU,GPU,GPU.1,NPU)")
     parser.add_argument("--public", default=False, action="store_true", help="Whether interface should be available publicly")
+    parser.add_argument("--no_prefix_caching", action="store_true", help="Prefill the whole prompt in every agent iteration instead of reusing the KV cache of the system prompt and tools")
+    parser.add_argument("--router_threshold", type=float, default=0.85, help="Minimum similarity of a message to a structured intent (e.g. view the cart) to call the tool without the agent, above 1 disables it")
+    parser.add_argument("--metrics_log", type=str, default="logs/agent_metrics.jsonl", help="Path to the JSONL file with token counts and latencies of every turn")
 
     args = parser.parse_args()
 
-    run(Path(args.chat_model), Path(args.embedding_model), Path(args.rag_pdf), args.device, args.public)
+    run(Path(args.chat_model), Path(args.embedding_model), Path(args.rag_pdf), args.device, args.public, Path(args.metrics_log), not args.no_prefix_caching, Path(args.index_dir), args.router_threshold)
@@ -0,0 +1,142 @@
+import re
+import time
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional
+
+import numpy as np
+from llama_index.core.base.embeddings.base import BaseEmbedding
+from llama_index.core.tools import FunctionTool
+
+
+@dataclass
+class Intent:
+    """
+    A structured request that can be answered by calling one tool directly.
+
+    Args:
+        tool: The tool to call
+        examples: Sample user messages with this intent, they are embedded together with the tool description
+        parse_arguments: Function extracting the tool arguments from the message, returns None if they're missing
+        format_response: Function creating the answer from the tool output and the arguments
+    """
+    tool: FunctionTool
+    examples: List[str]
+    parse_arguments: Callable[[str], Optional[Dict[str, Any]]] = lambda message: {}
+    format_response: Callable[[Any, Dict[str, Any]], str] = lambda output, arguments: str(output)
+
+
+@dataclass
+class RoutedResponse:
+    """Answer of the fast path."""
+    intent: str
+    arguments: Dict[str, Any]
+    response: str
+    similarity: float
+    time: float
+
+
+@dataclass
+class RouterStats:
+    """Decisions of the router and their latencies in seconds."""
+    fast_path_times: List[float] = field(default_factory=list)
+    # time spent on classification of messages that went to the agent anyway
+    fallback_times: List[float] = field(default_factory=list)
+
+    def summary(self) -> str:
+        total = len(self.fast_path_times) + len(self.fallback_times)
+        if total == 0:
+            return ""
+        fast_path_ms = np.mean(self.fast_path_times) * 1000 if self.fast_path_times else 0.0
+        fallback_ms = np.mean(self.fallback_times) * 1000 if self.fallback_times else 0.0
+        return (f"Router: {len(self.fast_path_times)}/{total} messages on the fast path ({fast_path_ms:.0f} ms on average), "
+                f"{fallback_ms:.0f} ms routing overhead per message sent to the agent")
+
+
+class IntentRouter:
+    """
+    Answers messages with a high-confidence structured intent (e.g. view the cart) by calling the tool directly,
+    without the agent's reasoning loop. The message is classified by the embedding similarity to the tool
+    descriptions and example messages of every intent. Everything else goes to the agent: low similarity,
+    a close second intent, missing arguments, a negation or more than one request in the message.
+
+    Args:
+        embed_model: Model to embed the messages with
+        intents: The intents to route
+        threshold: Minimum similarity of the message to the intent
+        margin: Minimum difference between the similarity to the best and the second best intent
+    """
+
+    def __init__(self, embed_model: BaseEmbedding, intents: List[Intent], threshold: float = 0.85, margin: float = 0.05):
+        self.embed_model = embed_model
+        self.intents = intents
+        self.threshold = threshold
+        self.margin = margin
+        self.stats = RouterStats()
+
+        texts = []
+        self._intent_indices = []
+        for i, intent in enumerate(intents):
+            for text in [intent.tool.metadata.description.strip(), *intent.examples]:
+                texts.append(text)
+                self._intent_indices.append(i)
+        self._intent_indices = np.array(self._intent_indices)
+        self._embeddings = self._normalize(np.array(embed_model.get_text_embedding_batch(texts)))
+
+    @staticmethod
+    def _normalize(embeddings: np.ndarray) -> np.ndarray:
+        return embeddings / np.clip(np.linalg.norm(embeddings, axis=-1, keepdims=True), 1e-12, None)
+
+    @staticmethod
+    def _is_single_request(message: str) -> bool:
+        # e.g. "how many gallons do I need? Add them to my cart" needs the agent to chain the tools
+        message = message.lower().replace("sq. ft", "sq ft")
+        parts = [part for part in re.split(r"[.?!;]+(?=\s|$)|\b(?:and|then|also)\b", message) if part.strip()]
+        return len(parts) == 1
+
+    @staticmethod
+    def _has_negation(message: str) -> bool:
+        # e.g. "don't show my cart" is close to "show my cart" in the embedding space
+        return re.search(r"\b(?:not|no|never|cannot|without)\b|n't\b|\bdont\b", message.lower().replace("’", "'")) is not None
+
+    def route(self, message: str) -> Optional[RoutedResponse]:
+        """
+        Answers the message on the fast path
+
+        Args:
+            message: The user message
+
+        Returns:
+            The answer, or None if the message should go to the agent
+        """
+        start_time = time.perf_counter()
+        response = self._route(message, start_time)
+        if response is None:
+            self.stats.fallback_times.append(time.perf_counter() - start_time)
+        else:
+            self.stats.fast_path_times.append(response.time)
+        return response
+
+    def _route(self, message: str, start_time: float) -> Optional[RoutedResponse]:
+        if not self._is_single_request(message) or self._has_negation(message):
+            return None
+
+        embedding = self._normalize(np.array(self.embed_model.get_text_embedding(message)))
+        similarities = self._embeddings @ embedding
+        # similarity of the message to every intent is the best one of its texts
+        intent_similarities = np.full(len(self.intents), -1.0)
+        np.maximum.at(intent_similarities, self._intent_indices, similarities)
+
+        best, second = np.argsort(intent_similarities)[::-1][:2] if len(self.intents) > 1 else (0, None)
+        if intent_similarities[best] < self.threshold:
+            return None
+        if second is not None and intent_similarities[best] - intent_similarities[second] < self.margin:
+            return None
+
+        intent = self.intents[best]
+        arguments = intent.parse_arguments(message)
+        if arguments is None:
+            return None
+
+        output = intent.tool.call(**arguments).raw_output
+        return RoutedResponse(intent=intent.tool.metadata.name, arguments=arguments, response=intent.format_response(output, arguments),
+                              similarity=float(intent_similarities[best]), time=time.perf_counter() - start_time)
@@ -0,0 +1,129 @@
+import argparse
+import gc
+import time
+from pathlib import Path
+from typing import List
+
+from llama_index.core.agent import ReActChatFormatter
+from llama_index.core.agent.react.types import ActionReasoningStep, BaseReasoningStep, ObservationReasoningStep
+from llama_index.core.llms import ChatMessage, MessageRole
+from llama_index.core.tools import FunctionTool
+from transformers import AutoTokenizer
+
+import app
+from system_prompt import react_system_header_str
+
+# (user message, tool calls of the agent as (tool, input, observation), final answer)
+CONVERSATION = [
+    ("what paint is the best for kitchens?",
+     [("vector_search", {"input": "best paint for kitchens"},
+       "For kitchens we recommend AwesomePainter Interior Acrylic Latex in semi-gloss finish. It resists moisture, grease and "
+       "stains, it's easy to wipe clean and it dries in 2 hours. It costs $34.99 per gallon and covers up to 400 sq ft.")],
+     "The best paint for kitchens is AwesomePainter Interior Acrylic Latex in semi-gloss finish. Would you like to add it to your cart? 🎨"),
+    ("how many gallons of paint do I need to cover 600 sq ft? Add them to my cart.",
+     [("calculate_paint_gallons", {"area": 600}, "3"),
+      ("add_to_cart", {"product_name": "AwesomePainter Interior Acrylic Latex", "quantity": 3, "price_per_unit": 34.99},
+       "{'message': 'Added 3 x AwesomePainter Interior Acrylic Latex to cart', 'cart': [{'product_name': 'AwesomePainter Interior "
+       "Acrylic Latex', 'quantity': 3, 'price_per_unit': 34.99, 'total_price': 104.97}]}"),
+      ("view_cart", {}, "[{'product_name': 'AwesomePainter Interior Acrylic Latex', 'quantity': 3, 'price_per_unit': 34.99, 'total_price': 104.97}]")],
+     "You need 3 gallons and I added them to your cart, the total is $104.97. Do you need brushes or rollers too? 🖌️"),
+]
+
+
+def build_prompts(llm: app.OpenVINOGenAILLM) -> List[List[str]]:
+    """
+    Builds the prompts the agent sends to the LLM in every iteration of the sample conversation
+
+    Args:
+        llm: The LLM formatting chat messages to the prompt
+
+    Returns:
+        Prompts of every iteration, per turn
+    """
+    tools = list(app.setup_tools()) + [FunctionTool.from_defaults(fn=lambda input: "", tool_metadata=app.VECTOR_SEARCH_METADATA)]
+    formatter = ReActChatFormatter.from_defaults(system_header=react_system_header_str, observation_role=MessageRole.TOOL)
+
+    turns = []
+    chat_history = []
+    for user_message, tool_calls, answer in CONVERSATION:
+        chat_history.append(ChatMessage(role=MessageRole.USER, content=user_message))
+        reasoning: List[BaseReasoningStep] = []
+        prompts = []
+        # one LLM call per tool call and the last one for the answer
+        for i in range(len(tool_calls) + 1):
+            prompts.append(llm.messages_to_prompt(formatter.format(tools, chat_history, current_reasoning=reasoning)))
+            if i < len(tool_calls):
+                tool, tool_input, observation = tool_calls[i]
+                reasoning += [ActionReasoningStep(thought=f"I need to use the {tool} tool.", action=tool, action_input=tool_input),
+                              ObservationReasoningStep(observation=observation)]
+        chat_history.append(ChatMessage(role=MessageRole.ASSISTANT, content=answer))
+        turns.append(prompts)
+    return turns
+
+
+def measure_ttft(llm: app.OpenVINOGenAILLM, turns: List[List[str]]) -> List[List[float]]:
+    """
+    Measures the time to first token of every prompt, in the order the agent sends them
+
+    Args:
+        llm: The LLM to measure
+        turns: Prompts of every iteration, per turn
+
+    Returns:
+        Time to first token in seconds of every prompt, per turn
+    """
+    # only the first token is needed
+    llm.config.max_new_tokens = 1
+    # compile and warm up on a prompt unrelated to the agent's ones
+    llm.complete("Hello", formatted=True)
+
+    times = []
+    for prompts in turns:
+        turn_times = []
+        for prompt in prompts:
+            start_time = time.perf_counter()
+            llm.complete(prompt, formatted=True)
+            turn_times.append(time.perf_counter() - start_time)
+        times.append(turn_times)
+    return times
+
+
+def run_benchmark(chat_model: Path, device: str) -> None:
+    """
+    Compares time to first token of every agent iteration with and without prefix caching
+
+    Args:
+        chat_model: Path to the LLM chat model
+        device: Target device for inference
+    """
+    tokenizer = AutoTokenizer.from_pretrained(chat_model)
+
+    llm = app.setup_llm(chat_model, device, prefix_caching=False)
+    turns = build_prompts(llm)
+    without_cache = measure_ttft(llm, turns)
+    # free the memory before loading the second pipeline
+    del llm
+    gc.collect()
+
+    llm = app.setup_llm(chat_model, device, prefix_caching=True)
+    with_cache = measure_ttft(llm, turns)
+
+    print(f"{'turn':>4} {'iteration':>9} {'prompt tokens':>13} {'TTFT no cache [ms]':>18} {'TTFT prefix cache [ms]':>22} {'reduction':>9}")
+    for turn, prompts in enumerate(turns):
+        for iteration, prompt in enumerate(prompts):
+            tokens = len(tokenizer.encode(prompt, add_special_tokens=False))
+            before, after = without_cache[turn][iteration], with_cache[turn][iteration]
+            print(f"{turn + 1:>4} {iteration + 1:>9} {tokens:>13} {before * 1000:>18.1f} {after * 1000:>22.1f} {1 - after / before:>9.0%}")
+
+    total_before = sum(map(sum, without_cache))
+    total_after = sum(map(sum, with_cache))
+    print(f"Total prefill time: {total_before:.2f}s without cache, {total_after:.2f}s with prefix cache ({1 - total_after / total_before:.0%} less)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--chat_model", type=str, default="model/qwen2-7B-INT4", help="Path to the chat model directory")
+    parser.add_argument("--device", type=str, default="GPU", help="Device for inferencing (CPU,GPU,GPU.1)")
+
+    args = parser.parse_args()
+    run_benchmark(Path(args.chat_model), args.device)
@@ -0,0 +1,225 @@
+import json
+import threading
+import time
+import uuid
+from dataclasses import dataclass, field, fields
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import numpy as np
+from llama_index.core.base.embeddings.base import BaseEmbedding
+
+
+@dataclass
+class CachedAnswer:
+    """
+    Answer to a question about one document, with the file of its voice response if it was spoken
+    """
+    key: str
+    question: str
+    answer: str
+    document_hash: str
+    created: float
+    last_used: float
+    hits: int = 0
+    audio_path: Optional[Path] = field(default=None, repr=False)
+
+
+@dataclass
+class CacheStats:
+    """
+    Lookups of the cache and their latencies in seconds
+    """
+    hits: int = 0
+    misses: int = 0
+    lookup_times: List[float] = field(default_factory=list)
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def summary(self) -> str:
+        lookup_ms = np.mean(self.lookup_times) * 1000 if self.lookup_times else 0.0
+        return (f"Answer cache: {self.hits}/{self.hits + self.misses} hits ({self.hit_rate:.0%} hit rate), "
+                f"{lookup_ms:.0f} ms per lookup")
+
+
+class AnswerCache:
+    """
+    Semantic cache of the chatbot's answers. A question is answered from the cache if it's similar enough
+    to a question asked before about the same document, so repeated questions skip retrieval and the LLM.
+    Entries expire after the time to live and the least recently used ones are evicted when the cache is full.
+    The cache is saved to disk, so it survives restarts. The voice responses stay on disk and are loaded only on a hit
+
+    Params:
+        embed_model: model embedding the questions
+        embedding_model_name: name of the embedding model, the cache of another model isn't loaded
+        cache_dir: dir the cache is saved to
+        threshold: minimum cosine similarity of the questions
+        ttl: time to live of an entry in seconds
+        max_entries: maximum number of entries
+    """
+
+    def __init__(self, embed_model: BaseEmbedding, embedding_model_name: str, cache_dir: Path, threshold: float = 0.95, ttl: float = 24 * 3600,
+                 max_entries: int = 1000):
+        self.embed_model = embed_model
+        self.embedding_model_name = embedding_model_name
+        self.cache_dir = cache_dir
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.stats = CacheStats()
+
+        self.entries: Dict[str, CachedAnswer] = {}
+        self.embeddings: Dict[str, np.ndarray] = {}
+        self._lock = threading.Lock()
+        self._load()
+
+    def embed(self, question: str) -> np.ndarray:
+        """
+        Embed the question
+
+        Params:
+            question: the user's question
+        Returns:
+            Normalized embedding of the question
+        """
+        embedding = np.array(self.embed_model.get_query_embedding(question), dtype=np.float32)
+        return embedding / max(np.linalg.norm(embedding), 1e-12)
+
+    def lookup(self, embedding: np.ndarray, document_hash: str) -> Optional[CachedAnswer]:
+        """
+        Find the answer to the most similar question about the document
+
+        Params:
+            embedding: normalized embedding of the question
+            document_hash: hash of the loaded document
+        Returns:
+            The cached answer or None if no question is similar enough
+        """
+        start_time = time.perf_counter()
+        with self._lock:
+            self._remove_expired()
+            keys = [key for key, entry in self.entries.items() if entry.document_hash == document_hash]
+            best = None
+            if keys:
+                similarities = np.stack([self.embeddings[key] for key in keys]) @ embedding
+                if similarities.max() >= self.threshold:
+                    best = self.entries[keys[int(similarities.argmax())]]
+                    best.hits += 1
+                    best.last_used = time.time()
+
+            # usage of the entries is saved with the next change of the cache, not to slow down the hits
+            if best is None:
+                self.stats.misses += 1
+            else:
+                self.stats.hits += 1
+            self.stats.lookup_times.append(time.perf_counter() - start_time)
+            return best
+
+    def add(self, question: str, embedding: np.ndarray, document_hash: str, answer: str, audio: Optional[np.ndarray] = None) -> None:
+        """
+        Cache the answer
+
+        Params:
+            question: the user's question
+            embedding: normalized embedding of the question
+            document_hash: hash of the loaded document
+            answer: the chatbot's answer
+            audio: the voice response, if the answer was spoken
+        """
+        now = time.time()
+        entry = CachedAnswer(key=uuid.uuid4().hex, question=question, answer=answer, document_hash=document_hash, created=now, last_used=now)
+        with self._lock:
+            self.entries[entry.key] = entry
+            self.embeddings[entry.key] = embedding
+            # least recently used entries go first
+            while len(self.entries) > self.max_entries:
+                self._remove(min(self.entries.values(), key=lambda e: e.last_used).key)
+            self._set_audio(entry, audio)
+            self._save_index()
+
+    def load_audio(self, entry: CachedAnswer) -> Optional[np.ndarray]:
+        """
+        Load the voice response of a cached answer
+
+        Params:
+            entry: the cached answer
+        Returns:
+            The voice response or None if the answer was only written or it's been removed in the meantime
+        """
+        with self._lock:
+            if entry.audio_path is None or not entry.audio_path.exists():
+                return None
+            return np.load(entry.audio_path)
+
+    def set_audio(self, entry: CachedAnswer, audio: np.ndarray) -> None:
+        """
+        Cache the voice response of an answer that was cached without it
+
+        Params:
+            entry: the cached answer
+            audio: the voice response
+        """
+        with self._lock:
+            if entry.key in self.entries:
+                self._set_audio(entry, audio)
+                self._save_index()
+
+    def _set_audio(self, entry: CachedAnswer, audio: Optional[np.ndarray]) -> None:
+        if audio is None or len(audio) == 0:
+            return
+        entry.audio_path = self.cache_dir / "audio" / f"{entry.key}.npy"
+        np.save(entry.audio_path, audio)
+
+    def _remove_expired(self) -> None:
+        now = time.time()
+        expired = [key for key, entry in self.entries.items() if now - entry.created > self.ttl]
+        for key in expired:
+            self._remove(key)
+        if expired:
+            self._save_index()
+
+    def _remove(self, key: str) -> None:
+        del self.entries[key]
+        del self.embeddings[key]
+        (self.cache_dir / "audio" / f"{key}.npy").unlink(missing_ok=True)
+
+    def _load(self) -> None:
+        (self.cache_dir / "audio").mkdir(parents=True, exist_ok=True)
+        index_path = self.cache_dir / "answers.json"
+        if not index_path.exists():
+            return
+
+        with open(index_path) as f:
+            index = json.load(f)
+        # the cache of another embedding model can't be used
+        if index["embedding_model"] != self.embedding_model_name:
+            for audio_path in (self.cache_dir / "audio").glob("*.npy"):
+                audio_path.unlink()
+            return
+
+        embeddings = np.load(self.cache_dir / "embeddings.npz")
+        for item in index["entries"]:
+            entry = CachedAnswer(**item)
+            self.entries[entry.key] = entry
+            self.embeddings[entry.key] = embeddings[entry.key]
+            audio_path = self.cache_dir / "audio" / f"{entry.key}.npy"
+            if audio_path.exists():
+                entry.audio_path = audio_path
+        self._remove_expired()
+
+    def _save_index(self) -> None:
+        index = {
+            "embedding_model": self.embedding_model_name,
+            # audio is saved separately
+            "entries": [{f.name: getattr(entry, f.name) for f in fields(entry) if f.name != "audio_path"} for entry in self.entries.values()],
+        }
+        # write to temporary files first, so the cache isn't broken if the app is killed in the meantime
+        with open(self.cache_dir / "embeddings.npz.tmp", "wb") as f:
+            np.savez(f, **self.embeddings)
+        with open(self.cache_dir / "answers.json.tmp", "w") as f:
+            json.dump(index, f)
+        (self.cache_dir / "embeddings.npz.tmp").replace(self.cache_dir / "embeddings.npz")
+        (self.cache_dir / "answers.json.tmp").replace(self.cache_dir / "answers.json")
@@ -1,14 +1,13 @@
 import argparse
+import hashlib
 import logging as log
 import threading
 import time
 from pathlib import Path
-from threading import Thread
-from typing import Tuple, List, Optional, Set
+from typing import Dict, Tuple, List, Optional, Set
 
 import fitz  # PyMuPDF
 import gradio as gr
-import librosa
 import numpy as np
 import openvino as ov
 import torch
@@ -18,32 +17,48 @@ from langchain_text_splitters import RecursiveCharacterTextSplitter
 from llama_index.core import Document, VectorStoreIndex, Settings
 from llama_index.core.chat_engine import SimpleChatEngine
 from llama_index.core.chat_engine.types import BaseChatEngine, ChatMode
+from llama_index.core.llms import ChatMessage, MessageRole
 from llama_index.core.memory import ChatMemoryBuffer
 from llama_index.core.node_parser import LangchainNodeParser
 from llama_index.embeddings.huggingface_openvino import OpenVINOEmbedding
 from llama_index.llms.openvino import OpenVINOLLM
-from llama_index.postprocessor.openvino_rerank import OpenVINORerank
 from optimum.intel import OVModelForSpeechSeq2Seq
-from transformers import AutoProcessor, TextIteratorStreamer
+from transformers import AutoProcessor
 from melo.api import TTS
 
+from answer_cache import AnswerCache
+from audio_frontend import WhisperFrontend
+from speech_streaming import SpeechStreamer
+from streaming_asr import StreamingTranscriber
+from two_stage_rerank import TwoStageOpenVINORerank
+
 # Global variables initialization
-TARGET_AUDIO_SAMPLE_RATE = 16000
 TARGET_AUDIO_SAMPLE_RATE_TTS = 44100
 
 MODEL_DIR = Path("model")
+# passages retrieved for every question, the reranker picks the best 3 of them
+RETRIEVED_PASSAGES = 10
 inference_lock = threading.Lock()
+asr_lock = threading.Lock()
 
 # Initialize Model variables
 asr_model: Optional[OVModelForSpeechSeq2Seq] = None
 asr_processor: Optional[AutoProcessor] = None
+asr_frontend: Optional[WhisperFrontend] = None
 ov_llm: Optional[OpenVINOLLM] = None
 ov_embedding: Optional[OpenVINOEmbedding] = None
-ov_reranker: Optional[OpenVINORerank] = None
+ov_reranker: Optional[TwoStageOpenVINORerank] = None
 ov_chat_engine: Optional[BaseChatEngine] = None
 ov_tts_model: Optional[torch.Tensor] = None
+answer_cache: Optional[AnswerCache] = None
+# hash of the loaded document, cached answers are valid only for it
+document_hash: Optional[str] = None
 
 chatbot_config = {}
+# transcribers of the voice inputs being recorded, per session
+transcribers: Dict[str, StreamingTranscriber] = {}
+# ASR time of the last voice input, per session, the time to first audio is counted from the end of speech
+asr_times: Dict[str, float] = {}
 
 
 def get_available_devices() -> Set[str]:
@@ -64,7 +79,7 @@ def load_asr_model(model_dir: Path) -> None:
     Params:
         model_dir: dir with the ASR model
     """
-    global asr_model, asr_processor
+    global asr_model, asr_processor, asr_frontend
 
     if not model_dir.exists():
         log.error(f"Cannot find {model_dir}. Did you run convert_and_optimize_asr.py first?")
@@ -74,6 +89,8 @@ def load_asr_model(model_dir: Path) -> None:
     # create a distil-whisper model and its processor
     asr_model = OVModelForSpeechSeq2Seq.from_pretrained(model_dir, device=device)
     asr_processor = AutoProcessor.from_pretrained(model_dir)
+    # resampling and input features without the processor's overhead
+    asr_frontend = WhisperFrontend(asr_processor.feature_extractor)
 
     model_name = model_dir.name
     log.info(f"Running {model_name} on {','.join(asr_model.encoder.request.get_property('EXECUTION_DEVICES'))}")
@@ -116,9 +133,9 @@ def load_embedding_model(model_dir: Path) -> Optional[OpenVINOEmbedding]:
     return OpenVINOEmbedding(str(model_dir), device=device, embed_batch_size=1, model_kwargs={"dynamic_shapes": False})
 
 
-def load_reranker_model(model_dir: Path) -> Optional[OpenVINORerank]:
+def load_reranker_model(model_dir: Path) -> Optional[TwoStageOpenVINORerank]:
     """
-    Load embedding model
+    Load reranker model
 
     Params:
         model_dir: dir with the reranker model
@@ -130,7 +147,7 @@ def load_reranker_model(model_dir: Path) -> Optional[OpenVINORerank]:
         return None
 
     # load reranker model in the format of Llama Index
-    return OpenVINORerank(model_id_or_path=str(model_dir), device="AUTO:CPU", top_n=3)
+    return TwoStageOpenVINORerank(model_id_or_path=str(model_dir), device="AUTO:CPU", top_n=3, max_candidates=RETRIEVED_PASSAGES)
 
 
 def load_rag_models(chat_model_dir: Path, embedding_model_dir: Path, reranker_model_dir: Path, personality_file_path: Path) -> None:
@@ -217,13 +234,14 @@ def load_context(file_path: Path) -> None:
     Params:
         file_path: the path to the document
     """
-    global ov_chat_engine
+    global ov_chat_engine, document_hash
 
     # Create memory buffer for chat history
     memory = ChatMemoryBuffer.from_defaults()
 
     # if no file is provided, use the default chat engine (not RAG based)
     if not file_path:
+        document_hash = None
         ov_chat_engine = SimpleChatEngine.from_defaults(
             llm=ov_llm,
             system_prompt=chatbot_config["system_configuration"],
@@ -233,6 +251,8 @@ def load_context(file_path: Path) -> None:
 
     # load the document
     document = load_file(file_path)
+    # answers depend on the document and the chatbot's personality
+    document_hash = hashlib.sha256(Path(file_path).read_bytes() + chatbot_config["system_configuration"].encode()).hexdigest()
 
     # create a splitter to split the document into chunks
     splitter = LangchainNodeParser(RecursiveCharacterTextSplitter(chunk_size=500, chunk_overlap=100))
@@ -252,6 +272,7 @@ def load_context(file_path: Path) -> None:
         chat_mode=ChatMode.CONTEXT,
         system_prompt=chatbot_config["system_configuration"],
         memory=memory,
+        similarity_top_k=RETRIEVED_PASSAGES,
         node_postprocessors=[ov_reranker]
     )
 
@@ -265,112 +286,258 @@ def generate_initial_greeting() -> str:
     return ov_chat_engine.chat(chatbot_config["greet_the_user_prompt"]).response
 
 
-def chat(history: List[List[str]]) -> List[List[str]]:
+def synthesize_sentence(sentence: str) -> np.ndarray:
+    """
+    Synthesizes speech from one sentence of the chatbot's response
+
+    Params:
+        sentence: the sentence to speak
+    Returns:
+        Audio of the sentence
+    """
+    # English
+    return ov_tts_model.tts_to_file(sentence, ov_tts_model.hps.data.spk2id['EN-US'], output_path=None, speed=1.0)
+
+
+def chat(history: List[List[str]], voice_input: str, request: gr.Request) -> Tuple[List[List[str]], Optional[Tuple[int, np.ndarray]]]:
     """
-    Chat function. It generates response based on a prompt
+    Chat function. It generates response based on a prompt. If the prompt was spoken, the response is spoken too:
+    every sentence is synthesized as soon as it's generated, while the rest of the response is still generating.
+    Answers to questions opening the conversation are taken from the cache together with their voice response,
+    if they were asked before
 
     Params:
         history: history of the messages (conversation) so far
+        voice_input: transcription of the voice input to check if used
+        request: request of the user's session
     Returns:
-        History with the latest chat's response (yields partial response)
+        History with the latest chat's response and the next chunk of the voice response (yields partial response)
     """
+    question = history[-1][0]
+    start_time = time.time()
+    asr_time = asr_times.pop(request.session_hash, 0.0)
+
+    # answers are cached only for the loaded documents and the questions opening the conversation,
+    # the answers to follow-up questions (e.g. "and on weekends?") depend on the chat history
+    is_first_question = not any(message.role == MessageRole.USER for message in ov_chat_engine.chat_history)
+    query_embedding = None
+    cached_answer = None
+    if answer_cache is not None and document_hash is not None and is_first_question:
+        query_embedding = answer_cache.embed(question)
+        cached_answer = answer_cache.lookup(query_embedding, document_hash)
+
+    if cached_answer is not None:
+        history[-1][1] = cached_answer.answer
+        # keep the chat history complete for the follow-up questions
+        ov_chat_engine._memory.put(ChatMessage(role=MessageRole.USER, content=question))
+        ov_chat_engine._memory.put(ChatMessage(role=MessageRole.ASSISTANT, content=cached_answer.answer))
+        log.info(f"Cached answer response time: {time.time() - start_time:.2f} seconds")
+        log.info(answer_cache.stats.summary())
+
+        # the voice response is cached too, unless the answer was only written before
+        cached_audio = answer_cache.load_audio(cached_answer) if voice_input else None
+        if not voice_input or cached_audio is not None:
+            yield history, (TARGET_AUDIO_SAMPLE_RATE_TTS, cached_audio) if voice_input else gr.skip()
+            return
+
+    # speak only if audio was used in the conversation
+    speech_streamer = SpeechStreamer(synthesize_sentence) if voice_input else None
+    voice_response = []
+
+    def audio_chunks(chunks: List[np.ndarray]):
+        for chunk in chunks:
+            voice_response.append(chunk)
+            yield history, (TARGET_AUDIO_SAMPLE_RATE_TTS, chunk)
+
     # no document is loaded
     if isinstance(ov_chat_engine, SimpleChatEngine):
         history[-1][1] = "No guide is provided, so I cannot answer this question. Please upload the hotel guide."
-        yield history
-        return
+        if speech_streamer:
+            speech_streamer.push(history[-1][1])
+    elif cached_answer is not None:
+        speech_streamer.push(cached_answer.answer)
+        yield history, gr.skip()
+    else:
+        # get token by token and merge to the final response
+        history[-1][1] = ""
+        with inference_lock:
+            start_time = time.time()
+
+            chat_streamer = ov_chat_engine.stream_chat(question).response_gen
+            for partial_text in chat_streamer:
+                history[-1][1] += partial_text
+                if speech_streamer:
+                    speech_streamer.push(partial_text)
+                # "return" partial response
+                yield history, gr.skip()
+                # and sentences synthesized in the meantime
+                if speech_streamer:
+                    yield from audio_chunks(speech_streamer.ready_chunks())
+
+            end_time = time.time()
+
+            # 75 words ~= 100 tokens
+            tokens = len(history[-1][1].split(" ")) * 4 / 3
+            processing_time = end_time - start_time
+            log.info(f"Chat model response time: {processing_time:.2f} seconds ({tokens / processing_time:.2f} tokens/s)")
+
+    if speech_streamer:
+        speech_streamer.finish()
+        yield from audio_chunks(speech_streamer.ready_chunks())
+        yield from audio_chunks(speech_streamer.remaining_chunks())
+
+        log.info(f"TTS model response time: {speech_streamer.synthesis_time:.2f} seconds")
+        if speech_streamer.first_audio_time is not None:
+            log.info(f"Time to first audio: {asr_time + speech_streamer.first_audio_time:.2f} seconds "
+                     f"(ASR {asr_time:.2f} seconds, response to first audio {speech_streamer.first_audio_time:.2f} seconds)")
+    else:
+        yield history, gr.skip()
 
-    # get token by token and merge to the final response
-    history[-1][1] = ""
-    with inference_lock:
-        start_time = time.time()
+    audio = np.concatenate(voice_response) if voice_response else None
+    if cached_answer is not None:
+        answer_cache.set_audio(cached_answer, audio)
+    elif query_embedding is not None:
+        answer_cache.add(question, query_embedding, document_hash, history[-1][1], audio)
+        log.info(answer_cache.stats.summary())
 
-        chat_streamer = ov_chat_engine.stream_chat(history[-1][0]).response_gen
-        for partial_text in chat_streamer:
-            history[-1][1] += partial_text
-            # "return" partial response
-            yield history
 
-        end_time = time.time()
+def transcribe_segment(audio: np.ndarray, sample_rate: int, context: str) -> str:
+    """
+    Transcribe one speech segment of the voice input
+
+    Params:
+        audio: audio of the segment
+        sample_rate: sample rate of the audio
+        context: text spoken before the segment
+    Returns:
+        Text of the segment
+    """
+    # get input features from the audio (resampled to 16000Hz, the whisper model requires it)
+    input_features = torch.from_numpy(asr_frontend(audio, sample_rate)[None])
+    # the previous text helps to keep names and spelling consistent between segments
+    prompt_ids = asr_processor.get_prompt_ids(context, return_tensors="pt") if context else None
 
-        # 75 words ~= 100 tokens
-        tokens = len(history[-1][1].split(" ")) * 4 / 3
-        processing_time = end_time - start_time
-        log.info(f"Chat model response time: {processing_time:.2f} seconds ({tokens / processing_time:.2f} tokens/s)")
+    # the model is shared by all sessions
+    with asr_lock:
+        tokens = asr_model.generate(input_features=input_features, prompt_ids=prompt_ids)
+    text = asr_processor.batch_decode(tokens, skip_special_tokens=True)[0].strip()
+    # the context isn't a part of the segment
+    return text[len(context):] if context and text.startswith(context) else text
 
 
-def transcribe(audio: Tuple[int, np.ndarray], prompt: str, conversation: List[List[str]]) -> List[List[str]]:
+def start_transcription(request: gr.Request) -> gr.Button:
     """
-    Transcribe audio to text
+    Start transcribing a new voice input
 
     Params:
-        audio: audio to transcribe text from
-        conversation: conversation history with the chatbot
+        request: request of the user's session
     Returns:
-        User prompt as a text
+        Submit button, blocked while recording
     """
-    # if audio is available, use audio, otherwise, use given text
-    if audio:
-        start_time = time.time()  # Start time for ASR process
+    drop_transcriber(request)
+    transcribers[request.session_hash] = StreamingTranscriber(transcribe_segment)
+    return gr.Button(interactive=False)
 
-        sample_rate, audio = audio
-        # the whisper model requires 16000Hz, not 44100Hz
-        audio = librosa.resample(audio.astype(np.float32), orig_sr=sample_rate, target_sr=TARGET_AUDIO_SAMPLE_RATE)\
-            .astype(np.int16)
 
-        # get input features from the audio
-        input_features = asr_processor(audio, sampling_rate=TARGET_AUDIO_SAMPLE_RATE, return_tensors="pt").input_features
+def stream_transcription(audio: Optional[Tuple[int, np.ndarray]], request: gr.Request) -> str:
+    """
+    Transcribe the voice input while the user is speaking
 
-        # use streamer to show transcription word by word
-        text_streamer = TextIteratorStreamer(asr_processor, skip_prompt=True, skip_special_tokens=True)
+    Params:
+        audio: the next chunk of the microphone audio
+        request: request of the user's session
+    Returns:
+        Transcription so far
+    """
+    transcriber = transcribers.get(request.session_hash)
+    # chunks coming after the recording stopped
+    if transcriber is None:
+        return gr.skip()
 
-        # transcribe in the background to deliver response token by token
-        thread = Thread(target=asr_model.generate, kwargs={"input_features": input_features, "streamer": text_streamer})
-        thread.start()
+    if audio is not None:
+        transcriber.push(*audio)
+    return transcriber.text
 
-        conversation.append(["", None])
-        # get token by token and merge to the final response
-        for partial_text in text_streamer:
-            conversation[-1][0] += partial_text
-            # "return" partial response
-            yield conversation
 
-        end_time = time.time()  # End time for ASR process
-        log.info(f"ASR model response time: {end_time - start_time:.2f} seconds")  # Print the ASR processing time
+def finish_transcription(request: gr.Request) -> str:
+    """
+    Transcribe the rest of the voice input after the recording stopped
 
-        # wait for the thread
-        thread.join()
-    else:
-        conversation.append([prompt, None])
-        yield conversation
+    Params:
+        request: request of the user's session
+    Returns:
+        User prompt as a text
+    """
+    transcriber = transcribers.pop(request.session_hash, None)
+    if transcriber is None:
+        return ""
 
-    return conversation
+    text = transcriber.finish()
+    asr_times[request.session_hash] = transcriber.latency
+    # most of the speech was transcribed during the recording, only the last segment is left
+    log.info(f"ASR model response time: {transcriber.latency:.2f} seconds after the end of speech")
+    return text
 
 
-def synthesize(conversation: List[List[str]], audio: Tuple[int, np.ndarray]) -> Optional[Tuple[int, np.ndarray]]:
+def drop_transcriber(request: gr.Request) -> None:
     """
-    Synthesizes speech from chatbot's response
+    Stop transcribing the session's voice input, when the prompt is submitted or a new one is recorded
 
     Params:
-        conversation: conversation history with the chatbot
-        audio: audio widget to check if used
+        request: request of the user's session
+    """
+    transcriber = transcribers.pop(request.session_hash, None)
+    if transcriber is not None:
+        transcriber.finish()
+
+
+def close_session(request: gr.Request) -> None:
+    """
+    Release the resources of the session, when the user leaves
+
+    Params:
+        request: request of the user's session
+    """
+    drop_transcriber(request)
+    asr_times.pop(request.session_hash, None)
+
+
+def update_submit_button(voice_input: str, prompt: str, request: gr.Request) -> gr.Button:
+    """
+    Allow submitting either the voice or the text input
+
+    Params:
+        voice_input: transcription of the voice input
+        prompt: text input
+        request: request of the user's session
     Returns:
-        Chatbot voice response (audio)
+        Submit button, blocked while the voice input is being recorded
     """
-    # if audio wasn't used in the conversation, return None
-    if not audio:
-        return None
+    recording = request.session_hash in transcribers
+    return gr.Button(interactive=not recording and bool(voice_input) ^ bool(prompt))
 
-    prompt = conversation[-1][1]
 
-    start_time = time.time()
-    # English
-    speech = ov_tts_model.tts_to_file(prompt, ov_tts_model.hps.data.spk2id['EN-US'], output_path=None, speed=1.0)
-    end_time = time.time()
+def reset_conversation() -> None:
+    """
+    Clear the chat history, so the next question starts a new conversation
+    """
+    ov_chat_engine.reset()
 
-    log.info(f"TTS model response time: {end_time - start_time:.2f} seconds")
 
-    return TARGET_AUDIO_SAMPLE_RATE_TTS, speech
+def add_user_prompt(voice_input: str, prompt: str, conversation: List[List[str]]) -> List[List[str]]:
+    """
+    Add the user prompt to the conversation
+
+    Params:
+        voice_input: transcription of the voice input
+        prompt: text input
+        conversation: conversation history with the chatbot
+    Returns:
+        Conversation with the user prompt
+    """
+    # if voice input is available, use it, otherwise, use given text
+    conversation.append([voice_input or prompt, None])
+    return conversation
 
 
 def create_UI(initial_message: str, example_pdf_path: Path) -> gr.Blocks:
@@ -391,8 +558,9 @@ def create_UI(initial_message: str, example_pdf_path: Path) -> gr.Blocks:
                 chatbot_ui = gr.Chatbot(value=[[None, initial_message]], label="Chatbot")
                 with gr.Tab(label="Voice"):
                     with gr.Row():
-                        input_audio_ui = gr.Audio(sources=["microphone"], label="Your voice input")
-                        output_audio_ui = gr.Audio(label="Chatbot voice response", autoplay=True)
+                        input_audio_ui = gr.Audio(sources=["microphone"], label="Your voice input", streaming=True)
+                        output_audio_ui = gr.Audio(label="Chatbot voice response", autoplay=True, streaming=True)
+                    voice_input_ui = gr.Textbox(label="Your voice input transcription", interactive=False)
                 with gr.Tab(label="Text"):
                     input_text_ui = gr.Textbox(label="Your text input")
                 with gr.Row():
@@ -400,31 +568,39 @@ def create_UI(initial_message: str, example_pdf_path: Path) -> gr.Blocks:
                     submit_btn = gr.Button("Submit", variant="primary", interactive=False)
 
         # events
-        # block submit button when no audio or text input
-        gr.on(triggers=[input_audio_ui.change, input_text_ui.change], inputs=[input_audio_ui, input_text_ui], outputs=submit_btn,
-              fn=lambda x, y: gr.Button(interactive=True) if bool(x) ^ bool(y) else gr.Button(interactive=False))
+        # transcribe the voice input while recording, the rest of it when the recording stops
+        input_audio_ui.stream(stream_transcription, inputs=input_audio_ui, outputs=voice_input_ui, stream_every=0.5)
+        # block submit button while recording and when no voice or text input
+        input_audio_ui.start_recording(start_transcription, outputs=submit_btn)
+        input_audio_ui.stop_recording(finish_transcription, outputs=voice_input_ui) \
+            .then(update_submit_button, inputs=[voice_input_ui, input_text_ui], outputs=submit_btn)
+        input_text_ui.change(update_submit_button, inputs=[voice_input_ui, input_text_ui], outputs=submit_btn)
 
         file_uploader_ui.change(lambda: [[None, initial_message]], outputs=chatbot_ui) \
             .then(load_context, inputs=file_uploader_ui)
 
         clear_btn.click(lambda: [[None, initial_message]], outputs=chatbot_ui) \
+            .then(reset_conversation) \
             .then(lambda: gr.Button(interactive=False), outputs=clear_btn)
 
-        # block buttons, clear output audio, do the transcription and conversation, clear input audio, unblock buttons
+        # block buttons, clear output audio, do the conversation, clear voice input, unblock buttons
         gr.on(triggers=[submit_btn.click, input_text_ui.submit], fn=lambda: gr.Button(interactive=False), outputs=submit_btn) \
             .then(lambda: gr.Button(interactive=False), outputs=clear_btn) \
             .then(lambda: None, outputs=output_audio_ui) \
-            .then(transcribe, inputs=[input_audio_ui, input_text_ui, chatbot_ui], outputs=chatbot_ui) \
+            .then(add_user_prompt, inputs=[voice_input_ui, input_text_ui, chatbot_ui], outputs=chatbot_ui) \
+            .then(drop_transcriber) \
             .then(lambda: None, outputs=input_text_ui) \
-            .then(chat, chatbot_ui, chatbot_ui) \
-            .then(synthesize, inputs=[chatbot_ui, input_audio_ui], outputs=output_audio_ui) \
-            .then(lambda: None, outputs=input_audio_ui) \
+            .then(chat, inputs=[chatbot_ui, voice_input_ui], outputs=[chatbot_ui, output_audio_ui]) \
+            .then(lambda: (None, None), outputs=[input_audio_ui, voice_input_ui]) \
             .then(lambda: gr.Button(interactive=True), outputs=clear_btn)
 
+        demo.unload(close_session)
+
         return demo
 
 
-def run(asr_model_dir: Path, chat_model_dir: Path, embedding_model_dir: Path, reranker_model_dir: Path, personality_file_path: Path, example_pdf_path: Path, public_interface: bool = False) -> None:
+def run(asr_model_dir: Path, chat_model_dir: Path, embedding_model_dir: Path, reranker_model_dir: Path, personality_file_path: Path, example_pdf_path: Path, public_interface: bool = False,
+        answer_cache_dir: Optional[Path] = Path("cache/answers"), answer_cache_threshold: float = 0.95, answer_cache_ttl: float = 24) -> None:
     """
     Run the chatbot application
 
@@ -438,7 +614,12 @@ def run(asr_model_dir: Path, chat_model_dir: Path, embedding_model_dir: Path, re
         personality_file_path: path to the chatbot personality specification file
         example_pdf_path: path to the pdf file
         public_interface: whether UI should be available publicly
+        answer_cache_dir: dir of the answer cache, None disables the cache
+        answer_cache_threshold: minimum similarity of a question to a cached one
+        answer_cache_ttl: time to live of the cached answers in hours
     """
+    global answer_cache
+
     # set up logging
     log.getLogger().setLevel(log.INFO)
 
@@ -453,6 +634,11 @@ def run(asr_model_dir: Path, chat_model_dir: Path, embedding_model_dir: Path, re
         log.error("Required models are not loaded. Exiting...")
         return
 
+    # answers to the repeated questions
+    if answer_cache_dir is not None:
+        answer_cache = AnswerCache(ov_embedding, embedding_model_dir.name, answer_cache_dir, answer_cache_threshold, answer_cache_ttl * 3600)
+        log.info(f"Answer cache with {len(answer_cache.entries)} answers loaded from {answer_cache_dir}")
+
     # get initial greeting
     initial_message = generate_initial_greeting()
 
@@ -476,7 +662,12 @@ if __name__ == "__main__":
     parser.add_argument("--personality", type=str, default="config/concierge_personality.yaml", help="Path to the YAML file with chatbot personality")
     parser.add_argument("--example_pdf", type=str, default="data/Grand_Azure_Resort_Spa_Full_Guide.pdf", help="Path to the PDF file which is an additional context")
     parser.add_argument("--public", default=False, action="store_true", help="Whether interface should be available publicly")
+    parser.add_argument("--answer_cache_dir", type=str, default="cache/answers", help="Path to the directory of the answer cache")
+    parser.add_argument("--answer_cache_threshold", type=float, default=0.95, help="Minimum similarity of a question to a cached one to use the cached answer")
+    parser.add_argument("--answer_cache_ttl", type=float, default=24, help="Time to live of the cached answers in hours")
+    parser.add_argument("--no_answer_cache", default=False, action="store_true", help="Whether to generate every answer")
 
     args = parser.parse_args()
-    run(Path(args.asr_model), Path(args.chat_model), Path(args.embedding_model), Path(args.reranker_model), Path(args.personality), Path(args.example_pdf), args.public)
+    run(Path(args.asr_model), Path(args.chat_model), Path(args.embedding_model), Path(args.reranker_model), Path(args.personality), Path(args.example_pdf), args.public,
+        None if args.no_answer_cache else Path(args.answer_cache_dir), args.answer_cache_threshold, args.answer_cache_ttl)
     
@@ -0,0 +1,92 @@
+import argparse
+import time
+from pathlib import Path
+from typing import Callable, List
+
+import librosa
+import numpy as np
+from transformers import AutoProcessor
+
+from audio_frontend import WhisperFrontend, resample
+
+TARGET_AUDIO_SAMPLE_RATE = 16000
+
+
+def generate_audio(duration: float, sample_rate: int) -> np.ndarray:
+    """
+    Generate speech-like audio: noise with a syllable-rate envelope
+
+    Params:
+        duration: length of the audio in seconds
+        sample_rate: sample rate of the audio
+    Returns:
+        Mono float32 audio
+    """
+    rng = np.random.default_rng(0)
+    t = np.arange(int(duration * sample_rate)) / sample_rate
+    envelope = np.clip(np.sin(2 * np.pi * 4 * t), 0, None)
+    return (0.1 * envelope * rng.standard_normal(len(t))).astype(np.float32)
+
+
+def measure(fn: Callable[[], object], repeats: int) -> float:
+    """
+    Measure the median execution time
+
+    Params:
+        fn: function to measure
+        repeats: number of measurements
+    Returns:
+        Median time in milliseconds
+    """
+    fn()
+    times = []
+    for _ in range(repeats):
+        start_time = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start_time)
+    return float(np.median(times)) * 1000
+
+
+def run_benchmark(asr_model_dir: Path, durations: List[float], sample_rates: List[int], repeats: int) -> None:
+    """
+    Compare librosa resampling with the processor's feature extraction to the polyphase resampling and the vectorized
+    feature extraction
+
+    Params:
+        asr_model_dir: dir with the ASR model (only its processor is used)
+        durations: lengths of the audio in seconds
+        sample_rates: sample rates of the microphone
+        repeats: number of measurements
+    """
+    processor = AutoProcessor.from_pretrained(asr_model_dir)
+    frontend = WhisperFrontend(processor.feature_extractor)
+
+    print(f"{'sample rate':>11} {'duration [s]':>12} {'librosa + processor [ms]':>24} {'frontend [ms]':>13} {'speedup':>7} {'max feature diff':>16}")
+    for sample_rate in sample_rates:
+        for duration in durations:
+            audio = generate_audio(duration, sample_rate)
+
+            def baseline():
+                resampled = librosa.resample(audio, orig_sr=sample_rate, target_sr=TARGET_AUDIO_SAMPLE_RATE)
+                return processor(resampled, sampling_rate=TARGET_AUDIO_SAMPLE_RATE, return_tensors="pt").input_features
+
+            baseline_time = measure(baseline, repeats)
+            frontend_time = measure(lambda: frontend(audio, sample_rate), repeats)
+
+            # the same resampled audio must give the same features
+            expected = processor(resample(audio, sample_rate, TARGET_AUDIO_SAMPLE_RATE), sampling_rate=TARGET_AUDIO_SAMPLE_RATE,
+                                 return_tensors="np").input_features[0]
+            difference = np.abs(frontend(audio, sample_rate) - expected).max()
+
+            print(f"{sample_rate:>11} {duration:>12.1f} {baseline_time:>24.1f} {frontend_time:>13.1f} {baseline_time / frontend_time:>6.1f}x {difference:>16.2e}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--asr_model_dir", type=str, default="model/distil-whisper-large-v3-FP16", help="Path to the automatic speech recognition model directory")
+    parser.add_argument("--durations", type=float, nargs="+", default=[2, 5, 10, 30], help="Lengths of the audio in seconds")
+    parser.add_argument("--sample_rates", type=int, nargs="+", default=[44100, 48000], help="Sample rates of the microphone")
+    parser.add_argument("--repeats", type=int, default=20, help="Number of measurements")
+
+    args = parser.parse_args()
+    run_benchmark(Path(args.asr_model_dir), args.durations, args.sample_rates, args.repeats)
@@ -0,0 +1,132 @@
+import queue
+import re
+import threading
+import time
+from typing import Callable, List, Optional
+
+import numpy as np
+
+
+class SentenceSegmenter:
+    """
+    Splits streamed text into sentences as soon as they are complete
+
+    Params:
+        min_length: sentences shorter than this are merged with the next one, so the TTS isn't called for every short phrase
+    """
+
+    SENTENCE_END = re.compile(r"(?<=[.!?;:])\s+|\n+")
+
+    def __init__(self, min_length: int = 20):
+        self.min_length = min_length
+        self.buffer = ""
+
+    def push(self, text: str) -> List[str]:
+        """
+        Add streamed text
+
+        Params:
+            text: new part of the text
+        Returns:
+            Sentences completed by the text
+        """
+        self.buffer += text
+        sentences = []
+        start = 0
+        for match in self.SENTENCE_END.finditer(self.buffer):
+            sentence = self.buffer[start:match.start()].strip()
+            if len(sentence) >= self.min_length:
+                sentences.append(sentence)
+                start = match.end()
+        self.buffer = self.buffer[start:]
+        return sentences
+
+    def flush(self) -> List[str]:
+        """
+        Returns:
+            The rest of the text as the last sentence
+        """
+        sentence, self.buffer = self.buffer.strip(), ""
+        return [sentence] if sentence else []
+
+
+class SpeechStreamer:
+    """
+    Synthesizes sentences on a worker thread while the text is still being generated. Audio of every sentence
+    is available as soon as it's synthesized, in the order of the sentences.
+
+    Params:
+        synthesize: function converting a sentence to audio
+        min_sentence_length: sentences shorter than this are merged with the next one
+    """
+
+    def __init__(self, synthesize: Callable[[str], np.ndarray], min_sentence_length: int = 20):
+        self.synthesize = synthesize
+        self.segmenter = SentenceSegmenter(min_sentence_length)
+        self.sentences = queue.Queue()
+        self.audio_chunks = queue.Queue()
+
+        self.start_time = time.time()
+        self.first_audio_time: Optional[float] = None
+        self.synthesis_time = 0.0
+
+        self.worker = threading.Thread(target=self._run, daemon=True)
+        self.worker.start()
+
+    def push(self, text: str) -> None:
+        """
+        Add streamed text, completed sentences are queued for synthesis
+
+        Params:
+            text: new part of the text
+        """
+        for sentence in self.segmenter.push(text):
+            self.sentences.put(sentence)
+
+    def finish(self) -> None:
+        """
+        Queue the rest of the text, no more text comes after it
+        """
+        for sentence in self.segmenter.flush():
+            self.sentences.put(sentence)
+        self.sentences.put(None)
+
+    def ready_chunks(self) -> List[np.ndarray]:
+        """
+        Returns:
+            Audio of sentences synthesized since the last call (without waiting)
+        """
+        chunks = []
+        while True:
+            try:
+                chunk = self.audio_chunks.get_nowait()
+            except queue.Empty:
+                return chunks
+            if chunk is None:
+                self.audio_chunks.put(None)
+                return chunks
+            chunks.append(chunk)
+
+    def remaining_chunks(self):
+        """
+        Wait for the synthesis of all sentences (call finish() first)
+
+        Returns:
+            Generator of the audio of the remaining sentences
+        """
+        while (chunk := self.audio_chunks.get()) is not None:
+            yield chunk
+
+    def _run(self) -> None:
+        while (sentence := self.sentences.get()) is not None:
+            start_time = time.time()
+            try:
+                audio = self.synthesize(sentence)
+            except Exception:
+                self.audio_chunks.put(None)
+                raise
+            self.synthesis_time += time.time() - start_time
+            if self.first_audio_time is None:
+                self.first_audio_time = time.time() - self.start_time
+            self.audio_chunks.put(audio)
+        self.audio_chunks.put(None)
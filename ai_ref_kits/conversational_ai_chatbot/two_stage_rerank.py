@@ -0,0 +1,136 @@
+import logging as log
+import threading
+import time
+from collections import OrderedDict, deque
+from typing import Any, List, Optional
+
+import numpy as np
+from llama_index.core.bridge.pydantic import Field, PrivateAttr
+from llama_index.core.schema import NodeWithScore, QueryBundle
+from llama_index.postprocessor.openvino_rerank import OpenVINORerank
+
+
+class TwoStageOpenVINORerank(OpenVINORerank):
+    """
+    Reranker with a cheap first stage. The retrieved passages are prefiltered by their dense retrieval scores:
+    only the ones close to the best score are candidates for the cross-encoder. If there are no more candidates
+    than top_n, the cross-encoder can't change the selection and it's skipped. Otherwise, all (query, passage) pairs
+    are scored in one padded inference, with the passage tokens cached between queries.
+    The latency of every query is logged and the last ones are kept
+
+    Params:
+        max_candidates: maximum number of passages scored by the cross-encoder
+        score_margin: passages with the dense score lower than the best one by more than this aren't candidates
+        max_cached_passages: number of passages with cached tokens
+    """
+
+    max_candidates: int = Field(default=10, description="Maximum number of passages scored by the cross-encoder")
+    score_margin: float = Field(default=0.1, description="Maximum difference between the dense scores of a candidate and the best passage")
+    max_cached_passages: int = Field(default=10000, description="Number of passages with cached tokens")
+
+    _passage_tokens: OrderedDict = PrivateAttr()
+    _latencies: deque = PrivateAttr()
+    _lock: threading.Lock = PrivateAttr()
+
+    def __init__(self, max_candidates: int = 10, score_margin: float = 0.1, max_cached_passages: int = 10000, **kwargs: Any):
+        super().__init__(**kwargs)
+        self.max_candidates = max_candidates
+        self.score_margin = score_margin
+        self.max_cached_passages = max_cached_passages
+
+        self._passage_tokens = OrderedDict()
+        self._latencies = deque(maxlen=100)
+        # the model has only one infer request
+        self._lock = threading.Lock()
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "TwoStageOpenVINORerank"
+
+    @property
+    def latencies(self) -> List[float]:
+        """
+        Returns:
+            Reranking time of the last 100 queries in seconds
+        """
+        return list(self._latencies)
+
+    def select_candidates(self, nodes: List[NodeWithScore]) -> List[NodeWithScore]:
+        """
+        Select the passages for the cross-encoder by the gap between their dense scores and the best one
+
+        Params:
+            nodes: retrieved passages
+        Returns:
+            Candidates, sorted by the dense score
+        """
+        nodes = sorted(nodes, key=lambda node: -(node.score or 0.0))[:self.max_candidates]
+        if nodes[0].score is None:
+            return nodes
+
+        # much less similar passages are unlikely to be relevant, a large gap leaves only a few candidates
+        close_nodes = [node for node in nodes if (node.score or 0.0) >= nodes[0].score - self.score_margin]
+        return nodes[:max(self.top_n, len(close_nodes))]
+
+    def _postprocess_nodes(self, nodes: List[NodeWithScore], query_bundle: Optional[QueryBundle] = None) -> List[NodeWithScore]:
+        if query_bundle is None:
+            raise ValueError("Missing query bundle in extra info.")
+        if not nodes:
+            return []
+
+        start_time = time.perf_counter()
+        candidates = self.select_candidates(nodes)
+        if len(candidates) <= self.top_n:
+            # the cross-encoder would only change the order
+            reranked_nodes = candidates
+        else:
+            with self._lock:
+                scores = self._score(query_bundle.query_str, candidates)
+            for node, score in zip(candidates, scores):
+                if self.keep_retrieval_score:
+                    node.node.metadata["retrieval_score"] = node.score
+                node.score = float(score)
+            reranked_nodes = sorted(candidates, key=lambda node: -node.score)[:self.top_n]
+
+        latency = time.perf_counter() - start_time
+        self._latencies.append(latency)
+        stage = f"{len(candidates)} of {len(nodes)} passages reranked" if len(candidates) > self.top_n else "cross-encoder skipped"
+        log.info(f"Reranker response time: {latency * 1000:.0f} ms ({stage})")
+        return reranked_nodes
+
+    def _encode_passage(self, node: NodeWithScore) -> List[int]:
+        key = node.node.hash
+        if key in self._passage_tokens:
+            self._passage_tokens.move_to_end(key)
+        else:
+            self._passage_tokens[key] = self._tokenizer(node.node.get_content(), add_special_tokens=False)["input_ids"]
+            if len(self._passage_tokens) > self.max_cached_passages:
+                self._passage_tokens.popitem(last=False)
+        return self._passage_tokens[key]
+
+    def _score(self, query: str, nodes: List[NodeWithScore]) -> np.ndarray:
+        tokenizer = self._tokenizer
+        max_length = min(tokenizer.model_max_length, 512)
+        query_tokens = tokenizer(query, add_special_tokens=False)["input_ids"][:max_length // 2]
+        # passages are truncated, so the pairs fit into the model
+        passage_length = max_length - len(query_tokens) - tokenizer.num_special_tokens_to_add(pair=True)
+        passages_tokens = [self._encode_passage(node)[:passage_length] for node in nodes]
+
+        # all pairs in one batch padded to the longest one
+        pairs = [tokenizer.build_inputs_with_special_tokens(query_tokens, tokens) for tokens in passages_tokens]
+        input_ids = np.full((len(pairs), max(map(len, pairs))), tokenizer.pad_token_id, dtype=np.int64)
+        attention_mask = np.zeros_like(input_ids)
+        for i, pair in enumerate(pairs):
+            input_ids[i, :len(pair)] = pair
+            attention_mask[i, :len(pair)] = 1
+        inputs = {"input_ids": input_ids, "attention_mask": attention_mask}
+
+        if "token_type_ids" in tokenizer.model_input_names:
+            token_type_ids = np.zeros_like(input_ids)
+            for i, tokens in enumerate(passages_tokens):
+                pair_types = tokenizer.create_token_type_ids_from_sequences(query_tokens, tokens)
+                token_type_ids[i, :len(pair_types)] = pair_types
+            inputs["token_type_ids"] = token_type_ids
+
+        logits = self._model(**inputs, return_dict=True).logits
+        return 1 / (1 + np.exp(-logits[:, 0]))
@@ -1,20 +1,23 @@
 import argparse
 import logging as log
+import threading
 import time
 from pathlib import Path
 from threading import Thread
-from typing import Tuple, List, Optional, Set
+from typing import Dict, Tuple, List, Optional, Set
 
 import gradio as gr
-import librosa
 import numpy as np
 import openvino as ov
+import torch
 from optimum.intel import OVModelForCausalLM, OVModelForSpeechSeq2Seq
 from transformers import AutoConfig, AutoTokenizer, AutoProcessor, PreTrainedTokenizer, TextIteratorStreamer
 from transformers.generation.streamers import BaseStreamer
 
+from audio_frontend import WhisperFrontend
+from streaming_asr import StreamingTranscriber
+
 # Global variables initialization
-TARGET_AUDIO_SAMPLE_RATE = 16000
 SYSTEM_CONFIGURATION = (
     "You are Adrishuo - a helpful, respectful, and honest virtual doctor assistant. "
     "Your role is talking to a patient who just came in."
@@ -45,6 +48,10 @@ chat_model: Optional[OVModelForCausalLM] = None
 chat_tokenizer: Optional[PreTrainedTokenizer] = None
 asr_model: Optional[OVModelForSpeechSeq2Seq] = None
 asr_processor: Optional[AutoProcessor] = None
+asr_frontend: Optional[WhisperFrontend] = None
+asr_lock = threading.Lock()
+# transcribers of the voice inputs being recorded, per session
+transcribers: Dict[str, StreamingTranscriber] = {}
 
 
 def get_available_devices() -> Set[str]:
@@ -65,7 +72,7 @@ def load_asr_model(model_dir: Path) -> None:
     Params:
         model_dir: dir with the ASR model
     """
-    global asr_model, asr_processor
+    global asr_model, asr_processor, asr_frontend
 
     if not model_dir.exists():
         log.error(f"Cannot find {model_dir}. Did you run convert_and_optimize_asr.py first?")
@@ -75,6 +82,8 @@ def load_asr_model(model_dir: Path) -> None:
     device = "GPU" if "GPU" in get_available_devices() and ov.__version__ < "2024.3" else "CPU"
     asr_model = OVModelForSpeechSeq2Seq.from_pretrained(model_dir, device=device)
     asr_processor = AutoProcessor.from_pretrained(model_dir)
+    # resampling and input features without the processor's overhead
+    asr_frontend = WhisperFrontend(asr_processor.feature_extractor)
 
 
 def load_chat_model(model_dir: Path) -> None:
@@ -190,45 +199,106 @@ def chat(history: List[List[str]]) -> List[List[str]]:
     thread.join()
 
 
-def transcribe(audio: Tuple[int, np.ndarray], conversation: List[List[str]]) -> List[List[str]]:
+def transcribe_segment(audio: np.ndarray, sample_rate: int, context: str) -> str:
     """
-    Transcribe audio to text
+    Transcribe one speech segment of the voice input
 
     Params:
-        audio: audio to transcribe text from
-        conversation: conversation history with the chatbot
+        audio: audio of the segment
+        sample_rate: sample rate of the audio
+        context: text spoken before the segment
     Returns:
-        User prompt as a text
+        Text of the segment
     """
-    start_time = time.time()  # Start time for ASR process
+    # get input features from the audio (resampled to 16000Hz, the whisper model requires it)
+    input_features = torch.from_numpy(asr_frontend(audio, sample_rate)[None])
+    # the previous text helps to keep names and spelling consistent between segments
+    prompt_ids = asr_processor.get_prompt_ids(context, return_tensors="pt") if context else None
 
-    sample_rate, audio = audio
-    # the whisper model requires 16000Hz, not 44100Hz
-    audio = librosa.resample(audio.astype(np.float32), orig_sr=sample_rate, target_sr=TARGET_AUDIO_SAMPLE_RATE).astype(np.int16)
+    # the model is shared by all sessions
+    with asr_lock:
+        tokens = asr_model.generate(input_features=input_features, prompt_ids=prompt_ids)
+    text = asr_processor.batch_decode(tokens, skip_special_tokens=True)[0].strip()
+    # the context isn't a part of the segment
+    return text[len(context):] if context and text.startswith(context) else text
 
-    # get input features from the audio
-    input_features = asr_processor(audio, sampling_rate=TARGET_AUDIO_SAMPLE_RATE, return_tensors="pt").input_features
 
-    # use streamer to show transcription word by word
-    text_streamer = TextIteratorStreamer(asr_processor, skip_prompt=True, skip_special_tokens=True)
+def start_transcription(request: gr.Request) -> gr.Button:
+    """
+    Start transcribing a new voice input
 
-    # transcribe in the background to deliver response token by token
-    thread = Thread(target=asr_model.generate, kwargs={"input_features": input_features, "streamer": text_streamer})
-    thread.start()
+    Params:
+        request: request of the user's session
+    Returns:
+        Submit button, blocked while recording
+    """
+    drop_transcriber(request)
+    transcribers[request.session_hash] = StreamingTranscriber(transcribe_segment)
+    return gr.Button(interactive=False)
 
-    conversation.append(["", None])
-    # get token by token and merge to the final response
-    for partial_text in text_streamer:
-        conversation[-1][0] += partial_text
-        # "return" partial response
-        yield conversation
 
-    end_time = time.time()  # End time for ASR process
-    log.info(f"ASR model response time: {end_time - start_time:.2f} seconds")  # Print the ASR processing time
+def stream_transcription(audio: Optional[Tuple[int, np.ndarray]], request: gr.Request) -> str:
+    """
+    Transcribe the voice input while the user is speaking
 
-    # wait for the thread
-    thread.join()
+    Params:
+        audio: the next chunk of the microphone audio
+        request: request of the user's session
+    Returns:
+        Transcription so far
+    """
+    transcriber = transcribers.get(request.session_hash)
+    # chunks coming after the recording stopped
+    if transcriber is None:
+        return gr.skip()
 
+    if audio is not None:
+        transcriber.push(*audio)
+    return transcriber.text
+
+
+def finish_transcription(request: gr.Request) -> str:
+    """
+    Transcribe the rest of the voice input after the recording stopped
+
+    Params:
+        request: request of the user's session
+    Returns:
+        User prompt as a text
+    """
+    transcriber = transcribers.pop(request.session_hash, None)
+    if transcriber is None:
+        return ""
+
+    text = transcriber.finish()
+    # most of the speech was transcribed during the recording, only the last segment is left
+    log.info(f"ASR model response time: {transcriber.latency:.2f} seconds after the end of speech")
+    return text
+
+
+def drop_transcriber(request: gr.Request) -> None:
+    """
+    Stop transcribing the session's voice input, when the prompt is submitted or the user leaves
+
+    Params:
+        request: request of the user's session
+    """
+    transcriber = transcribers.pop(request.session_hash, None)
+    if transcriber is not None:
+        transcriber.finish()
+
+
+def add_user_prompt(voice_input: str, conversation: List[List[str]]) -> List[List[str]]:
+    """
+    Add the transcribed user prompt to the conversation
+
+    Params:
+        voice_input: transcription of the voice input
+        conversation: conversation history with the chatbot
+    Returns:
+        Conversation with the user prompt
+    """
+    conversation.append([voice_input, None])
     return conversation
 
 
@@ -266,7 +336,9 @@ def create_UI(initial_message: str) -> gr.Blocks:
         """)
         with gr.Row():
             # user's input
-            input_audio_ui = gr.Audio(sources=["microphone"], scale=5, label="Your voice input")
+            with gr.Column(scale=5):
+                input_audio_ui = gr.Audio(sources=["microphone"], label="Your voice input", streaming=True)
+                voice_input_ui = gr.Textbox(label="Your voice input transcription", interactive=False)
             # submit button
             submit_audio_btn = gr.Button("Submit", variant="primary", scale=1, interactive=False)
 
@@ -278,17 +350,24 @@ def create_UI(initial_message: str) -> gr.Blocks:
         summary_ui = gr.Textbox(label="Summary", interactive=False)
 
         # events
-        # block submit button when no audio input
-        input_audio_ui.change(lambda x: gr.Button(interactive=False) if x is None else gr.Button(interactive=True), inputs=input_audio_ui, outputs=submit_audio_btn)
-
-        # block buttons, do the transcription and conversation, clear audio, unblock buttons
+        # transcribe the voice input while recording, the rest of it when the recording stops
+        input_audio_ui.stream(stream_transcription, inputs=input_audio_ui, outputs=voice_input_ui, stream_every=0.5)
+        # block submit button while recording and when no voice input
+        input_audio_ui.start_recording(start_transcription, outputs=submit_audio_btn)
+        input_audio_ui.stop_recording(finish_transcription, outputs=voice_input_ui) \
+            .then(lambda x: gr.Button(interactive=bool(x)), inputs=voice_input_ui, outputs=submit_audio_btn)
+
+        # block buttons, do the conversation, clear voice input, unblock buttons
         submit_audio_btn.click(lambda: gr.Button(interactive=False), outputs=submit_audio_btn) \
             .then(lambda: gr.Button(interactive=False), outputs=summarize_button)\
-            .then(transcribe, inputs=[input_audio_ui, chatbot_ui], outputs=chatbot_ui)\
+            .then(add_user_prompt, inputs=[voice_input_ui, chatbot_ui], outputs=chatbot_ui)\
+            .then(drop_transcriber)\
             .then(chat, chatbot_ui, chatbot_ui)\
-            .then(lambda: None, inputs=[], outputs=[input_audio_ui])\
+            .then(lambda: (None, None), inputs=[], outputs=[input_audio_ui, voice_input_ui])\
             .then(lambda: gr.Button(interactive=True), outputs=summarize_button)
 
+        demo.unload(drop_transcriber)
+
         # block button, do the summarization, unblock button
         summarize_button.click(lambda: gr.Button(interactive=False), outputs=summarize_button) \
             .then(summarize, inputs=chatbot_ui, outputs=summary_ui) \
@@ -0,0 +1,96 @@
+import math
+from functools import lru_cache
+from typing import Tuple
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+from scipy.signal import firwin, resample_poly
+
+
+@lru_cache
+def _resampling_filter(up: int, down: int) -> np.ndarray:
+    # the same anti-aliasing filter resample_poly designs on every call
+    max_rate = max(up, down)
+    return firwin(2 * 10 * max_rate + 1, 1.0 / max_rate, window=("kaiser", 5.0)).astype(np.float32)
+
+
+def get_resampling_ratio(orig_sr: int, target_sr: int) -> Tuple[int, int]:
+    """
+    Integer upsampling and downsampling factors of the resampling
+
+    Params:
+        orig_sr: sample rate of the audio
+        target_sr: required sample rate
+    Returns:
+        Upsampling and downsampling factor (e.g. 1 and 3 for 48kHz -> 16kHz, 160 and 441 for 44.1kHz -> 16kHz)
+    """
+    gcd = math.gcd(orig_sr, target_sr)
+    return target_sr // gcd, orig_sr // gcd
+
+
+def resample(audio: np.ndarray, orig_sr: int, target_sr: int) -> np.ndarray:
+    """
+    Resample audio with an integer-ratio polyphase filter. The filter is designed once per ratio
+
+    Params:
+        audio: mono float audio
+        orig_sr: sample rate of the audio
+        target_sr: required sample rate
+    Returns:
+        Resampled audio
+    """
+    if orig_sr == target_sr:
+        return audio
+    up, down = get_resampling_ratio(orig_sr, target_sr)
+    return resample_poly(audio.astype(np.float32), up, down, window=_resampling_filter(up, down))
+
+
+class WhisperFrontend:
+    """
+    Whisper input features (log-mel spectrogram) computed with a vectorized STFT. The Hann window and the mel filters
+    are created once. The audio is padded to 30 seconds, but only the frames overlapping the audio are computed,
+    the rest is the known value of silence. The features are the same as the ones from the model's feature extractor
+
+    Params:
+        feature_extractor: WhisperFeatureExtractor of the model (its parameters and mel filters are used)
+    """
+
+    # the lowest mel energy, so the log of silence
+    MEL_FLOOR = 1e-10
+
+    def __init__(self, feature_extractor):
+        self.sampling_rate = feature_extractor.sampling_rate
+        self.n_fft = feature_extractor.n_fft
+        self.hop_length = feature_extractor.hop_length
+        self.n_samples = feature_extractor.n_samples
+        self.num_frames = self.n_samples // self.hop_length
+        # periodic Hann window as in torch.hann_window
+        self.window = (0.5 - 0.5 * np.cos(2 * np.pi * np.arange(self.n_fft) / self.n_fft)).astype(np.float32)
+        self.mel_filters = np.ascontiguousarray(feature_extractor.mel_filters, dtype=np.float32)
+
+    def __call__(self, audio: np.ndarray, sample_rate: int) -> np.ndarray:
+        """
+        Compute the input features
+
+        Params:
+            audio: mono float audio
+            sample_rate: sample rate of the audio, it's resampled to the model's one if needed
+        Returns:
+            Log-mel spectrogram of shape (num mel bins, num frames)
+        """
+        audio = resample(audio, sample_rate, self.sampling_rate)[:self.n_samples]
+
+        waveform = np.zeros(self.n_samples, dtype=np.float32)
+        waveform[:len(audio)] = audio
+        # centered frames
+        padded = np.pad(waveform, self.n_fft // 2, mode="reflect")
+        # frames after these ones see only the zero padding
+        num_audio_frames = min(self.num_frames, -(-(len(audio) + self.n_fft // 2) // self.hop_length))
+        frames = sliding_window_view(padded, self.n_fft)[::self.hop_length][:num_audio_frames]
+
+        power = np.abs(np.fft.rfft(frames * self.window, axis=-1)) ** 2
+        log_spec = np.full((self.num_frames, self.mel_filters.shape[1]), np.log10(self.MEL_FLOOR), dtype=np.float32)
+        log_spec[:num_audio_frames] = np.log10(np.maximum(power @ self.mel_filters, self.MEL_FLOOR))
+
+        log_spec = np.maximum(log_spec, log_spec.max() - 8.0)
+        return ((log_spec + 4.0) / 4.0).T
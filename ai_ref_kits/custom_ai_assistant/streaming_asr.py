@@ -0,0 +1,228 @@
+import threading
+import time
+from collections import deque
+from typing import Callable, List, Optional
+
+import numpy as np
+
+
+def to_mono_float(audio: np.ndarray) -> np.ndarray:
+    """
+    Convert the microphone audio to mono float32 in [-1, 1]
+
+    Params:
+        audio: audio samples (integer or float, mono or multichannel)
+    Returns:
+        Mono float32 audio
+    """
+    if np.issubdtype(audio.dtype, np.integer):
+        audio = audio.astype(np.float32) / np.iinfo(audio.dtype).max
+    if audio.ndim > 1:
+        audio = audio.mean(axis=1)
+    return audio.astype(np.float32)
+
+
+class EnergyVAD:
+    """
+    Lightweight voice activity detector. A frame is speech if its energy is well above the background noise,
+    which is the quietest frame of the last few seconds
+
+    Params:
+        frame_duration: length of a frame in seconds
+        margin_db: how much louder than the noise a speech frame is
+        min_energy_db: frames quieter than this are never speech
+        noise_window_duration: how long in seconds the quietest frame is remembered
+        initial_noise_db: noise assumed until it's measured
+    """
+
+    def __init__(self, frame_duration: float = 0.03, margin_db: float = 10.0, min_energy_db: float = -50.0,
+                 noise_window_duration: float = 5.0, initial_noise_db: float = -60.0):
+        self.frame_duration = frame_duration
+        self.margin_db = margin_db
+        self.min_energy_db = min_energy_db
+        self.energies = deque([initial_noise_db], maxlen=int(noise_window_duration / frame_duration))
+
+    def is_speech(self, frames: np.ndarray) -> np.ndarray:
+        """
+        Classify audio frames
+
+        Params:
+            frames: audio frames, one per row
+        Returns:
+            Speech flag of every frame
+        """
+        energies_db = 10 * np.log10(np.mean(frames ** 2, axis=1) + 1e-10)
+        flags = np.zeros(len(frames), dtype=bool)
+        for i, energy in enumerate(energies_db):
+            self.energies.append(energy)
+            flags[i] = energy > max(min(self.energies) + self.margin_db, self.min_energy_db)
+        return flags
+
+
+class StreamingTranscriber:
+    """
+    Transcribes microphone audio while the user is speaking. The voice activity detector splits the stream into
+    speech segments and every segment is transcribed on a worker thread as soon as it ends, so only the last one
+    is left when the user stops speaking. In the meantime, the open segment is transcribed from time to time
+    to show a partial hypothesis. The end of the text so far is the context of the next segment
+
+    Params:
+        transcribe: function converting a segment (audio, sample rate, previous text) to text
+        vad: voice activity detector
+        min_silence_duration: silence in seconds that ends a segment
+        min_speech_duration: segments with less speech in seconds are dropped as noise
+        max_segment_duration: longer segments in seconds are cut (Whisper gets 30 seconds at most)
+        padding_duration: audio in seconds kept before and after the speech
+        partial_interval: new audio in seconds needed to update the partial hypothesis
+        context_length: max number of characters of the previous text passed as the context
+    """
+
+    def __init__(self, transcribe: Callable[[np.ndarray, int, str], str], vad: Optional[EnergyVAD] = None,
+                 min_silence_duration: float = 0.4, min_speech_duration: float = 0.25, max_segment_duration: float = 20.0,
+                 padding_duration: float = 0.2, partial_interval: float = 1.0, context_length: int = 200):
+        self.transcribe = transcribe
+        self.vad = vad or EnergyVAD()
+        self.context_length = context_length
+
+        frame_duration = self.vad.frame_duration
+        self.min_silence_frames = round(min_silence_duration / frame_duration)
+        self.min_speech_frames = round(min_speech_duration / frame_duration)
+        self.max_segment_frames = round(max_segment_duration / frame_duration)
+        self.padding_frames = round(padding_duration / frame_duration)
+        self.partial_interval_frames = round(partial_interval / frame_duration)
+
+        self.sample_rate: Optional[int] = None
+        self.frame_length = 0
+        # samples which don't make a full frame yet
+        self.buffer = np.zeros(0, dtype=np.float32)
+        # silence before the speech, it's added to the beginning of the next segment
+        self.padding = deque(maxlen=self.padding_frames)
+        # frames of the open segment
+        self.segment: List[np.ndarray] = []
+        self.speech_frames = 0
+        self.silence_frames = 0
+        # finished segments waiting for the transcription
+        self.segments: List[np.ndarray] = []
+
+        self.texts: List[str] = []
+        self.partial = ""
+        self.latency = 0.0
+        self._partial_frames = 0
+        self._finished = False
+        self._condition = threading.Condition()
+
+        self.worker = threading.Thread(target=self._run, daemon=True)
+        self.worker.start()
+
+    @property
+    def text(self) -> str:
+        """
+        Returns:
+            Transcription of the finished segments and the partial hypothesis of the open one
+        """
+        with self._condition:
+            return " ".join(self.texts + [self.partial]).strip()
+
+    def push(self, sample_rate: int, audio: np.ndarray) -> None:
+        """
+        Add a chunk of the microphone audio
+
+        Params:
+            sample_rate: sample rate of the audio
+            audio: audio samples
+        """
+        audio = to_mono_float(audio)
+        with self._condition:
+            if self._finished:
+                return
+            if self.sample_rate is None:
+                self.sample_rate = sample_rate
+                self.frame_length = int(sample_rate * self.vad.frame_duration)
+
+            self.buffer = np.concatenate([self.buffer, audio])
+            num_frames = len(self.buffer) // self.frame_length
+            frames = self.buffer[:num_frames * self.frame_length].reshape(num_frames, self.frame_length)
+            self.buffer = self.buffer[num_frames * self.frame_length:]
+
+            for frame, speech in zip(frames, self.vad.is_speech(frames)):
+                self._add_frame(frame, speech)
+            self._condition.notify_all()
+
+    def finish(self) -> str:
+        """
+        Transcribe the rest of the speech, no more audio comes after it
+
+        Returns:
+            The whole transcription
+        """
+        start_time = time.perf_counter()
+        with self._condition:
+            if self.segment:
+                self._close_segment()
+            self._finished = True
+            self._condition.notify_all()
+        self.worker.join()
+        # time from the end of the utterance to the text
+        self.latency = time.perf_counter() - start_time
+        return self.text
+
+    def _add_frame(self, frame: np.ndarray, speech: bool) -> None:
+        if not self.segment:
+            if not speech:
+                self.padding.append(frame)
+                return
+            self.segment = list(self.padding)
+            self.padding.clear()
+            self.speech_frames = self.silence_frames = 0
+
+        self.segment.append(frame)
+        if speech:
+            self.speech_frames += 1
+            self.silence_frames = 0
+        else:
+            self.silence_frames += 1
+
+        if self.silence_frames >= self.min_silence_frames or len(self.segment) >= self.max_segment_frames:
+            self._close_segment()
+
+    def _close_segment(self) -> None:
+        # keep only the padding of the trailing silence
+        trailing_frames = max(0, self.silence_frames - self.padding_frames)
+        if self.speech_frames >= self.min_speech_frames:
+            self.segments.append(np.concatenate(self.segment[:len(self.segment) - trailing_frames]))
+        self.segment = []
+        self._partial_frames = 0
+
+    def _partial_due(self) -> bool:
+        return not self._finished and len(self.segment) - self._partial_frames >= self.partial_interval_frames
+
+    def _context(self) -> str:
+        context = " ".join(self.texts)
+        if len(context) > self.context_length:
+            # don't start in the middle of a word
+            context = context[-self.context_length:].split(" ", 1)[-1]
+        return context
+
+    def _run(self) -> None:
+        while True:
+            with self._condition:
+                self._condition.wait_for(lambda: self.segments or self._finished or self._partial_due())
+                # finished segments go first, partial hypotheses are only shown when the transcription keeps up
+                if self.segments:
+                    audio, final = self.segments.pop(0), True
+                elif self._partial_due():
+                    audio, final = np.concatenate(self.segment), False
+                    self._partial_frames = len(self.segment)
+                else:
+                    return
+                context = self._context()
+
+            text = self.transcribe(audio, self.sample_rate, context).strip()
+
+            with self._condition:
+                if final:
+                    if text:
+                        self.texts.append(text)
+                    self.partial = ""
+                else:
+                    self.partial = text
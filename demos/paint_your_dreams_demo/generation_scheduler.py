@@ -0,0 +1,191 @@
+import logging as log
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from dataclasses import dataclass, field
+from functools import partial
+from typing import Any, Callable, Hashable, Optional
+
+import numpy as np
+
+
+@dataclass
+class GenerationRequest:
+    # (model name, image size, LoRA adapter, adapter alpha, device, pipeline type)
+    pipeline_key: tuple
+    prompt: str
+    seed: int
+    num_inference_steps: int
+    guidance_scale: float
+    strength: float = 1.0
+    image: Optional[np.ndarray] = None
+    mask: Optional[np.ndarray] = None
+    # the seed doesn't matter to the user, so the request can share a batch (and its seed) with others
+    random_seed: bool = False
+    session_id: Hashable = None
+    # resolves to (image, processing time in seconds)
+    future: Future = field(default_factory=Future)
+
+    @property
+    def batch_key(self) -> Optional[tuple]:
+        """
+        Requests with the same batch key can be generated as one batch, None if the request must run alone.
+        The pipelines take one prompt for the whole batch, so only text2image requests with the same prompt
+        and settings and random seeds are compatible.
+        """
+        if not self.random_seed or self.image is not None:
+            return None
+        return self.pipeline_key, self.prompt, self.num_inference_steps, self.guidance_scale
+
+
+class GenerationScheduler:
+    """
+    Owns the generation pipelines and runs requests from all sessions on one background thread, so handlers
+    only wait for their results and don't block each other. Compatible requests of different sessions waiting
+    in the queue are generated together in a batch of 2, 4, ... (up to max_batch_size) images.
+
+    :param pipeline_loader: Function returning a pipeline for the pipeline key and batch size
+    :param batch_runner: Function generating images for a list of requests with the pipeline, returns (N, H, W, 3)
+    :param max_batch_size: The biggest batch, a power of 2. Every batch size needs its own compiled pipeline
+    :param stats_window: Time window in seconds for images/s
+    :param result_gate: Function taking a generated image and returning a future with the image to release
+        (e.g. after a safety check). The scheduler doesn't wait for it and goes on with the next batch
+    """
+
+    def __init__(self, pipeline_loader: Callable[[tuple, int], Any], batch_runner: Callable[[Any, list[GenerationRequest]], np.ndarray],
+                 max_batch_size: int = 4, stats_window: float = 30.0, result_gate: Optional[Callable[[np.ndarray], Future]] = None):
+        self.__pipeline_loader = pipeline_loader
+        self.__batch_runner = batch_runner
+        self.__result_gate = result_gate
+        self.__max_batch_size = max_batch_size
+        self.__stats_window = stats_window
+
+        self.__pending = deque()
+        # started requests left over from a batch that shrank after cancellations, they go first
+        self.__started = []
+        self.__condition = threading.Condition()
+        self.__finished = deque()  # (time, number of images)
+        self.__stopped = False
+
+        self.__thread = threading.Thread(target=self.__run, daemon=True)
+        self.__thread.start()
+
+    @property
+    def queue_depth(self) -> int:
+        """
+        Number of requests waiting for generation
+        """
+        with self.__condition:
+            return len(self.__started) + sum(not request.future.cancelled() for request in self.__pending)
+
+    @property
+    def images_per_second(self) -> float:
+        """
+        Generated images per second over the last stats_window seconds
+        """
+        now = time.perf_counter()
+        with self.__condition:
+            while self.__finished and now - self.__finished[0][0] > self.__stats_window:
+                self.__finished.popleft()
+            return sum(n for _, n in self.__finished) / self.__stats_window
+
+    def submit(self, request: GenerationRequest) -> Future:
+        """
+        Queue the request. The returned future resolves to (image, processing time in seconds)
+        """
+        with self.__condition:
+            self.__pending.append(request)
+            self.__condition.notify()
+        return request.future
+
+    def cancel_session(self, session_id: Hashable) -> None:
+        """
+        Cancel all requests of the session that haven't started yet
+        """
+        with self.__condition:
+            for request in self.__pending:
+                if request.session_id == session_id:
+                    request.future.cancel()
+
+    def stop(self) -> None:
+        with self.__condition:
+            self.__stopped = True
+            self.__condition.notify()
+        self.__thread.join()
+
+    def __next_batch(self) -> list[GenerationRequest]:
+        with self.__condition:
+            if self.__started and not self.__stopped:
+                batch_size = 1 << (len(self.__started).bit_length() - 1)
+                batch, self.__started = self.__started[:batch_size], self.__started[batch_size:]
+                return batch
+
+            while not self.__stopped:
+                # drop cancelled requests
+                while self.__pending and not self.__pending[0].future.set_running_or_notify_cancel():
+                    self.__pending.popleft()
+                if self.__pending:
+                    break
+                self.__condition.wait()
+            if self.__stopped:
+                return []
+
+            # the oldest request goes first, with compatible requests queued after it
+            first = self.__pending.popleft()
+            batch = [first]
+            if first.batch_key is not None:
+                # one request per session, e.g. the next image of endless generation waits for the current one,
+                # otherwise every session would batch with itself and need a pipeline of a bigger batch
+                sessions = {first.session_id}
+                compatible = []
+                for request in self.__pending:
+                    if request.batch_key == first.batch_key and not request.future.cancelled() and request.session_id not in sessions:
+                        compatible.append(request)
+                        sessions.add(request.session_id)
+                # a power of 2, so only a few batch sizes need a compiled pipeline
+                batch_size = 1
+                while batch_size * 2 <= min(len(compatible) + 1, self.__max_batch_size):
+                    batch_size *= 2
+                for request in compatible:
+                    if len(batch) == batch_size:
+                        break
+                    if request.future.set_running_or_notify_cancel():
+                        batch.append(request)
+                    self.__pending.remove(request)
+                # requests cancelled in the meantime can leave fewer of them, the batch shrinks to a power of 2 again
+                batch_size = 1 << (len(batch).bit_length() - 1)
+                batch, self.__started = batch[:batch_size], batch[batch_size:]
+            return batch
+
+    def __run(self) -> None:
+        while True:
+            batch = self.__next_batch()
+            if not batch:
+                break
+
+            start_time = time.perf_counter()
+            try:
+                pipeline = self.__pipeline_loader(batch[0].pipeline_key, len(batch))
+                images = self.__batch_runner(pipeline, batch)
+            except Exception as e:
+                log.error(f"Generation failed: {e}")
+                for request in batch:
+                    request.future.set_exception(e)
+                continue
+            processing_time = time.perf_counter() - start_time
+
+            with self.__condition:
+                self.__finished.append((time.perf_counter(), len(batch)))
+            for request, image in zip(batch, images):
+                if self.__result_gate is None:
+                    request.future.set_result((image, processing_time))
+                else:
+                    self.__result_gate(image).add_done_callback(partial(self.__release, request, processing_time))
+
+    @staticmethod
+    def __release(request: GenerationRequest, processing_time: float, gate_future: Future) -> None:
+        if gate_future.exception() is not None:
+            request.future.set_exception(gate_future.exception())
+        else:
+            request.future.set_result((gate_future.result(), processing_time))
@@ -1,10 +1,11 @@
 import argparse
 import asyncio
+import concurrent.futures
 import logging as log
 import os
 import random
 import sys
-import time
+from collections import deque
 from pathlib import Path
 from typing import Optional
 
@@ -14,11 +15,14 @@ import numpy as np
 import openvino as ov
 import openvino_genai as genai
 import tqdm
-from PIL import Image
 from huggingface_hub import snapshot_download
 from optimum.exporters.openvino.convert import export_tokenizer
 from optimum.intel import OVPipelineForText2Image, OVModelForImageClassification
-from transformers import Pipeline, pipeline, AutoProcessor
+from transformers import AutoProcessor
+
+from generation_scheduler import GenerationRequest, GenerationScheduler
+from nsfw_checker import NSFWChecker
+from pipeline_cache import PipelineCache
 
 SCRIPT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "utils")
 sys.path.append(os.path.dirname(SCRIPT_DIR))
@@ -30,18 +34,14 @@ MODEL_DIR = Path("model")
 
 SAFETY_CHECKER_MODEL_NAME = "Falconsai/nsfw_image_detection"
 
-safety_checker: Optional[Pipeline] = None
+safety_checker: Optional[NSFWChecker] = None
 
-ov_pipelines = {}
+pipeline_cache: Optional[PipelineCache] = None
 
-stop_generating: bool = True
+scheduler: Optional[GenerationScheduler] = None
 
-current_pipeline_configuration = {
-    "model_name": "",
-    "image_size": 512,
-    "lora_adapter": None,
-    "adapter_alpha": 0.0
-}
+# sessions that pressed stop
+stopped_sessions = set()
 
 dreamshaper_config = {
     "guidance_scale_value": 8,
@@ -102,8 +102,15 @@ def download_and_load_safety_checker(model_name: str) -> None:
         processor = AutoProcessor.from_pretrained(model_name, use_fast=True)
         processor.save_pretrained(safety_checker_dir)
 
-    safety_checker = pipeline("image-classification", model=OVModelForImageClassification.from_pretrained(safety_checker_dir),
-                            image_processor=AutoProcessor.from_pretrained(safety_checker_dir, use_fast=True))
+    # the classifier runs on CPU, so it doesn't compete with the generation for the accelerator
+    safety_checker = NSFWChecker(safety_checker_dir, replacement=nsfw_placeholder, device="CPU")
+
+
+def nsfw_placeholder(image: np.ndarray) -> np.ndarray:
+    result = np.zeros_like(image)
+    h, w = result.shape[:2]
+    utils.draw_text(result, "Potential NSFW content", (w // 2, h // 2), center=True, font_scale=3.0)
+    return result
 
 
 async def download_model(model_name: str, is_lora_adapter: bool = False) -> None:
@@ -139,7 +146,8 @@ async def load_lora_adapter(adapter_model_name: str, adapter_alpha: float) -> ge
     return adapter_config
 
 
-async def create_pipeline(model_name: str, device: str, size: int, adapter_model_name: str, adapter_alpha: float, pipeline_type: str) -> genai.Text2ImagePipeline | genai.Image2ImagePipeline | genai.InpaintingPipeline:
+async def create_pipeline(model_name: str, device: str, size: int, adapter_model_name: str, adapter_alpha: float, pipeline_type: str,
+                          batch_size: int = 1) -> genai.Text2ImagePipeline | genai.Image2ImagePipeline | genai.InpaintingPipeline:
     ov_config = {"CACHE_DIR": "cache"}
 
     # Download model if it hasn't been downloaded yet
@@ -156,7 +164,7 @@ async def create_pipeline(model_name: str, device: str, size: int, adapter_model
     else:
         raise ValueError(f"Unknown pipeline: {pipeline_type}")
 
-    ov_pipeline.reshape(1, size, size, ov_pipeline.get_generation_config().guidance_scale)
+    ov_pipeline.reshape(batch_size, size, size, ov_pipeline.get_generation_config().guidance_scale)
 
     # Load LoRA adapter if specified
     if adapter_model_name is not None and adapter_model_name != "None":
@@ -167,16 +175,49 @@ async def create_pipeline(model_name: str, device: str, size: int, adapter_model
     return ov_pipeline
 
 
-async def load_pipeline(model_name: str, device: str, size: int, adapter_model_name: str, adapter_alpha: float, pipeline_type: str) -> genai.Text2ImagePipeline | genai.Image2ImagePipeline | genai.InpaintingPipeline:
-    if (device, pipeline_type) not in ov_pipelines:
-        ov_pipelines[(device, pipeline_type)] = await create_pipeline(model_name, device, size, adapter_model_name, adapter_alpha, pipeline_type)
+def load_pipeline(pipeline_key: tuple) -> genai.Text2ImagePipeline | genai.Image2ImagePipeline | genai.InpaintingPipeline:
+    model_name, image_size, adapter_model_name, adapter_alpha, device, pipeline_type, batch_size = pipeline_key
+    # called from the scheduler or warm-up threads, which have no event loop
+    return asyncio.run(create_pipeline(model_name, device, image_size, adapter_model_name, adapter_alpha, pipeline_type, batch_size))
+
+
+def estimate_pipeline_memory(pipeline_key: tuple) -> int:
+    # the weights of all models in the pipeline (and the adapter) are the bulk of the compiled pipeline
+    model_name, adapter_model_name = pipeline_key[0], pipeline_key[2]
+    model_dirs = [MODEL_DIR / model_name]
+    if adapter_model_name is not None and adapter_model_name != "None":
+        model_dirs.append(MODEL_DIR / adapter_model_name)
+    return sum(path.stat().st_size for model_dir in model_dirs for path in model_dir.rglob("*") if path.suffix in (".bin", ".safetensors"))
 
-    return ov_pipelines[(device, pipeline_type)]
+
+def load_scheduled_pipeline(pipeline_key: tuple, batch_size: int) -> genai.Text2ImagePipeline | genai.Image2ImagePipeline | genai.InpaintingPipeline:
+    return pipeline_cache.get((*pipeline_key, batch_size))
+
+
+def run_batch(ov_pipeline: genai.Text2ImagePipeline | genai.Image2ImagePipeline | genai.InpaintingPipeline, requests: list[GenerationRequest]) -> np.ndarray:
+    # all requests in the batch share the pipeline, the prompt and the settings
+    request = requests[0]
+    image_size, pipeline_type = request.pipeline_key[1], request.pipeline_key[5]
+
+    # inpainting pipeline
+    if pipeline_type == "inpainting":
+        result = ov_pipeline.generate(prompt=request.prompt, image=ov.Tensor(request.image[None]), mask_image=ov.Tensor(request.mask[None]), num_inference_steps=request.num_inference_steps,
+                                      width=image_size, height=image_size, guidance_scale=request.guidance_scale, strength=1.0 - request.strength, rng_seed=request.seed, callback=progress)
+    # image2image pipeline
+    elif pipeline_type == "image2image":
+        result = ov_pipeline.generate(prompt=request.prompt, image=ov.Tensor(request.image[None]), num_inference_steps=request.num_inference_steps, width=image_size, height=image_size,
+                                      guidance_scale=request.guidance_scale, strength=1.0 - request.strength, rng_seed=request.seed, callback=progress)
+    # text2image pipeline
+    else:
+        result = ov_pipeline.generate(prompt=request.prompt, num_inference_steps=request.num_inference_steps, width=image_size, height=image_size,
+                                      guidance_scale=request.guidance_scale, rng_seed=request.seed, num_images_per_prompt=len(requests), callback=progress)
+    # the output tensor may be reused by the next generation, while the images are still checked and shown
+    return result.data.copy()
 
 
-async def stop():
-    global stop_generating
-    stop_generating = True
+async def stop(request: gr.Request):
+    stopped_sessions.add(request.session_hash)
+    scheduler.cancel_session(request.session_hash)
 
 
 progress_bar = None
@@ -194,27 +235,16 @@ def progress(step, num_steps, latent) -> bool:
 
 
 async def generate_images(model_name: str, device: str, image_size: int, adapter_model_name: str, adapter_alpha: float, input_image_mask: np.ndarray, prompt: str, seed: int,
-                          guidance_scale: float, num_inference_steps: int, strength: float, randomize_seed: bool, endless_generation: bool) -> tuple[np.ndarray, float]:
-    global stop_generating, current_pipeline_configuration, ov_pipelines
-    stop_generating = not endless_generation
-
-    pipeline_config = {
-        "model_name": model_name,
-        "image_size": image_size,
-        "lora_adapter": adapter_model_name,
-        "adapter_alpha": adapter_alpha
-    }
-
-    # Clear pipelines if model, adapter or image size changed
-    if pipeline_config != current_pipeline_configuration:
-        ov_pipelines.clear()
-
-    current_pipeline_configuration = pipeline_config
+                          guidance_scale: float, num_inference_steps: int, strength: float, randomize_seed: bool, endless_generation: bool,
+                          request: gr.Request) -> tuple[np.ndarray, float, str]:
+    session_id = request.session_hash
+    stopped_sessions.discard(session_id)
 
     device = device.split(":")[0]  # Extract device type (e.g., "CPU", "GPU")
 
     input_image = None
     image_mask = None
+    pipeline_type = "text2image"
     if input_image_mask["background"] is not None:
         input_image = input_image_mask["background"][:, :, :3]
         image_mask = input_image_mask["layers"][0][:, :, 3:]
@@ -224,48 +254,44 @@ async def generate_images(model_name: str, device: str, image_size: int, adapter
         input_image = cv2.resize(input_image, (image_size, image_size))
         image_mask = cv2.resize(image_mask, (image_size, image_size), interpolation=cv2.INTER_NEAREST)
         image_mask = cv2.cvtColor(image_mask, cv2.COLOR_GRAY2BGR)
-
-    while True:
-        if randomize_seed:
-            seed = random.randint(0, MAX_SEED)
-
-        start_time = time.perf_counter()
-        if input_image is not None:
-            # inpainting pipeline
-            if image_mask.any():
-                ov_pipeline = await load_pipeline(model_name, device, image_size, adapter_model_name, adapter_alpha, "inpainting")
-                result = ov_pipeline.generate(prompt=prompt, image=ov.Tensor(input_image[None]), mask_image=ov.Tensor(image_mask[None]), num_inference_steps=num_inference_steps,
-                                              width=image_size, height=image_size, guidance_scale=guidance_scale, strength=1.0 - strength, rng_seed=seed, callback=progress).data[0]
-            # image2image pipeline
-            else:
-                ov_pipeline = await load_pipeline(model_name, device, image_size, adapter_model_name, adapter_alpha, "image2image")
-                result = ov_pipeline.generate(prompt=prompt, image=ov.Tensor(input_image[None]), num_inference_steps=num_inference_steps, width=image_size, height=image_size,
-                                              guidance_scale=guidance_scale, strength=1.0 - strength, rng_seed=seed, callback=progress).data[0]
-
-        # text2image pipeline
-        else:
-            ov_pipeline = await load_pipeline(model_name, device, image_size, adapter_model_name, adapter_alpha, "text2image")
-            result = ov_pipeline.generate(prompt=prompt, num_inference_steps=num_inference_steps, width=image_size, height=image_size,
-                                          guidance_scale=guidance_scale, rng_seed=seed, callback=progress).data[0]
-        end_time = time.perf_counter()
-
-        label = safety_checker(Image.fromarray(result), top_k=1)
-        if label[0]["label"].lower() == "nsfw":
-            result = np.zeros_like(result)
-            h, w = result.shape[:2]
-            utils.draw_text(result, "Potential NSFW content", (w // 2, h // 2), center=True, font_scale=3.0)
-
-        utils.draw_ov_watermark(result, size=0.60)
-
-        processing_time = end_time - start_time
-
-        yield result, round(processing_time, 5)
-
-        if stop_generating:
-            break
-
-        # small delay necessary for endless generation
-        await asyncio.sleep(0.5)
+        pipeline_type = "inpainting" if image_mask.any() else "image2image"
+
+    pipeline_key = (model_name, image_size, adapter_model_name, adapter_alpha, device, pipeline_type)
+
+    def submit() -> concurrent.futures.Future:
+        return scheduler.submit(GenerationRequest(
+            pipeline_key=pipeline_key, prompt=prompt, seed=random.randint(0, MAX_SEED) if randomize_seed else seed,
+            num_inference_steps=num_inference_steps, guidance_scale=guidance_scale, strength=strength,
+            image=input_image, mask=image_mask, random_seed=randomize_seed, session_id=session_id))
+
+    pending = deque()
+    try:
+        while True:
+            # in endless mode the next request is already queued, so the pipeline doesn't wait for the UI
+            while len(pending) < (2 if endless_generation else 1):
+                pending.append(submit())
+
+            future = pending.popleft()
+            try:
+                result, processing_time = await asyncio.wrap_future(future)
+            except asyncio.CancelledError:
+                # stopped by the user
+                if future.cancelled():
+                    break
+                raise
+
+            # the scheduler releases only images that passed the safety check
+            utils.draw_ov_watermark(result, size=0.60)
+
+            server_load = f"{scheduler.queue_depth} requests queued, {scheduler.images_per_second:.2f} images/s, " \
+                          f"pipeline cache hit rate {pipeline_cache.hit_rate:.0%}, safety check +{safety_checker.latency * 1000:.0f} ms/image"
+            yield result, round(processing_time, 5), server_load
+
+            if not endless_generation or session_id in stopped_sessions:
+                break
+    finally:
+        # don't generate images nobody waits for
+        scheduler.cancel_session(session_id)
 
 
 def build_ui() -> gr.Interface:
@@ -321,6 +347,7 @@ def build_ui() -> gr.Interface:
                         result_img = gr.Image(label="Generated image", elem_id="output_image", format="png")
                     with gr.Row():
                         result_time_label = gr.Text("", label="Inference time", type="text")
+                        server_load_label = gr.Text("", label="Server load", type="text")
                     with gr.Row():
                         model_dropdown = gr.Dropdown(choices=model_choices, value=initial_model, label="Model")
                         adapter_dropdown = gr.Dropdown(choices=adapter_choices, value="None", label="LoRA Adapter", visible=len(adapter_choices) > 1)
@@ -390,7 +417,7 @@ def build_ui() -> gr.Interface:
             generate_images,
             inputs=[model_dropdown, device_dropdown, image_size_slider, adapter_dropdown, adapter_alpha_slider, input_image, prompt_text, seed_slider, guidance_scale_slider,
                     num_inference_steps_slider, strength_slider, randomize_seed_checkbox, endless_checkbox],
-            outputs=[result_img, result_time_label]
+            outputs=[result_img, result_time_label, server_load_label]
         ).then(swap_buttons_highlighting, outputs=[start_button, stop_button])
 
         # rand the prompt
@@ -407,12 +434,23 @@ def build_ui() -> gr.Interface:
     return demo
 
 
-def run_demo(local_network: bool = False, public_interface: bool = False) -> None:
+def run_demo(local_network: bool = False, public_interface: bool = False, max_batch_size: int = 4, pipeline_cache_gb: float = 16.0) -> None:
+    global scheduler, pipeline_cache
     server_name = "0.0.0.0" if local_network else None
 
     # Download only the safety checker model at startup
     download_and_load_safety_checker(SAFETY_CHECKER_MODEL_NAME)
 
+    # recently used pipelines stay compiled, so switching between them is instant
+    pipeline_cache = PipelineCache(load_pipeline, estimate_pipeline_memory, int(pipeline_cache_gb * 2 ** 30))
+    # precompile the default configuration of already downloaded models in the background (nothing is downloaded here)
+    default_device = next(iter(utils.available_devices()))
+    pipeline_cache.warm_up([(model_name, 512, "None", 0.5, default_device, "text2image", 1) for model_name in MODEL_CONFIGS
+                            if (MODEL_DIR / model_name).exists()])
+
+    # one generation backend for all sessions (screens)
+    scheduler = GenerationScheduler(load_scheduled_pipeline, run_batch, max_batch_size=max_batch_size, result_gate=safety_checker.submit)
+
     demo = build_ui()
     print("Demo is ready!", flush=True) # Required for the CI to detect readiness
     demo.launch(server_name=server_name, share=public_interface)
@@ -425,6 +463,8 @@ if __name__ == '__main__':
     parser = argparse.ArgumentParser()
     parser.add_argument("--local_network", action="store_true", help="Whether demo should be available in local network")
     parser.add_argument("--public", default=False, action="store_true", help="Whether interface should be available publicly")
+    parser.add_argument("--max_batch_size", type=int, default=4, choices=[1, 2, 4, 8], help="The biggest batch of images generated together for sessions with the same prompt")
+    parser.add_argument("--pipeline_cache_gb", type=float, default=16.0, help="Memory budget (in GB) for compiled pipelines kept in the cache")
 
     args = parser.parse_args()
-    run_demo(args.local_network, args.public)
+    run_demo(args.local_network, args.public, args.max_batch_size, args.pipeline_cache_gb)
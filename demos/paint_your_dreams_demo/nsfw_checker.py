@@ -0,0 +1,93 @@
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from pathlib import Path
+from typing import Callable
+
+import numpy as np
+import openvino as ov
+from transformers import AutoConfig, AutoProcessor
+
+
+class NSFWChecker:
+    """
+    Checks generated images with an image classifier on its own thread and async infer queue, so the check
+    of one image runs while the next one is generated. Images waiting for the check are classified together
+    in micro-batches.
+
+    :param model_dir: Directory with the classifier exported to OpenVINO IR (openvino_model.xml) and its processor
+    :param replacement: Function creating the image released instead of an NSFW one
+    :param device: Device to run the classifier on
+    :param max_batch_size: Maximum number of images classified at once
+    """
+
+    def __init__(self, model_dir: Path, replacement: Callable[[np.ndarray], np.ndarray], device: str = "CPU", max_batch_size: int = 8):
+        self.__replacement = replacement
+        self.__max_batch_size = max_batch_size
+        self.__processor = AutoProcessor.from_pretrained(model_dir, use_fast=True)
+        labels = AutoConfig.from_pretrained(model_dir).id2label
+        self.__nsfw_index = next(int(i) for i, label in labels.items() if label.lower() == "nsfw")
+
+        core = ov.Core()
+        compiled_model = core.compile_model(model_dir / "openvino_model.xml", device, {"CACHE_DIR": "cache"})
+        self.__infer_queue = ov.AsyncInferQueue(compiled_model)
+        self.__infer_queue.set_callback(self.__on_result)
+
+        self.__pending = deque()  # (image, future, submit time)
+        self.__condition = threading.Condition()
+        self.__latencies = deque(maxlen=100)
+        # latencies are recorded on the infer queue's thread
+        self.__latencies_lock = threading.Lock()
+
+        threading.Thread(target=self.__run, daemon=True).start()
+
+    @property
+    def latency(self) -> float:
+        """
+        Mean time (in seconds) from submitting an image to releasing it, over the last 100 images
+        """
+        with self.__latencies_lock:
+            latencies = list(self.__latencies)
+        return float(np.mean(latencies)) if latencies else 0.0
+
+    def submit(self, image: np.ndarray) -> Future:
+        """
+        Queue the image for the check. The returned future resolves to the image if it's safe, or to its replacement
+        """
+        future = Future()
+        with self.__condition:
+            self.__pending.append((image, future, time.perf_counter()))
+            self.__condition.notify()
+        return future
+
+    def __run(self) -> None:
+        while True:
+            with self.__condition:
+                while not self.__pending:
+                    self.__condition.wait()
+                # everything that came in since the last batch, up to the limit
+                batch = [self.__pending.popleft() for _ in range(min(len(self.__pending), self.__max_batch_size))]
+
+            try:
+                pixel_values = self.__processor(images=[image for image, _, _ in batch], return_tensors="pt").pixel_values.numpy()
+                self.__infer_queue.start_async({0: pixel_values}, batch)
+            except Exception as e:
+                for _, future, _ in batch:
+                    future.set_exception(e)
+
+    def __on_result(self, request: ov.InferRequest, batch: list) -> None:
+        try:
+            nsfw = np.argmax(request.get_output_tensor(0).data, axis=-1) == self.__nsfw_index
+            now = time.perf_counter()
+            for (image, future, submit_time), is_nsfw in zip(batch, nsfw):
+                result = self.__replacement(image) if is_nsfw else image
+                # recorded before the caller is woken up, so it sees its own image's latency
+                with self.__latencies_lock:
+                    self.__latencies.append(now - submit_time)
+                future.set_result(result)
+        except Exception as e:
+            # the callers wait for the rest of the batch
+            for _, future, _ in batch:
+                if not future.done():
+                    future.set_exception(e)
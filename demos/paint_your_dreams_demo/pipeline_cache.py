@@ -0,0 +1,118 @@
+import logging as log
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Hashable, Iterable
+
+
+class PipelineCache:
+    """
+    LRU cache of compiled pipelines bounded by memory. The least recently used pipelines are dropped when the
+    estimated memory of all cached pipelines exceeds the budget. A pipeline requested from several threads
+    is compiled only once.
+
+    :param loader: Function creating and compiling the pipeline for the key
+    :param memory_estimator: Function returning the estimated memory (in bytes) of the loaded pipeline for the key
+    :param memory_budget: Maximum memory (in bytes) of all cached pipelines. The last used pipeline is always kept
+    """
+
+    def __init__(self, loader: Callable[[Hashable], Any], memory_estimator: Callable[[Hashable], int], memory_budget: int):
+        self.__loader = loader
+        self.__memory_estimator = memory_estimator
+        self.__memory_budget = memory_budget
+
+        self.__lock = threading.Lock()
+        self.__entries = OrderedDict()  # key: (pipeline, memory)
+        self.__loading = {}  # key: event set when the loading finished
+
+        self.hits = 0
+        self.misses = 0
+        self.compile_times = []
+
+    @property
+    def memory_used(self) -> int:
+        with self.__lock:
+            return sum(memory for _, memory in self.__entries.values())
+
+    @property
+    def hit_rate(self) -> float:
+        return self.hits / max(1, self.hits + self.misses)
+
+    def get(self, key: Hashable) -> Any:
+        """
+        Get the pipeline for the key, compile it if it isn't cached
+        """
+        return self.__get(key, count=True)
+
+    def warm_up(self, keys: Iterable[Hashable]) -> threading.Thread:
+        """
+        Compile the pipelines in the background while they fit into the free memory budget. It doesn't evict
+        anything and doesn't count to hits and misses.
+
+        :return: The warm-up thread
+        """
+        def run():
+            for key in keys:
+                with self.__lock:
+                    memory_used = sum(memory for _, memory in self.__entries.values())
+                    if key in self.__entries or key in self.__loading:
+                        continue
+                if memory_used + self.__memory_estimator(key) > self.__memory_budget:
+                    log.info(f"Warm-up of {key} skipped, it doesn't fit into the memory budget")
+                    continue
+                try:
+                    self.__get(key, count=False)
+                except Exception as e:
+                    log.error(f"Warm-up of {key} failed: {e}")
+
+        thread = threading.Thread(target=run, daemon=True)
+        thread.start()
+        return thread
+
+    def __get(self, key: Hashable, count: bool) -> Any:
+        while True:
+            with self.__lock:
+                if key in self.__entries:
+                    self.__entries.move_to_end(key)
+                    if count:
+                        self.hits += 1
+                    return self.__entries[key][0]
+
+                event = self.__loading.get(key)
+                if event is None:
+                    # this thread compiles the pipeline
+                    self.__loading[key] = threading.Event()
+                    break
+            # another thread compiles it, wait and check again (if that failed, this thread tries itself)
+            event.wait()
+
+        try:
+            start_time = time.perf_counter()
+            pipeline = self.__loader(key)
+            compile_time = time.perf_counter() - start_time
+            memory = self.__memory_estimator(key)
+        except Exception:
+            with self.__lock:
+                self.__loading.pop(key).set()
+            raise
+
+        with self.__lock:
+            # waiting threads find the pipeline in the cache
+            self.__loading.pop(key).set()
+            if count:
+                self.misses += 1
+            self.compile_times.append(compile_time)
+            self.__entries[key] = (pipeline, memory)
+            if not count:
+                # warmed up pipelines haven't been used yet, so they go first when memory is needed
+                self.__entries.move_to_end(key, last=False)
+            self.__evict()
+            log.info(f"Pipeline {key} compiled in {compile_time:.1f}s, cache hit rate {self.hit_rate:.0%}, "
+                     f"{len(self.__entries)} pipelines cached ({sum(m for _, m in self.__entries.values()) / 2 ** 30:.1f} GB)")
+        return pipeline
+
+    def __evict(self) -> None:
+        # drop the least recently used pipelines, but never the last used one
+        while len(self.__entries) > 1 and sum(memory for _, memory in self.__entries.values()) > self.__memory_budget:
+            old_key, _ = self.__entries.popitem(last=False)
+            log.info(f"Pipeline {old_key} removed from the cache")
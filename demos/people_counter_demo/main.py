@@ -4,7 +4,7 @@ import logging as log
 import os
 import sys
 import time
-from collections import defaultdict, deque
+from collections import deque
 from pathlib import Path
 from typing import Tuple, List, Dict
 
@@ -18,6 +18,8 @@ SCRIPT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "uti
 sys.path.append(os.path.dirname(SCRIPT_DIR))
 
 from utils import demo_utils as utils
+from utils.model_manager import ModelManager
+from utils.yolo_pipeline import YOLOPipeline, YOLOResult
 from deep_sort_realtime.deepsort_tracker import DeepSort
 
 CATEGORIES = [
@@ -46,10 +48,13 @@ def convert(model_name: str, model_dir: Path) -> tuple[Path, Path]:
     return Path(ov_model_path), Path(ov_int8_model_path)
 
 
-def get_model(model_path: Path, verbose: bool = False):
-    # compile the model with YOLO
-    model = YOLO(model_path, task="detect", verbose=verbose)
-    return model
+def get_model(model_path: Path, device: str, category_id: int, num_requests: int = 0) -> YOLOPipeline:
+    # compile the exported model directly with OpenVINO, keeping several requests in flight
+    return YOLOPipeline(model_path, device=device, classes=[category_id], num_requests=num_requests)
+
+
+def to_detections(result: YOLOResult) -> sv.Detections:
+    return sv.Detections(xyxy=result.xyxy, confidence=result.confidence, class_id=result.class_id, mask=result.mask)
 
 
 def load_zones(json_path: str) -> List[np.ndarray]:
@@ -106,47 +111,99 @@ def track_objects(frame: np.array, detections: sv.Detections, tracker: DeepSort)
     return list(sorted(tracks, key=lambda x: x.det_conf if x.det_conf is not None else 0.0, reverse=True))
 
 
-def draw_annotations(frame: np.array, detections: sv.Detections, tracker: DeepSort, queue_count: Dict, object_limit: int, category:str,
-                     zones: List, zone_annotators: List, box_annotators: List, masks_annotators: List, label_annotators: List) -> None:
+class ZoneCounter:
+    """
+    Running average of the number of objects in every zone over the last N frames, updated in O(1) per zone.
+
+    :param num_zones: Number of zones
+    :param last_frames: Number of frames to average over
+    """
+
+    def __init__(self, num_zones: int, last_frames: int):
+        self.__history = np.zeros((last_frames, num_zones), dtype=np.int64)
+        self.__sums = np.zeros(num_zones, dtype=np.int64)
+        self.__pos = 0
+        self.__filled = 0
+
+    def update(self, counts: np.ndarray) -> np.ndarray:
+        # replace the oldest counts in the window with the new ones
+        self.__sums += counts - self.__history[self.__pos]
+        self.__history[self.__pos] = counts
+        self.__pos = (self.__pos + 1) % len(self.__history)
+        self.__filled = min(self.__filled + 1, len(self.__history))
+        return self.mean()
+
+    def mean(self) -> np.ndarray:
+        return self.__sums // max(self.__filled, 1)
+
+
+def get_zone_labels(json_path: str, resolution_wh: Tuple[int, int]) -> np.ndarray:
+    polygons = load_zones(json_path)
+
+    # one map for all zones, every pixel holds the id of its zone (0 = no zone), overlapping zones belong to the later one
+    zone_labels = np.zeros(resolution_wh[::-1], dtype=np.uint8 if len(polygons) < 256 else np.uint16)
+    for zone_id, polygon in enumerate(polygons, start=1):
+        cv2.fillPoly(zone_labels, [polygon], zone_id)
+    return zone_labels
+
+
+def assign_zones(detections: sv.Detections, zone_labels: np.ndarray) -> np.ndarray:
+    # the bottom center of the box is the anchor, the same as for sv.PolygonZone
+    h, w = zone_labels.shape
+    xs = ((detections.xyxy[:, 0] + detections.xyxy[:, 2]) / 2).astype(np.int32).clip(0, w - 1)
+    ys = detections.xyxy[:, 3].astype(np.int32).clip(0, h - 1)
+    return zone_labels[ys, xs]
+
+
+def draw_annotations(frame: np.array, detections: sv.Detections, tracker: DeepSort, zone_counter: ZoneCounter, object_limit: int, category:str,
+                     zones: List, zone_labels: np.ndarray, zone_annotators: List, box_annotators: List, masks_annotators: List, label_annotators: List,
+                     annotate: bool = True) -> Dict[int, int]:
+    # zone of every detection with a single lookup, then the number of objects in every zone in this frame
+    detection_zones = assign_zones(detections, zone_labels)
+    counts = np.bincount(detection_zones, minlength=len(zones) + 1)[1:]
+    mean_counts = zone_counter.update(counts)
 
-    for zone_annotator in zone_annotators:
-        # visualize polygon for the zone
-        frame = zone_annotator.annotate(scene=frame)
+    if annotate:
+        for zone, zone_annotator, count in zip(zones, zone_annotators, counts):
+            # the annotator shows the zone's current count
+            zone.current_count = int(count)
+            # visualize polygon for the zone
+            frame = zone_annotator.annotate(scene=frame)
 
     if detections:
-        # uniquely track the objects
-        tracks = track_objects(frame, detections, tracker)
+        # uniquely track the objects, the ids are only needed for the labels
+        tracks = track_objects(frame, detections, tracker) if annotate else []
 
         # annotate the frame with the detected persons within each zone
-        for zone_id, (zone, box_annotator, masks_annotator, label_annotator) in enumerate(
-                zip(zones, box_annotators, masks_annotators, label_annotators), start=1):
-
-            # get detections relevant only for the zone
-            mask = zone.trigger(detections=detections)
-            detections_filtered = detections[mask]
-            # visualize boxes around objects in the zone
-            frame = masks_annotator.annotate(scene=frame, detections=detections_filtered)
-            frame = box_annotator.annotate(scene=frame, detections=detections_filtered)
-            # count how many objects detected
-            det_count = len(detections_filtered)
-            # Add track ID annotations
-            label_annotator.annotate(scene=frame, detections=detections_filtered,
-                                     labels=[f"ID: {track.track_id if track.time_since_update == 0 else ' '}" for
-                                             track, in_zone in zip(tracks, mask) if in_zone])
-            # add the count to the list
-            queue_count[zone_id].append(det_count)
-            # calculate the mean number of customers in the queue
-            mean_customer_count = np.mean(queue_count[zone_id], dtype=np.int32)
+        for zone_id, (box_annotator, masks_annotator, label_annotator) in enumerate(
+                zip(box_annotators, masks_annotators, label_annotators), start=1):
+
+            det_count = counts[zone_id - 1]
+            if annotate and det_count > 0:
+                # get detections relevant only for the zone
+                mask = detection_zones == zone_id
+                detections_filtered = detections[mask]
+                # visualize boxes around objects in the zone
+                frame = masks_annotator.annotate(scene=frame, detections=detections_filtered)
+                frame = box_annotator.annotate(scene=frame, detections=detections_filtered)
+                # Add track ID annotations
+                label_annotator.annotate(scene=frame, detections=detections_filtered,
+                                         labels=[f"ID: {track.track_id if track.time_since_update == 0 else ' '}" for
+                                                 track, in_zone in zip(tracks, mask) if in_zone])
+            # the mean number of customers in the queue
+            mean_customer_count = mean_counts[zone_id - 1]
 
             cat = "people" if category == "person" else "objects"
             # add alert text to the frame if necessary, flash every second
-            if mean_customer_count > object_limit and time.time() % 2 > 1:
+            if annotate and mean_customer_count > object_limit and time.time() % 2 > 1:
                 utils.draw_text(frame, text=f"Too many {cat} in zone {zone_id}!", point=(frame.shape[1] // 2, frame.shape[0] // 2), center=True, font_color=(0, 0, 255))
 
             # print an info about number of customers in the queue, ask for the more assistants if required
             log.info(
                 f"Zone {zone_id}, avg {category} count: {mean_customer_count} {f'Too many {cat}!' if mean_customer_count > object_limit else ''}")
 
+    return {zone_id: int(count) for zone_id, count in enumerate(counts, start=1)}
+
 
 def run(video_path: str, model_paths: Tuple[Path, Path], model_name: str = "", category: str = "person", zones_config_file: str = "",
         object_limit: int = 3, flip: bool = True, tracker_frames: int = 1800, colorful: bool = False, last_frames: int = 50) -> None:
@@ -156,27 +213,33 @@ def run(video_path: str, model_paths: Tuple[Path, Path], model_name: str = "", c
         "INT8": model_paths[1],
     }
 
-    # Start with INT8
-    model_type = "INT8"
-    model = get_model(model_mapping[model_type], verbose=False)
-
     # Device setup
     devices_mapping = utils.available_devices()  # e.g. {"cpu":"Intel CPU", "gpu":"Intel GPU", ...}
     device_type = next(iter(devices_mapping.keys()))  # default to first available
 
+    category_id = CATEGORIES.index(category)
+    # two frames in flight, so drawing one frame overlaps inference of the next one
+    pipeline_depth = 2
+
+    # Start with INT8, other (precision, device) combinations are compiled in the background when requested
+    model_manager = ModelManager(lambda key: get_model(model_mapping[key[0]], key[1], category_id, num_requests=pipeline_depth), ("INT8", device_type))
+    (model_type, device_type), model = model_manager.current
+
     qr_code = utils.get_qr_code("https://github.com/openvinotoolkit/openvino_build_deploy/tree/master/demos/people_counter_demo", with_embedded_image=True)
 
     # Video player
     if isinstance(video_path, str) and video_path.isnumeric():
         video_path = int(video_path)
-    player = utils.VideoPlayer(video_path, size=(1920, 1080), fps=60, flip=flip)
+    # frames stay in the player's buffers while they are in the pipeline
+    player = utils.VideoPlayer(video_path, size=(1920, 1080), fps=60, flip=flip, buffer_size=pipeline_depth + 2, max_borrowed=pipeline_depth)
 
     # get zones, and zone and box annotators for zones
     zones, zone_annotators, box_annotators, masks_annotators, label_annotators = get_annotators(json_path=zones_config_file, resolution_wh=(player.width, player.height), colorful=colorful)
-    category_id = CATEGORIES.index(category)
+    # zone map at the resolution of the player's frames
+    zone_labels = get_zone_labels(zones_config_file, resolution_wh=(1920, 1080))
 
     # object counter
-    queue_count = defaultdict(lambda: deque(maxlen=last_frames))
+    zone_counter = ZoneCounter(len(zones), last_frames)
     # keep at most 100 last times
     processing_times = deque(maxlen=100)
 
@@ -194,21 +257,25 @@ def run(video_path: str, model_paths: Tuple[Path, Path], model_name: str = "", c
         if frame is None:
             print("Source ended")
             break
-        # Get the results.
-        frame = np.array(frame)
-        f_height, f_width = frame.shape[:2]
 
-        # inference + timing
-        result = model(frame, device=f"intel:{device_type}", verbose=False)[0]
+        # switch to a new model once it's ready, frames in flight are dropped together with the old one
+        if model_manager.current[1] is not model:
+            (model_type, device_type), model = model_manager.current
+            model.clear()
+            processing_times.clear()
+
+        # start inference and take the oldest frame once the pipeline is full
+        model.submit(frame)
+        if model.pending < pipeline_depth:
+            continue
+        frame, _, result = model.get()
         processing_times.append(result.speed["inference"])
 
-        # convert to supervision detections
-        detections = sv.Detections.from_ultralytics(result)
-        # filter out other predictions than selected category
-        detections = detections[detections.class_id == category_id]
+        # convert to supervision detections (only the selected category is kept by the model)
+        detections = to_detections(result)
 
         # draw results
-        draw_annotations(frame, detections, tracker, queue_count, object_limit, category, zones, zone_annotators, box_annotators, masks_annotators, label_annotators)
+        draw_annotations(frame, detections, tracker, zone_counter, object_limit, category, zones, zone_labels, zone_annotators, box_annotators, masks_annotators, label_annotators)
 
         # Mean processing time [ms].
         processing_time = np.mean(processing_times)
@@ -216,6 +283,8 @@ def run(video_path: str, model_paths: Tuple[Path, Path], model_name: str = "", c
         fps = 1000 / processing_time
         utils.draw_text(frame, text=f"Inference time: {processing_time:.0f}ms ({fps:.1f} FPS)", point=(10, 10))
         utils.draw_text(frame, text=f"Currently running {model_name} ({model_type}) on {device_type}", point=(10, 50))
+        if model_manager.loading_key is not None:
+            utils.draw_text(frame, text=f"Loading {model_name} ({model_manager.loading_key[0]}) on {model_manager.loading_key[1]}...", point=(10, 90))
 
         # Draw control panel & watermark
         utils.draw_control_panel(frame, devices_mapping)
@@ -228,29 +297,142 @@ def run(video_path: str, model_paths: Tuple[Path, Path], model_name: str = "", c
         if key in (27, ord('q')):
             break
 
-        # handle keypress for precision/device
-        model_changed = False
+        # handle keypress for precision/device, on top of what was requested before
+        requested_type, requested_device = model_manager.requested_key
 
         if key == ord('f'):
-            model_type = "FP16"
-            model_changed = True
+            requested_type = "FP16"
         elif key == ord('i'):
-            model_type = "INT8"
-            model_changed = True
+            requested_type = "INT8"
         for i, dev in enumerate(devices_mapping.keys()):
             if key == ord('1') + i:
-                device_type = dev
-                model_changed = True
+                requested_device = dev
 
-        if model_changed:
-            del model
-            model = get_model(model_mapping[model_type], verbose=False)
-            processing_times.clear()
+        if (requested_type, requested_device) != model_manager.requested_key:
+            # the current model keeps running until the new one is compiled
+            model_manager.request((requested_type, requested_device))
 
     player.stop()
     cv2.destroyAllWindows()
 
 
+def write_counts(counts_file, frame_id: int, timestamp: float, zone_counts: Dict[int, int], as_csv: bool) -> None:
+    if as_csv:
+        counts_file.write(",".join([str(frame_id), f"{timestamp:.3f}"] + [str(count) for count in zone_counts.values()]) + "\n")
+    else:
+        counts_file.write(json.dumps({"frame": frame_id, "time": round(timestamp, 3), "counts": {str(zone_id): count for zone_id, count in zone_counts.items()}}) + "\n")
+
+
+def print_latency_report(stage_times: Dict[str, List[float]], frames: int, total_time: float) -> None:
+    print(f"Processed {frames} frames in {total_time:.1f}s ({frames / total_time if total_time > 0 else 0:.1f} FPS end-to-end)")
+    print(f"{'stage':<12}{'p50 [ms]':>10}{'p95 [ms]':>10}{'p99 [ms]':>10}")
+    for stage, times in stage_times.items():
+        if not times:
+            continue
+        p50, p95, p99 = np.percentile(times, [50, 95, 99])
+        print(f"{stage:<12}{p50:>10.1f}{p95:>10.1f}{p99:>10.1f}")
+
+
+def run_headless(video_path: str, model_paths: Tuple[Path, Path], category: str = "person", zones_config_file: str = "", object_limit: int = 3,
+                 flip: bool = False, tracker_frames: int = 1800, colorful: bool = False, last_frames: int = 50, device: str = "AUTO",
+                 precision: str = "INT8", counts_path: str = "counts.csv", output_video_path: str = "") -> None:
+    model_mapping = {
+        "FP16": model_paths[0],
+        "INT8": model_paths[1],
+    }
+    category_id = CATEGORIES.index(category)
+    # as many requests in flight as the device handles best
+    model = get_model(model_mapping[precision], device, category_id)
+
+    # read the file directly as fast as inference allows, VideoPlayer would pace it to the source FPS
+    cap = cv2.VideoCapture(video_path)
+    if not cap.isOpened():
+        raise RuntimeError(f"Cannot open {video_path}")
+    source_fps = cap.get(cv2.CAP_PROP_FPS)
+    if source_fps <= 0:
+        source_fps = 30
+    # zones are defined for the resolution of the live demo
+    frame_size = (1920, 1080)
+
+    zones, zone_annotators, box_annotators, masks_annotators, label_annotators = get_annotators(json_path=zones_config_file, resolution_wh=frame_size, colorful=colorful)
+    zone_labels = get_zone_labels(zones_config_file, resolution_wh=frame_size)
+
+    zone_counter = ZoneCounter(len(zones), last_frames)
+    tracker = DeepSort(max_age=tracker_frames, n_init=3)
+
+    writer = None
+    if output_video_path:
+        writer = cv2.VideoWriter(output_video_path, cv2.VideoWriter.fourcc(*"mp4v"), source_fps, frame_size)
+
+    as_csv = Path(counts_path).suffix.lower() == ".csv"
+    counts_file = open(counts_path, "w")
+    if as_csv:
+        counts_file.write(",".join(["frame", "time"] + [f"zone_{zone_id}" for zone_id in range(1, len(zones) + 1)]) + "\n")
+
+    stage_times = {stage: [] for stage in ["decode", "preprocess", "inference", "postprocess", "counting", "output", "total"]}
+    frame_id = 0
+    source_ended = False
+    start_time = time.perf_counter()
+    try:
+        while True:
+            if not source_ended:
+                t0 = time.perf_counter()
+                ret, frame = cap.read()
+                if ret:
+                    if frame.shape[1::-1] != frame_size:
+                        frame = cv2.resize(frame, frame_size, interpolation=cv2.INTER_AREA if frame.shape[1] > frame_size[0] else cv2.INTER_LINEAR)
+                    if flip:
+                        frame = cv2.flip(frame, 1)
+                    model.submit(frame, (t0, (time.perf_counter() - t0) * 1000))
+                    # keep all requests busy before taking any result
+                    if model.pending < model.num_requests:
+                        continue
+                else:
+                    source_ended = True
+
+            # results come in the frame order, after the source ends the pipeline is drained
+            output = model.get()
+            if output is None:
+                break
+            frame, (t0, decode_time), result = output
+
+            t1 = time.perf_counter()
+            zone_counts = draw_annotations(frame, to_detections(result), tracker, zone_counter, object_limit, category, zones, zone_labels, zone_annotators,
+                                           box_annotators, masks_annotators, label_annotators, annotate=writer is not None)
+            t2 = time.perf_counter()
+
+            write_counts(counts_file, frame_id, frame_id / source_fps, zone_counts, as_csv)
+            if writer is not None:
+                utils.draw_ov_watermark(frame)
+                writer.write(frame)
+            t3 = time.perf_counter()
+
+            stage_times["decode"].append(decode_time)
+            # inference also includes the time waiting for a free request
+            stage_times["preprocess"].append(result.speed["preprocess"])
+            stage_times["inference"].append(result.speed["inference"])
+            stage_times["postprocess"].append(result.speed["postprocess"])
+            stage_times["counting"].append((t2 - t1) * 1000)
+            stage_times["output"].append((t3 - t2) * 1000)
+            stage_times["total"].append((t3 - t0) * 1000)
+
+            frame_id += 1
+            if frame_id % 1000 == 0:
+                log.info(f"Processed {frame_id} frames")
+    # ctrl-c
+    except KeyboardInterrupt:
+        print("Interrupted")
+    finally:
+        total_time = time.perf_counter() - start_time
+        model.wait_all()
+        cap.release()
+        counts_file.close()
+        if writer is not None:
+            writer.release()
+
+    print_latency_report(stage_times, frame_id, total_time)
+
+
 if __name__ == '__main__':
     parser = argparse.ArgumentParser()
     parser.add_argument('--stream', default="0", type=str, help="Path to a video file or the webcam number")
@@ -261,10 +443,23 @@ if __name__ == '__main__':
     parser.add_argument('--category', type=str, default="person", choices=CATEGORIES, help="The category to detect (from COCO dataset)")
     parser.add_argument('--zones_config_file', type=str, default="zones.json", help="Path to the zone config file (json)")
     parser.add_argument('--object_limit', type=int, default=3, help="The maximum number of objects in the area")
-    parser.add_argument("--flip", type=bool, default=True, help="Mirror input video")
+    parser.add_argument("--flip", type=lambda value: value.lower() in ("true", "1", "yes"), default=None,
+                        help="Mirror input video (true or false, mirrored by default only when displayed)")
     parser.add_argument('--colorful', action="store_true", help="If objects should be annotated with random colors")
     parser.add_argument('--tracker_frames', type=int, default=1800, help="Maximum number of missed frames for the tracker")
+    parser.add_argument('--headless', action="store_true", help="Process the video file as fast as possible without displaying it")
+    parser.add_argument('--device', type=str, default="AUTO", help="Device to run inference on in the headless mode")
+    parser.add_argument('--precision', type=str, default="INT8", choices=["FP16", "INT8"], help="Model precision in the headless mode")
+    parser.add_argument('--counts_output', type=str, default="counts.csv", help="Path to the per-frame zone counts in the headless mode (.csv or .jsonl)")
+    parser.add_argument('--video_output', type=str, default="", help="Path to the annotated output video in the headless mode (disabled if empty)")
 
     args = parser.parse_args()
     model_paths = convert(args.model_name, Path(args.model_dir))
-    run(args.stream, model_paths, args.model_name, args.category, args.zones_config_file, args.object_limit, args.tracker_frames, args.flip, args.colorful)
+    # a webcam is mirrored, recorded footage processed in the headless mode isn't
+    flip = args.flip if args.flip is not None else not args.headless
+    if args.headless:
+        run_headless(args.stream, model_paths, category=args.category, zones_config_file=args.zones_config_file, object_limit=args.object_limit,
+                     flip=flip, tracker_frames=args.tracker_frames, colorful=args.colorful, device=args.device, precision=args.precision,
+                     counts_path=args.counts_output, output_video_path=args.video_output)
+    else:
+        run(args.stream, model_paths, args.model_name, args.category, args.zones_config_file, args.object_limit, flip, args.tracker_frames, args.colorful)
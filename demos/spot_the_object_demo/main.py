@@ -10,13 +10,13 @@ import numpy as np
 from supervision import BoxCornerAnnotator, LabelAnnotator, TraceAnnotator, LineZoneAnnotator, LineZone, ByteTrack, \
     Point, Detections, Color, ColorLookup, DetectionsSmoother
 from supervision.annotators.base import BaseAnnotator
-from ultralytics import YOLOE, YOLO, YOLOWorld
-from ultralytics.engine.results import Results
+from ultralytics import YOLOE, YOLOWorld
 
 SCRIPT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "utils")
 sys.path.append(os.path.dirname(SCRIPT_DIR))
 
 from utils import demo_utils as utils
+from utils.yolo_pipeline import YOLOPipeline, YOLOResult
 
 MODEL_DIR = Path("model")
 DATA_DIR = Path("data")
@@ -27,7 +27,7 @@ NULL_CLASSES = ["person", "hand", "finger", "fabric"]
 PROBABILITY_COEFFICIENT = 15
 
 
-def load_yolo_model(model_name: str, main_class: str, aux_classes: list[str]) -> YOLO:
+def load_yolo_model(model_name: str, main_class: str, aux_classes: list[str], device: str, num_requests: int) -> YOLOPipeline:
     # set classes to detect
     classes = [main_class] + aux_classes + NULL_CLASSES
 
@@ -42,7 +42,8 @@ def load_yolo_model(model_name: str, main_class: str, aux_classes: list[str]) ->
 
     model_path = model.export(format="openvino", dynamic=False, half=True)
 
-    return YOLO(model_path)
+    # compile the exported model directly with OpenVINO, keeping several requests in flight, only boxes are used
+    return YOLOPipeline(model_path, device=device, conf=0.01, num_requests=num_requests, with_masks=False)
 
 
 def load_annotators(size: tuple[int, int]) -> tuple[list[BaseAnnotator], LineZone, ByteTrack, DetectionsSmoother]:
@@ -81,8 +82,8 @@ def add_box_margin(box: tuple[int], frame_size: tuple[int], margin_ratio: float
     return int(new_x1), int(new_y1), int(new_x2), int(new_y2)
 
 
-def filter_and_process_results(main_class: str, aux_classes: list[str], det_results: Results, tracker: ByteTrack, smoother: DetectionsSmoother, line_zone: LineZone) -> Detections:
-    detections = Detections.from_ultralytics(det_results)
+def filter_and_process_results(main_class: str, aux_classes: list[str], det_results: YOLOResult, tracker: ByteTrack, smoother: DetectionsSmoother, line_zone: LineZone) -> Detections:
+    detections = Detections(xyxy=det_results.xyxy, confidence=det_results.confidence, class_id=det_results.class_id)
     # we have to increase probabilities, which are very low in case of YOLOWorld to be able to use tracking
     detections.confidence *= PROBABILITY_COEFFICIENT
 
@@ -122,7 +123,9 @@ def draw_results(frame: np.ndarray, annotators: list[BaseAnnotator], line_zone:
 
 
 def run(video_path: str, det_model_name: str, device: str, main_class: str, aux_classes: list[str], flip: bool):
-    det_model = load_yolo_model(det_model_name, main_class, aux_classes)
+    # two frames in flight, so drawing one frame overlaps inference of the next one
+    pipeline_depth = 2
+    det_model = load_yolo_model(det_model_name, main_class, aux_classes, device, pipeline_depth)
 
     qr_code = utils.get_qr_code("https://github.com/openvinotoolkit/openvino_build_deploy/tree/master/demos/spot_the_object_demo", with_embedded_image=True)
 
@@ -130,7 +133,8 @@ def run(video_path: str, det_model_name: str, device: str, main_class: str, aux_
     # initialize video player to deliver frames
     if isinstance(video_path, str) and video_path.isnumeric():
         video_path = int(video_path)
-    player = utils.VideoPlayer(video_path, size=video_size, fps=60, flip=flip)
+    # frames stay in the player's buffers while they are in the pipeline
+    player = utils.VideoPlayer(video_path, size=video_size, fps=60, flip=flip, buffer_size=pipeline_depth + 2, max_borrowed=pipeline_depth)
     annotators, line_zone, tracker, smoother = load_annotators(video_size)
 
     processing_times = deque(maxlen=100)
@@ -148,18 +152,22 @@ def run(video_path: str, det_model_name: str, device: str, main_class: str, aux_
             print("Source ended")
             break
 
-        f_height, f_width = frame.shape[:2]
+        # start inference and take the oldest frame once the pipeline is full
+        det_model.submit(frame)
+        if det_model.pending < pipeline_depth:
+            continue
+        frame, _, det_results = det_model.get()
 
         start_time = time.time()
+        inference_time = det_results.speed["inference"] / 1000
 
-        det_results = det_model.predict(frame, conf=0.01, verbose=False, device=f"intel:{device.lower()}")[0]
         det_results = filter_and_process_results(main_class, aux_classes, det_results, tracker, smoother, line_zone)
 
         end_time = time.time()
 
         draw_results(frame, annotators, line_zone, det_results)
 
-        processing_times.append(end_time - start_time)
+        processing_times.append(inference_time + end_time - start_time)
         # mean processing time [ms]
         processing_time = np.mean(processing_times) * 1000
 
@@ -2,20 +2,19 @@ import argparse
 import collections
 import os
 import sys
-import time
 from pathlib import Path
 from typing import Tuple
 
 import cv2
 import numpy as np
-import openvino as ov
 from ultralytics import YOLO
-from ultralytics.engine.results import Results
 
 SCRIPT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "utils")
 sys.path.append(os.path.dirname(SCRIPT_DIR))
 
 from utils import demo_utils as utils
+from utils.model_manager import ModelManager
+from utils.yolo_pipeline import YOLOPipeline, YOLOResult
 
 
 def export_model(model_name: str) -> Path:
@@ -31,21 +30,9 @@ def export_model(model_name: str) -> Path:
     return ov_model_path / f"{model_name}.xml"
 
 
-def load_and_compile_model(model_path: Path, device: str) -> YOLO:
-    core = ov.Core()
-    model = core.read_model(model_path)
-    compiled_model = core.compile_model(model=model, device_name=device, config={"PERFORMANCE_HINT": "LATENCY"})
-
-    pose_model = YOLO(model_path.parent, task="pose")
-
-    if pose_model.predictor is None:
-        custom = {"conf": 0.25, "batch": 1, "save": False, "mode": "predict"}  # method defaults
-        pose_model.predictor = pose_model._smart_load("predictor")(overrides={**pose_model.overrides, **custom}, _callbacks=pose_model.callbacks)
-        pose_model.predictor.setup_model(model=pose_model.model)
-
-    pose_model.predictor.model.ov_compiled_model = compiled_model
-
-    return pose_model
+def load_and_compile_model(model_path: Path, device: str, num_requests: int) -> YOLOPipeline:
+    # compile the exported model directly with OpenVINO, keeping several requests in flight
+    return YOLOPipeline(model_path, device=device, conf=0.25, num_requests=num_requests)
 
 
 colors = ((255, 0, 0), (255, 0, 255), (170, 0, 255), (255, 0, 85), (255, 0, 170), (85, 255, 0),
@@ -56,10 +43,10 @@ default_skeleton = ((15, 13), (13, 11), (16, 14), (14, 12), (11, 12), (5, 11), (
                     (6, 8), (7, 9), (8, 10), (1, 2), (0, 1), (0, 2), (1, 3), (2, 4), (3, 5), (4, 6))
 
 
-def draw_poses(img: np.ndarray, detections: Results, point_score_threshold: float = 0.5, skeleton: Tuple[Tuple[int, int]] = default_skeleton):
+def draw_poses(img: np.ndarray, detections: YOLOResult, point_score_threshold: float = 0.5, skeleton: Tuple[Tuple[int, int]] = default_skeleton):
     keypoints = detections.keypoints
-    poses = keypoints.xy.numpy()
-    scores = keypoints.conf.numpy() if keypoints.conf is not None else np.ones_like(poses[..., 0])
+    poses = keypoints[..., :2]
+    scores = keypoints[..., 2] if keypoints.shape[-1] == 3 else np.ones_like(poses[..., 0])
     if poses.size == 0:
         return img
 
@@ -84,14 +71,19 @@ def run_pose_estimation(source: str, model_name: str, device: str, flip: bool =
     qr_code = utils.get_qr_code("https://github.com/openvinotoolkit/openvino_build_deploy/tree/master/demos/strike_a_pose_demo", with_embedded_image=True)
 
     model_path = export_model(model_name)
-    pose_model = load_and_compile_model(model_path, device)
+    # two frames in flight, so drawing one frame overlaps inference of the next one
+    pipeline_depth = 2
+    # models for other devices are compiled in the background when requested
+    model_manager = ModelManager(lambda dev: load_and_compile_model(model_path, dev, pipeline_depth), device)
+    device, pose_model = model_manager.current
 
     player = None
     try:
         if isinstance(source, str) and source.isnumeric():
             source = int(source)
         # Create a video player to play with target fps.
-        player = utils.VideoPlayer(source, flip=flip, fps=30, size=(1920, 1080))
+        # frames stay in the player's buffers while they are in the pipeline
+        player = utils.VideoPlayer(source, flip=flip, fps=30, size=(1920, 1080), buffer_size=pipeline_depth + 2, max_borrowed=pipeline_depth)
         # Start capturing.
         player.start()
         title = "Press ESC to Exit"
@@ -107,16 +99,22 @@ def run_pose_estimation(source: str, model_name: str, device: str, flip: bool =
                 print("Source ended")
                 break
 
-            # Measure processing time.
-            start_time = time.time()
-            # Get results.
-            results = pose_model(frame, verbose=False)[0]
-            stop_time = time.time()
+            # Switch to a new model once it's ready, frames in flight are dropped together with the old one.
+            if model_manager.current[1] is not pose_model:
+                device, pose_model = model_manager.current
+                pose_model.clear()
+                processing_times.clear()
+
+            # Start inference and take the oldest frame once the pipeline is full.
+            pose_model.submit(frame)
+            if pose_model.pending < pipeline_depth:
+                continue
+            frame, _, results = pose_model.get()
 
             # Draw poses on a frame.
             frame = draw_poses(frame, results)
 
-            processing_times.append(stop_time - start_time)
+            processing_times.append(results.speed["inference"] / 1000)
             # Use processing times from last 200 frames.
             if len(processing_times) > 200:
                 processing_times.popleft()
@@ -127,6 +125,8 @@ def run_pose_estimation(source: str, model_name: str, device: str, flip: bool =
             fps = 1000 / processing_time
             utils.draw_text(frame, text=f"Currently running {model_name} (INT8) on {device}", point=(10, 10))
             utils.draw_text(frame, f"Inference time: {processing_time:.1f}ms ({fps:.1f} FPS)", (10, 50))
+            if model_manager.loading_key is not None:
+                utils.draw_text(frame, f"Loading {model_name} on {model_manager.loading_key}...", (10, 90))
 
             # Draw watermark
             utils.draw_ov_watermark(frame)
@@ -141,12 +141,8 @@ def run_pose_estimation(source: str, model_name: str, device: str, flip: bool =
 
             for i, dev in enumerate(device_mapping.keys()):
                 if key == ord('1') + i:
-                    del pose_model
-                    device = dev
-
-                    pose_model = load_and_compile_model(model_path, device)
-
-                    processing_times.clear()
+                    # the current model keeps running until the new one is compiled
+                    model_manager.request(dev)
     # ctrl-c
     except KeyboardInterrupt:
         print("Interrupted")
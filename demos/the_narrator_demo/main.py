@@ -1,10 +1,12 @@
 import argparse
 import logging as log
+import math
 import os
 import sys
 import threading
 import time
-from collections import deque
+from collections import Counter, deque
+from dataclasses import dataclass
 from functools import partial
 from pathlib import Path
 
@@ -23,12 +25,15 @@ SCRIPT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "uti
 sys.path.append(os.path.dirname(SCRIPT_DIR))
 
 from utils import demo_utils as utils
+from utils.model_manager import ModelManager
 
 MODEL_DIR = Path("models")
 TEXT_CONFIG = BlipTextConfig()
 
-current_frames = deque(maxlen=1)
-captions = deque(maxlen=1000)   # keep history for summary + latest for display
+current_frames = {}  # stream id: the newest frame
+captions = deque(maxlen=1000)   # keep history for summary
+latest_captions = {}  # stream id: the newest caption for display
+caption_stats = Counter()  # how many captions were generated or reused
 
 processing_times = deque(maxlen=100)
 
@@ -106,11 +111,11 @@ def load_models(model_name: str, device: str = "AUTO") -> tuple[ov.CompiledModel
     return vision_model, text_model, processor
 
 
-def init_past_inputs(model_inputs: list) -> list[ov.Tensor]:
+def init_past_inputs(model_inputs: list, batch_size: int = 1) -> list[ov.Tensor]:
     past_inputs = []
     for input_tensor in model_inputs[4:]:
         partial_shape = input_tensor.partial_shape
-        partial_shape[0] = 1
+        partial_shape[0] = batch_size
         partial_shape[2] = 0
         past_inputs.append(ov.Tensor(ov.Type.f32, partial_shape.get_shape()))
     return past_inputs
@@ -121,7 +126,7 @@ def text_decoder_forward(ov_text_decoder_with_past: ov.CompiledModel, input_ids:
                          **kwargs) -> CausalLMOutputWithCrossAttentions:
     inputs = [input_ids, attention_mask, encoder_hidden_states, encoder_attention_mask]
     if past_key_values is None:
-        inputs.extend(init_past_inputs(ov_text_decoder_with_past.inputs))
+        inputs.extend(init_past_inputs(ov_text_decoder_with_past.inputs, input_ids.shape[0]))
     else:
         inputs.extend(past_key_values)
 
@@ -133,37 +138,132 @@ def text_decoder_forward(ov_text_decoder_with_past: ov.CompiledModel, input_ids:
                                              attentions=None, cross_attentions=None)
 
 
-def generate_caption(image: np.array, vision_model: ov.CompiledModel, text_decoder: BlipTextLMHeadModel, processor: BlipProcessor) -> str:
-    image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
-    pixel_values = np.array(processor(image).pixel_values)
-    image_embeds = vision_model(np.array(pixel_values))[vision_model.output(0)]
-    
+@dataclass
+class SceneState:
+    """
+    The last captioned scene of a stream
+    """
+    frame_hash: np.ndarray = None
+    # mean of the image embeddings, normalized
+    embedding: np.ndarray = None
+    caption: str = ""
+
+
+def frame_hash(frame: np.ndarray, hash_size: int = 8) -> np.ndarray:
+    """
+    Difference hash: signs of horizontal gradients of a tiny grayscale image. It's cheap and robust to noise
+    and small light changes, so close hashes mean the same scene.
+
+    :return: hash_size * hash_size bits as a boolean array
+    """
+    small = cv2.resize(frame, (hash_size + 1, hash_size), interpolation=cv2.INTER_AREA)
+    small = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+    return (small[:, 1:] > small[:, :-1]).ravel()
+
+
+def generate_captions(frames: dict[int, np.ndarray], vision_model: ov.CompiledModel, text_decoder: BlipTextLMHeadModel,
+                      processor: BlipProcessor, scenes: dict[int, SceneState], hash_threshold: int = 4,
+                      similarity_threshold: float = 0.95) -> dict[int, str]:
+    """
+    Caption the newest frames of all streams. A frame is captioned only if its scene changed:
+    static scenes (close frame hashes) reuse the last caption without any inference, and scenes with almost
+    the same image embeddings reuse it without running the text decoder. Frames of all streams go through
+    the vision encoder and the text decoder in one batch.
+
+    :param frames: Stream id and its frame (BGR)
+    :param scenes: Stream id and its last captioned scene, updated in place
+    :param hash_threshold: Maximal number of different hash bits for a static scene
+    :param similarity_threshold: Minimal cosine similarity of embeddings for the same scene
+    :return: Stream id and the caption
+    """
+    results = {}
+
+    # static scenes, nothing to compute
+    hashes = {stream_id: frame_hash(frame) for stream_id, frame in frames.items()}
+    for stream_id, hash_bits in hashes.items():
+        scene = scenes.setdefault(stream_id, SceneState())
+        if scene.caption and np.count_nonzero(scene.frame_hash != hash_bits) <= hash_threshold:
+            results[stream_id] = scene.caption
+            caption_stats["static"] += 1
+
+    stream_ids = [stream_id for stream_id in frames if stream_id not in results]
+    if not stream_ids:
+        return results
+
+    # all changed frames through the vision encoder at once
+    images = [cv2.cvtColor(frames[stream_id], cv2.COLOR_BGR2RGB) for stream_id in stream_ids]
+    pixel_values = np.array(processor(images).pixel_values)
+    image_embeds = vision_model(pixel_values)[vision_model.output(0)]
+    embeddings = image_embeds.mean(axis=1)
+    embeddings /= np.linalg.norm(embeddings, axis=1, keepdims=True) + 1e-6
+
+    # similar scenes don't need a new caption
+    to_generate = []
+    for i, stream_id in enumerate(stream_ids):
+        scene = scenes[stream_id]
+        scene.frame_hash = hashes[stream_id]
+        if scene.caption and np.dot(scene.embedding, embeddings[i]) >= similarity_threshold:
+            results[stream_id] = scene.caption
+            caption_stats["similar"] += 1
+        else:
+            to_generate.append(i)
+
+    if not to_generate:
+        return results
+
+    # the rest is captioned in one batch
+    image_embeds = image_embeds[to_generate]
     image_attention_mask = np.ones(image_embeds.shape[:-1], dtype=np.int64)
-    input_ids = np.array([[TEXT_CONFIG.bos_token_id, TEXT_CONFIG.eos_token_id]], dtype=np.int64)
+    input_ids = np.full((len(to_generate), 1), TEXT_CONFIG.bos_token_id, dtype=np.int64)
 
     outputs = text_decoder.generate(
-        input_ids=torch.LongTensor(input_ids[:, :-1]),
+        input_ids=torch.LongTensor(input_ids),
         eos_token_id=TEXT_CONFIG.sep_token_id,
         pad_token_id=TEXT_CONFIG.pad_token_id,
         encoder_hidden_states=image_embeds,
         encoder_attention_mask=image_attention_mask
     )
-    return processor.decode(outputs[0], skip_special_tokens=True)
+    for i, caption in zip(to_generate, processor.batch_decode(outputs, skip_special_tokens=True)):
+        stream_id = stream_ids[i]
+        scenes[stream_id].embedding = embeddings[i]
+        scenes[stream_id].caption = caption
+        results[stream_id] = caption
+        caption_stats["generated"] += 1
+
+    return results
 
 
-def inference_worker(vision_model, text_decoder, processor):
-    global current_frames, captions, processing_times
+def inference_worker(model_manager: ModelManager):
+    global current_frames, captions, latest_captions, processing_times
 
+    scenes = {}
+    models = None
     while not global_stop_event.is_set():
+        # take the newest models for every frame, they are swapped in the background after a device change
+        if model_manager.model is not models:
+            models = model_manager.model
+            # embeddings from another device could differ a bit, so start from scratch
+            scenes.clear()
+        vision_model, text_decoder, processor = models
+
         with global_frame_lock:
-            frame = current_frames.pop() if len(current_frames) > 0 else np.zeros((1080, 1920, 3), dtype=np.uint8)
+            frames = dict(current_frames)
+            current_frames.clear()
+
+        if not frames:
+            time.sleep(0.01)
+            continue
 
         start_time = time.perf_counter()
-        caption = generate_caption(frame, vision_model, text_decoder, processor)
+        new_captions = generate_captions(frames, vision_model, text_decoder, processor, scenes)
         elapsed = time.perf_counter() - start_time
 
         with global_result_lock:
-            captions.append(caption)
+            for stream_id, caption in new_captions.items():
+                # only new captions go to the history, so the summary doesn't repeat static scenes
+                if latest_captions.get(stream_id) != caption:
+                    captions.append(caption)
+                latest_captions[stream_id] = caption
             processing_times.append(elapsed)
 
 
@@ -201,8 +301,8 @@ def summarize_captions_with_ov_llmpipeline(captions_list, ov_model_path, device)
     print("\n[STREAM END]", flush=True)
 
 
-def run(video_path: str, model_name: str, flip: bool = True, summary_ov_model: str = "") -> None:
-    global current_frames, captions, processing_times
+def run(video_paths: list[str], model_name: str, flip: bool = True, summary_ov_model: str = "") -> None:
+    global current_frames, captions, latest_captions, processing_times
     # set up logging
     log.getLogger().setLevel(log.INFO)
 
@@ -212,12 +312,21 @@ def run(video_path: str, model_name: str, flip: bool = True, summary_ov_model: s
     device_mapping = utils.available_devices(exclude=["NPU"])
     device_type = "AUTO"
 
-    vision_model, text_decoder, processor = load_models(model_name, device_type)
+    # models for other devices are compiled in the background when requested
+    model_manager = ModelManager(lambda device: load_models(model_name, device), device_type)
 
-    # initialize video player to deliver frames
-    if isinstance(video_path, str) and video_path.isnumeric():
-        video_path = int(video_path)
-    player = utils.VideoPlayer(video_path, size=(1920, 1080), fps=60, flip=flip)
+    # streams are shown in a grid, every player delivers frames of the grid cell size
+    grid_cols = math.ceil(math.sqrt(len(video_paths)))
+    grid_rows = math.ceil(len(video_paths) / grid_cols)
+    cell_width, cell_height = 1920 // grid_cols, 1080 // grid_rows
+    canvas = np.zeros((cell_height * grid_rows, cell_width * grid_cols, 3), dtype=np.uint8)
+
+    # initialize video players to deliver frames
+    players = []
+    for video_path in video_paths:
+        if isinstance(video_path, str) and video_path.isnumeric():
+            video_path = int(video_path)
+        players.append(utils.VideoPlayer(video_path, size=(cell_width, cell_height), fps=60, flip=flip))
 
     # keep at most 100 last times
     processing_times = deque(maxlen=100)
@@ -229,45 +338,62 @@ def run(video_path: str, model_name: str, flip: bool = True, summary_ov_model: s
     # Start the inference thread
     worker = threading.Thread(
         target=inference_worker,
-        args=(vision_model, text_decoder, processor),
+        args=(model_manager,),
         daemon=True
     )
     worker.start()
 
-    # start a video stream
-    player.start()
+    # start video streams
+    for player in players:
+        player.start()
     t1 = time.time()
-    caption = ""
+    stream_captions = {}
     while True:
-        # Grab the frame.
-        frame = player.next()
-        if frame is None:
+        # Grab the frames.
+        frames = [player.next() for player in players]
+        if any(frame is None for frame in frames):
             print("Source ended")
             break
 
-        # Update the latest frame for inference
+        # Update the latest frames for inference, the player's frame is reused after the next call so copy it
         with global_frame_lock:
-            current_frames.append(frame)
+            for stream_id, frame in enumerate(frames):
+                current_frames[stream_id] = frame.copy()
+
+        if len(frames) == 1:
+            frame = frames[0]
+        else:
+            frame = canvas
+            for stream_id, stream_frame in enumerate(frames):
+                row, col = divmod(stream_id, grid_cols)
+                frame[row * cell_height:(row + 1) * cell_height, col * cell_width:(col + 1) * cell_width] = stream_frame
 
         f_height, f_width = frame.shape[:2]
 
-        # Get the latest caption
+        # Get the latest captions
         with global_result_lock:
             t2 = time.time()
-            # update the caption only if the time difference is significant, otherwise it will be flickering
-            if t2 - t1 > 1 or not caption:
-                caption = captions.pop() if len(captions) > 0 else ""
+            # update the captions only if the time difference is significant, otherwise they will be flickering
+            if t2 - t1 > 1 or not stream_captions:
+                stream_captions = dict(latest_captions)
                 t1 = t2
 
             # Get the mean processing time
             processing_time = np.mean(processing_times) * 1000 if processing_times else 0
             fps = 1000 / processing_time if processing_time > 0 else 0
+            reused_captions = caption_stats["static"] + caption_stats["similar"]
+            reused_ratio = reused_captions / max(1, reused_captions + caption_stats["generated"])
 
         # Draw the results on the frame
-        utils.draw_text(frame, text=caption, point=(f_width // 2, f_height - 50), center=True, font_scale=1.5, with_background=True)
-        utils.draw_text(frame, text=f"Inference time: {processing_time:.0f}ms ({fps:.1f} FPS)", point=(10, 10))
+        for stream_id, caption in stream_captions.items():
+            row, col = divmod(stream_id, grid_cols)
+            utils.draw_text(frame, text=caption, point=(col * cell_width + cell_width // 2, (row + 1) * cell_height - 50), center=True,
+                            font_scale=1.5 / grid_cols, with_background=True)
+        utils.draw_text(frame, text=f"Inference time: {processing_time:.0f}ms ({fps:.1f} FPS), captions reused: {reused_ratio:.0%}", point=(10, 10))
         utils.draw_text(frame, text=f"Currently running {model_name} on {device_type}", point=(10, 50))
         utils.draw_text(frame, text=f"Press ESC to get text summary", point=(10, 90))
+        if model_manager.loading_key is not None:
+            utils.draw_text(frame, text=f"Loading {model_name} on {model_manager.loading_key}...", point=(10, 130))
 
         utils.draw_ov_watermark(frame)
         utils.draw_qr_code(frame, qr_code)
@@ -281,34 +407,27 @@ def run(video_path: str, model_name: str, flip: bool = True, summary_ov_model: s
 
         for i, dev in enumerate(device_mapping.keys()):
             if key == ord('1') + i:
-                if device_type != dev:
-                    device_type = dev
-                    # Stop the current worker
-                    global_stop_event.set()
-                    worker.join(timeout=1)
-                    global_stop_event.clear()
-
-                    # Recompile models for the new device
-                    vision_model, text_decoder, processor = load_models(model_name, device_type)
-                    # Start a new inference worker
-                    worker = threading.Thread(
-                        target=inference_worker,
-                        args=(vision_model, text_decoder, processor),
-                        daemon=True
-                    )
-                    worker.start()
-                    # Clear the processing times
-                    with global_result_lock:
-                        processing_times.clear()
-
-    # stop the stream
-    player.stop()
+                # the current models keep running until the new ones are compiled
+                model_manager.request(dev)
+
+        if model_manager.key != device_type:
+            device_type = model_manager.key
+            # Clear the processing times
+            with global_result_lock:
+                processing_times.clear()
+
+    # stop the streams
+    for player in players:
+        player.stop()
     global_stop_event.set()
     # wait 5s to finish inference - should be enough even for weak devices
     worker.join(timeout=5)
     # clean-up windows
     cv2.destroyAllWindows()
 
+    log.info(f"Captions generated: {caption_stats['generated']}, reused for static scenes: {caption_stats['static']}, "
+             f"reused for similar scenes: {caption_stats['similar']}")
+
     if summary_ov_model:
         local_summary_model = asyncio.run(download_model(summary_ov_model))
         print("\n" + "=" * 60)
@@ -319,7 +438,7 @@ def run(video_path: str, model_name: str, flip: bool = True, summary_ov_model: s
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
-    parser.add_argument("--stream", default="0", type=str, help="Path to a video file or the webcam number")
+    parser.add_argument("--stream", default=["0"], type=str, nargs="+", help="Paths to video files or webcam numbers, all are captioned together")
     parser.add_argument("--model_name", type=str, default="Salesforce/blip-image-captioning-base", help="Model to be used for captioning",
                         choices=["Salesforce/blip-image-captioning-base", "Salesforce/blip-image-captioning-large"])
     parser.add_argument("--flip", type=bool, default=True, help="Mirror input video")
@@ -45,6 +45,23 @@ class OpenPoseDecoder:
 
         return poses, scores
 
+    @staticmethod
+    def heatmap_nms(heatmaps, kernel_size=3):
+        # Keep only local maxima. 2D max pooling (stride 1, zero padding) is done for all channels at once
+        # as separable maximums of shifted views: over rows and then over columns.
+        h, w = heatmaps.shape[-2:]
+        pad = kernel_size // 2
+        padded = np.pad(heatmaps, ((0, 0), (0, 0), (pad, pad), (pad, pad)), mode="constant")
+
+        pooled_rows = padded[..., :, :w].copy()
+        for k in range(1, kernel_size):
+            np.maximum(pooled_rows, padded[..., :, k:k + w], out=pooled_rows)
+        pooled = pooled_rows[..., :h, :].copy()
+        for k in range(1, kernel_size):
+            np.maximum(pooled, pooled_rows[..., k:k + h, :], out=pooled)
+
+        return heatmaps * (heatmaps == pooled)
+
     def extract_points(self, heatmaps, nms_heatmaps):
         batch_size, channels_num, h, w = heatmaps.shape
         assert batch_size == 1, 'Batch size of 1 only supported'
@@ -111,50 +128,59 @@ class OpenPoseDecoder:
         pose_b = pose_b[:-2]
         return np.all(np.logical_or.reduce((pose_a == pose_b, pose_a < 0, pose_b < 0)))
 
-    def update_poses(self, kpt_a_id, kpt_b_id, all_keypoints, connections, pose_entries, pose_entry_size):
-        for connection in connections:
-            pose_a_idx = -1
-            pose_b_idx = -1
-            for j, pose in enumerate(pose_entries):
-                if pose[kpt_a_id] == connection[0]:
-                    pose_a_idx = j
-                if pose[kpt_b_id] == connection[1]:
-                    pose_b_idx = j
+    def update_poses(self, kpt_a_id, kpt_b_id, all_keypoints, connections, pose_entries, pose_entry_size,
+                     kpt_to_pose):
+        # kpt_to_pose maps a keypoint id to the index of the pose entry containing it (-1 if none), so a pose
+        # is found with a lookup instead of scanning all entries. Every keypoint belongs to one pose at most.
+        # Merged entries are set to None rather than deleted to keep the indices valid.
+        for kpt_a, kpt_b, affinity_score in connections:
+            pose_a_idx = kpt_to_pose[kpt_a]
+            pose_b_idx = kpt_to_pose[kpt_b]
             if pose_a_idx < 0 and pose_b_idx < 0:
                 # Create new pose entry.
                 pose_entry = np.full(pose_entry_size, -1, dtype=np.float32)
-                pose_entry[kpt_a_id] = connection[0]
-                pose_entry[kpt_b_id] = connection[1]
+                pose_entry[kpt_a_id] = kpt_a
+                pose_entry[kpt_b_id] = kpt_b
                 pose_entry[-1] = 2
-                pose_entry[-2] = np.sum(all_keypoints[connection[0:2], 2]) + connection[2]
+                pose_entry[-2] = all_keypoints[kpt_a, 2] + all_keypoints[kpt_b, 2] + affinity_score
+                kpt_to_pose[[kpt_a, kpt_b]] = len(pose_entries)
                 pose_entries.append(pose_entry)
             elif pose_a_idx >= 0 and pose_b_idx >= 0 and pose_a_idx != pose_b_idx:
                 # Merge two poses are disjoint merge them, otherwise ignore connection.
                 pose_a = pose_entries[pose_a_idx]
                 pose_b = pose_entries[pose_b_idx]
                 if self.is_disjoint(pose_a, pose_b):
+                    pose_b_kpts = pose_b[:-2][pose_b[:-2] >= 0].astype(np.int32)
                     pose_a += pose_b
                     pose_a[:-2] += 1
-                    pose_a[-2] += connection[2]
-                    del pose_entries[pose_b_idx]
+                    pose_a[-2] += affinity_score
+                    kpt_to_pose[pose_b_kpts] = pose_a_idx
+                    pose_entries[pose_b_idx] = None
             elif pose_a_idx >= 0 and pose_b_idx >= 0:
                 # Adjust score of a pose.
-                pose_entries[pose_a_idx][-2] += connection[2]
+                pose_entries[pose_a_idx][-2] += affinity_score
             elif pose_a_idx >= 0:
                 # Add a new limb into pose.
                 pose = pose_entries[pose_a_idx]
                 if pose[kpt_b_id] < 0:
-                    pose[-2] += all_keypoints[connection[1], 2]
-                pose[kpt_b_id] = connection[1]
-                pose[-2] += connection[2]
+                    pose[-2] += all_keypoints[kpt_b, 2]
+                else:
+                    # the replaced keypoint doesn't belong to any pose anymore
+                    kpt_to_pose[int(pose[kpt_b_id])] = -1
+                pose[kpt_b_id] = kpt_b
+                kpt_to_pose[kpt_b] = pose_a_idx
+                pose[-2] += affinity_score
                 pose[-1] += 1
             elif pose_b_idx >= 0:
                 # Add a new limb into pose.
                 pose = pose_entries[pose_b_idx]
                 if pose[kpt_a_id] < 0:
-                    pose[-2] += all_keypoints[connection[0], 2]
-                pose[kpt_a_id] = connection[0]
-                pose[-2] += connection[2]
+                    pose[-2] += all_keypoints[kpt_a, 2]
+                else:
+                    kpt_to_pose[int(pose[kpt_a_id])] = -1
+                pose[kpt_a_id] = kpt_a
+                kpt_to_pose[kpt_a] = pose_b_idx
+                pose[-2] += affinity_score
                 pose[-1] += 1
         return pose_entries
 
@@ -179,6 +205,7 @@ class OpenPoseDecoder:
     def group_keypoints(self, all_keypoints_by_type, pafs, pose_entry_size=20):
         all_keypoints = np.concatenate(all_keypoints_by_type, axis=0)
         pose_entries = []
+        kpt_to_pose = np.full(len(all_keypoints), -1, dtype=np.int32)
         # For every limb.
         for part_id, paf_channel in enumerate(self.paf_indices):
             kpt_a_id, kpt_b_id = self.skeleton[part_id]
@@ -230,9 +257,10 @@ class OpenPoseDecoder:
 
             # Update poses with new connections.
             pose_entries = self.update_poses(kpt_a_id, kpt_b_id, all_keypoints,
-                                             connections, pose_entries, pose_entry_size)
+                                             connections, pose_entries, pose_entry_size, kpt_to_pose)
 
-        # Remove poses with not enough points.
+        # Remove merged poses and poses with not enough points.
+        pose_entries = [pose for pose in pose_entries if pose is not None]
         pose_entries = np.asarray(pose_entries, dtype=np.float32).reshape(-1, pose_entry_size)
         pose_entries = pose_entries[pose_entries[:, -1] >= 3]
         return pose_entries, all_keypoints
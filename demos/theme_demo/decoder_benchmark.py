@@ -0,0 +1,160 @@
+import argparse
+import os
+import time
+
+import cv2
+import numpy as np
+from numpy.lib.stride_tricks import as_strided
+
+import themes
+from decoder import OpenPoseDecoder
+
+
+class ReferenceOpenPoseDecoder(OpenPoseDecoder):
+    """
+    The previous decoding path: per-channel pooling for heatmap NMS and grouping scanning all pose entries
+    for every connection. Used only to compare speed and results.
+    """
+
+    @staticmethod
+    def heatmap_nms(heatmaps, kernel_size=3):
+        # 2D pooling in numpy (from: https://stackoverflow.com/a/54966908/1624463)
+        def pool2d(A, kernel_size, stride, padding):
+            A = np.pad(A, padding, mode="constant")
+            output_shape = ((A.shape[0] - kernel_size) // stride + 1, (A.shape[1] - kernel_size) // stride + 1)
+            kernel_size = (kernel_size, kernel_size)
+            A_w = as_strided(A, shape=output_shape + kernel_size,
+                             strides=(stride * A.strides[0], stride * A.strides[1]) + A.strides)
+            A_w = A_w.reshape(-1, *kernel_size)
+            return A_w.max(axis=(1, 2)).reshape(output_shape)
+
+        pooled_heatmaps = np.array([[pool2d(h, kernel_size=kernel_size, stride=1, padding=kernel_size // 2)
+                                     for h in heatmaps[0]]])
+        return heatmaps * (heatmaps == pooled_heatmaps)
+
+    def update_poses(self, kpt_a_id, kpt_b_id, all_keypoints, connections, pose_entries, pose_entry_size,
+                     kpt_to_pose):
+        for connection in connections:
+            pose_a_idx = -1
+            pose_b_idx = -1
+            for j, pose in enumerate(pose_entries):
+                if pose[kpt_a_id] == connection[0]:
+                    pose_a_idx = j
+                if pose[kpt_b_id] == connection[1]:
+                    pose_b_idx = j
+            if pose_a_idx < 0 and pose_b_idx < 0:
+                pose_entry = np.full(pose_entry_size, -1, dtype=np.float32)
+                pose_entry[kpt_a_id] = connection[0]
+                pose_entry[kpt_b_id] = connection[1]
+                pose_entry[-1] = 2
+                pose_entry[-2] = np.sum(all_keypoints[connection[0:2], 2]) + connection[2]
+                pose_entries.append(pose_entry)
+            elif pose_a_idx >= 0 and pose_b_idx >= 0 and pose_a_idx != pose_b_idx:
+                pose_a = pose_entries[pose_a_idx]
+                pose_b = pose_entries[pose_b_idx]
+                if self.is_disjoint(pose_a, pose_b):
+                    pose_a += pose_b
+                    pose_a[:-2] += 1
+                    pose_a[-2] += connection[2]
+                    del pose_entries[pose_b_idx]
+            elif pose_a_idx >= 0 and pose_b_idx >= 0:
+                pose_entries[pose_a_idx][-2] += connection[2]
+            elif pose_a_idx >= 0:
+                pose = pose_entries[pose_a_idx]
+                if pose[kpt_b_id] < 0:
+                    pose[-2] += all_keypoints[connection[1], 2]
+                pose[kpt_b_id] = connection[1]
+                pose[-2] += connection[2]
+                pose[-1] += 1
+            elif pose_b_idx >= 0:
+                pose = pose_entries[pose_b_idx]
+                if pose[kpt_a_id] < 0:
+                    pose[-2] += all_keypoints[connection[0], 2]
+                pose[kpt_a_id] = connection[0]
+                pose[-2] += connection[2]
+                pose[-1] += 1
+        return pose_entries
+
+
+def record_outputs(source: str, device: str, num_frames: int, output_path: str) -> None:
+    """
+    Run the pose estimation model of the Halloween theme on the video and save its outputs
+
+    :param source: Path to a video file or the webcam number
+    :param device: Device to run the model on
+    :param num_frames: Number of frames to record
+    :param output_path: Path to the .npz file
+    """
+    model = themes.HalloweenTheme(device).pose_estimation_model
+    height, width = list(model.input(0).shape)[2:4]
+
+    cap = cv2.VideoCapture(int(source) if source.isnumeric() else source)
+    heatmaps, pafs = [], []
+    while len(heatmaps) < num_frames:
+        ret, frame = cap.read()
+        if not ret:
+            break
+        input_img = cv2.resize(frame, (width, height), interpolation=cv2.INTER_AREA).transpose((2, 0, 1))[np.newaxis]
+        results = model([input_img])
+        heatmaps.append(results[model.output("Mconv7_stage2_L2")])
+        pafs.append(results[model.output("Mconv7_stage2_L1")])
+    cap.release()
+
+    np.savez_compressed(output_path, heatmaps=np.concatenate(heatmaps), pafs=np.concatenate(pafs))
+    print(f"Recorded outputs of {len(heatmaps)} frames to {output_path}")
+
+
+def decode(decoder: OpenPoseDecoder, heatmaps: np.ndarray, pafs: np.ndarray):
+    nms_heatmaps = decoder.heatmap_nms(heatmaps)
+    return decoder(heatmaps, nms_heatmaps, pafs)
+
+
+def run_benchmark(outputs_path: str, repeats: int = 3) -> None:
+    """
+    Decode the recorded outputs with the reference and the current decoder, check the poses are the same
+    and print the decoding times
+
+    :param outputs_path: Path to the .npz file with recorded outputs
+    :param repeats: How many times every frame is decoded
+    """
+    outputs = np.load(outputs_path)
+    all_heatmaps, all_pafs = outputs["heatmaps"], outputs["pafs"]
+
+    decoders = {"reference": ReferenceOpenPoseDecoder(), "current": OpenPoseDecoder()}
+    times = {name: [] for name in decoders}
+    mismatches = 0
+    num_poses = 0
+    for i in range(len(all_heatmaps)):
+        heatmaps, pafs = all_heatmaps[i:i + 1], all_pafs[i:i + 1]
+
+        results = {}
+        for name, decoder in decoders.items():
+            for _ in range(repeats):
+                start_time = time.perf_counter()
+                results[name] = decode(decoder, heatmaps, pafs)
+                times[name].append(time.perf_counter() - start_time)
+
+        (ref_poses, ref_scores), (poses, scores) = results["reference"], results["current"]
+        num_poses += len(ref_poses)
+        if ref_poses.shape != poses.shape or not np.allclose(ref_poses, poses) or not np.allclose(ref_scores, scores):
+            mismatches += 1
+
+    print(f"Frames: {len(all_heatmaps)}, poses: {num_poses}, frames with different poses: {mismatches}")
+    for name, decoder_times in times.items():
+        decoder_times = np.array(decoder_times) * 1000
+        print(f"{name:>10}: mean {decoder_times.mean():.2f} ms, p95 {np.percentile(decoder_times, 95):.2f} ms")
+    print(f"Speedup: {np.mean(times['reference']) / np.mean(times['current']):.1f}x")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--outputs', default="pose_outputs.npz", type=str, help="Path to the recorded network outputs. They're recorded from the stream if the file doesn't exist")
+    parser.add_argument('--stream', default="0", type=str, help="Path to a video file or the webcam number")
+    parser.add_argument('--device', default="CPU", type=str, help="Device to record outputs on")
+    parser.add_argument('--frames', default=100, type=int, help="Number of frames to record")
+    parser.add_argument('--repeats', default=3, type=int, help="How many times every frame is decoded")
+
+    args = parser.parse_args()
+    if not os.path.exists(args.outputs):
+        record_outputs(args.stream, args.device, args.frames, args.outputs)
+    run_benchmark(args.outputs, args.repeats)
@@ -13,6 +13,7 @@ SCRIPT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "uti
 sys.path.append(os.path.dirname(SCRIPT_DIR))
 
 from utils import demo_utils as utils
+from utils.model_manager import ModelManager
 
 
 def load_theme(theme: str, device: str):
@@ -34,6 +35,8 @@ def run_demo(source: str, theme: str, device: str, flip: bool = True):
     qr_code = utils.get_qr_code("https://github.com/openvinotoolkit/openvino_build_deploy/tree/master/demos/theme_demo", with_embedded_image=True)
 
     theme_obj = load_theme(theme, device)
+    # models for other devices are compiled in the background when requested
+    model_manager = ModelManager(theme_obj.compile_models, theme_obj.device, theme_obj.models)
 
     player = None
     try:
@@ -55,6 +58,11 @@ def run_demo(source: str, theme: str, device: str, flip: bool = True):
                 print("Source ended")
                 break
 
+            # Switch to the new models once they are ready.
+            if model_manager.key != theme_obj.device:
+                theme_obj.set_models(*model_manager.current)
+                processing_times.clear()
+
             # Measure processing time.
             start_time = time.time()
 
@@ -76,6 +84,8 @@ def run_demo(source: str, theme: str, device: str, flip: bool = True):
             fps = 1000 / processing_time
             utils.draw_text(frame, text=f"Currently running models ({theme_obj.model_precision}) on {theme_obj.device}", point=(10, 10))
             utils.draw_text(frame, f"Inference time: {processing_time:.1f}ms ({fps:.1f} FPS)", (10, 50))
+            if model_manager.loading_key is not None:
+                utils.draw_text(frame, f"Loading models on {model_manager.loading_key}...", (10, 90))
 
             # Draw watermark
             utils.draw_ov_watermark(frame)
@@ -90,8 +100,8 @@ def run_demo(source: str, theme: str, device: str, flip: bool = True):
 
             for i, dev in enumerate(device_mapping.keys()):
                 if key == ord('1') + i:
-                    theme_obj.load_models(dev)
-                    processing_times.clear()
+                    # the current models keep running until the new ones are compiled
+                    model_manager.request(dev)
     # ctrl-c
     except KeyboardInterrupt:
         print("Interrupted")
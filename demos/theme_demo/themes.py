@@ -1,31 +1,74 @@
 import abc
+import math
 import os
 import sys
 from pathlib import Path
 from typing import Any
-import time
 
 import cv2
 import numpy as np
 import openvino as ov
 
 from decoder import OpenPoseDecoder
-from numpy.lib.stride_tricks import as_strided
 
 SCRIPT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "utils")
 sys.path.append(os.path.dirname(SCRIPT_DIR))
 
 from utils import demo_utils as utils
+from utils.iou_tracker import IoUTracker
+
+
+class ScaledAsset:
+    """
+    An RGBA asset kept as a pyramid of pre-scaled versions with premultiplied alpha. Requested widths are
+    quantized to the pyramid levels (geometric steps), which are built on the first use, so drawing the asset
+    needs no resizing and only integer math.
+
+    :param image: BGRA image
+    :param step: Ratio between widths of consecutive levels
+    :param min_width: Width of the smallest level
+    """
+
+    def __init__(self, image: np.ndarray, step: float = 1.1, min_width: int = 4):
+        self.shape = image.shape
+        self.__step = step
+        self.__min_width = min_width
+        # premultiply once at full resolution, so the scaled levels are filtered correctly,
+        # alpha is multiplied by 255 too to keep the same precision as the colors
+        alpha = image[:, :, 3:4].astype(np.uint16)
+        self.__premultiplied = np.concatenate([image[:, :, :3] * alpha, alpha * 255], axis=2)
+        self.__levels = {}
+
+    def get(self, width: float) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Get the asset scaled to the level closest to the width
+
+        :param width: Requested width in pixels
+        :return: Premultiplied BGR (color * alpha) as uint16 and inverse alpha (255 - alpha) as uint8
+        """
+        level = max(0, round(math.log(max(width, 1) / self.__min_width, self.__step)))
+        if level not in self.__levels:
+            self.__levels[level] = self.__build_level(round(self.__min_width * self.__step ** level))
+        return self.__levels[level]
+
+    def __build_level(self, width: int) -> tuple[np.ndarray, np.ndarray]:
+        height = max(1, round(self.shape[0] * width / self.shape[1]))
+        interpolation = cv2.INTER_AREA if width < self.shape[1] else cv2.INTER_LINEAR
+        scaled = cv2.resize(self.__premultiplied, (width, height), interpolation=interpolation)
+        alpha = (scaled[:, :, 3:4] + 127) // 255
+        # rounding mustn't make the color brighter than alpha allows, the blending would overflow
+        premultiplied = np.minimum(scaled[:, :, :3], alpha * 255)
+        inverse_alpha = (255 - alpha).astype(np.uint8)
+        return premultiplied, inverse_alpha
 
 
 class Theme(abc.ABC):
     def __init__(self):
         self.model_dir = Path(__file__).parent / "model"
         self.assets_dir = Path(__file__).parent / "assets"
-        self.tracked_faces = {}  # track_id: {'box': np.ndarray, ...}
-        self.next_face_id = 0
-        self.iou_threshold = 0.5
-        self.smoothing_tau = 0.3  # seconds
+        self.tracker = IoUTracker(iou_threshold=0.5, smoothing_tau=0.3)
+        self.device = None
+        self.models = {}
 
     def __download_model(self, model_name: str, precision: str):
         model_path = self.model_dir / model_name / precision / f"{model_name}"
@@ -33,19 +76,72 @@ class Theme(abc.ABC):
         utils.download_file(models_dir + model_name + ".bin", model_path.with_suffix(".bin").name, model_path.parent)
         utils.download_file(models_dir + model_name + ".xml", model_path.with_suffix(".xml").name, model_path.parent)
 
-    def _load_model(self, model_name: str, precision: str, device: str):
+    def _load_model(self, model_name: str, precision: str, device: str, dynamic_batch: bool = False):
         model_path = self.model_dir / model_name / precision / f"{model_name}.xml"
         if not model_path.exists():
             self.__download_model(model_name, precision)
 
         core = ov.Core()
         model = core.read_model(model=model_path)
-        compiled_model = core.compile_model(model=model, device_name=device)
+        # NPU needs static shapes, so models stay with batch 1 there and are run per image
+        if dynamic_batch and "NPU" not in device:
+            shape = model.input(0).partial_shape
+            shape[0] = -1
+            model.reshape(shape)
+        # the cache makes compiling for a device the second time much faster
+        compiled_model = core.compile_model(model=model, device_name=device, config={"CACHE_DIR": "cache"})
         return compiled_model
 
-    def _load_asset(self, asset_name: str):
+    def load_models(self, device: str):
+        self.set_models(device, self.compile_models(device))
+
+    @abc.abstractmethod
+    def compile_models(self, device: str) -> dict[str, ov.CompiledModel]:
+        """
+        Compile all models of the theme for the device. It doesn't change the theme, so it can run
+        in the background while the theme uses other models.
+        """
+        return {}
+
+    def set_models(self, device: str, models: dict[str, ov.CompiledModel]):
+        self.device = device
+        self.models = models
+
+    @staticmethod
+    def _create_infer_queue(compiled_model: ov.CompiledModel) -> ov.AsyncInferQueue:
+        def callback(request, userdata):
+            results, index = userdata
+            results[index] = request.get_output_tensor(0).data
+
+        infer_queue = ov.AsyncInferQueue(compiled_model)
+        infer_queue.set_callback(callback)
+        return infer_queue
+
+    @staticmethod
+    def _start_batch(infer_queue: ov.AsyncInferQueue, compiled_model: ov.CompiledModel, batch: np.ndarray) -> np.ndarray:
+        """
+        Start inference on the batch without waiting for it. The returned array is filled once
+        infer_queue.wait_all() returns. Models with a dynamic batch get the whole batch in one request,
+        the others get one request per image, which still run in parallel.
+
+        :param infer_queue: The queue created for the model with _create_infer_queue
+        :param compiled_model: The model
+        :param batch: Input images (N, C, H, W)
+        :return: The array for the output of the model (N, ...)
+        """
+        output_shape = compiled_model.output(0).partial_shape
+        results = np.empty((len(batch), *[dim.get_length() for dim in output_shape[1:]]), dtype=np.float32)
+
+        if compiled_model.input(0).partial_shape[0].is_dynamic:
+            infer_queue.start_async({0: batch}, (results, slice(None)))
+        else:
+            for i in range(len(batch)):
+                infer_queue.start_async({0: batch[i:i + 1]}, (results, slice(i, i + 1)))
+        return results
+
+    def _load_asset(self, asset_name: str) -> ScaledAsset:
         asset_path = (self.assets_dir / asset_name).with_suffix(".png")
-        return cv2.imread(str(asset_path), cv2.IMREAD_UNCHANGED)
+        return ScaledAsset(cv2.imread(str(asset_path), cv2.IMREAD_UNCHANGED))
 
     def _load_assets(self, assets_names: list[str]):
         assets = {}
@@ -53,6 +149,28 @@ class Theme(abc.ABC):
             assets[asset_name] = self._load_asset(asset_name)
         return assets
 
+    @staticmethod
+    def _blend(img, premultiplied, inverse_alpha, x1, y1):
+        # the part of the overlay inside the image
+        x2, y2 = x1 + premultiplied.shape[1], y1 + premultiplied.shape[0]
+        crop_x1, crop_y1, crop_x2, crop_y2 = max(0, x1), max(0, y1), min(x2, img.shape[1]), min(y2, img.shape[0])
+        if crop_x1 >= crop_x2 or crop_y1 >= crop_y2:
+            return
+
+        # face image to be overlayed
+        face_crop = img[crop_y1:crop_y2, crop_x1:crop_x2]
+        premultiplied = premultiplied[crop_y1 - y1:crop_y2 - y1, crop_x1 - x1:crop_x2 - x1]
+        inverse_alpha = inverse_alpha[crop_y1 - y1:crop_y2 - y1, crop_x1 - x1:crop_x2 - x1]
+
+        # blend images: (color * alpha + background * (255 - alpha)) / 255 in uint16,
+        # the division is rounded with (x + 128 + ((x + 128) >> 8)) >> 8, which is exact for 8-bit products
+        blended = face_crop * inverse_alpha.astype(np.uint16)
+        blended += premultiplied
+        blended += 128
+        blended += blended >> 8
+        blended >>= 8
+        face_crop[:] = blended
+
     @abc.abstractmethod
     def run_inference(self, frame: np.ndarray) -> Any:
         return None
@@ -61,92 +179,6 @@ class Theme(abc.ABC):
     def draw_results(self, image: np.ndarray, detections: Any) -> np.ndarray:
         return image
 
-    def _calculate_iou_matrix(self, boxes1, boxes2):
-        # boxes: (N, 4) arrays
-        if len(boxes1) == 0 or len(boxes2) == 0:
-            return np.zeros((len(boxes1), len(boxes2)), dtype=np.float32)
-        boxes1 = np.array(boxes1)
-        boxes2 = np.array(boxes2)
-        x11, y11, w1, h1 = np.split(boxes1, 4, axis=1)
-        x12, y12 = x11 + w1, y11 + h1
-        x21, y21, w2, h2 = np.split(boxes2, 4, axis=1)
-        x22, y22 = x21 + w2, y21 + h2
-        xi1 = np.maximum(x11, x21.T)
-        yi1 = np.maximum(y11, y21.T)
-        xi2 = np.minimum(x12, x22.T)
-        yi2 = np.minimum(y12, y22.T)
-        inter_area = np.maximum(xi2 - xi1, 0) * np.maximum(yi2 - yi1, 0)
-        box1_area = w1 * h1
-        box2_area = w2 * h2
-        union_area = box1_area + box2_area.T - inter_area
-        return inter_area / (union_area + 1e-6)
-
-    def _smooth_detections(self, current_detections):
-        now = time.time()
-        if not current_detections:
-            self.tracked_faces = {}
-            return []
-        # Prepare current faces
-        curr_boxes = [det[0][1] for det in current_detections]
-        curr_scores = [det[0][0] for det in current_detections]
-        curr_landmarks = [det[1] for det in current_detections]
-        curr_emotions = [det[2] if len(det) > 2 else None for det in current_detections]
-        curr_boxes_np = np.array(curr_boxes)
-        # Prepare tracked faces
-        tracked_ids = list(self.tracked_faces.keys())
-        tracked_boxes_np = np.array([self.tracked_faces[tid]['box'] for tid in tracked_ids]) if tracked_ids else np.zeros((0,4))
-        # IoU matrix
-        ious = self._calculate_iou_matrix(tracked_boxes_np, curr_boxes_np)
-        # Greedy matching
-        matched_tracked = set()
-        matched_current = set()
-        matches = []
-        for t_idx, tid in enumerate(tracked_ids):
-            if ious.shape[1] == 0:
-                break
-            c_idx = np.argmax(ious[t_idx])
-            if ious[t_idx, c_idx] >= self.iou_threshold and c_idx not in matched_current:
-                matches.append((tid, c_idx))
-                matched_tracked.add(tid)
-                matched_current.add(c_idx)
-        # Update matched tracks
-        for tid, c_idx in matches:
-            prev = self.tracked_faces[tid]
-            dt = now - prev['last_update']
-            alpha = np.exp(-dt / self.smoothing_tau)
-            new_box = prev['box'] * alpha + curr_boxes_np[c_idx] * (1 - alpha)
-            self.tracked_faces[tid].update({
-                'box': new_box,
-                'score': curr_scores[c_idx],
-                'landmarks': curr_landmarks[c_idx],
-                'emotion': curr_emotions[c_idx],
-                'last_update': now
-            })
-        # Add new tracks
-        for c_idx in range(len(current_detections)):
-            if c_idx not in matched_current:
-                tid = self.next_face_id
-                self.next_face_id += 1
-                self.tracked_faces[tid] = {
-                    'box': curr_boxes_np[c_idx],
-                    'score': curr_scores[c_idx],
-                    'landmarks': curr_landmarks[c_idx],
-                    'emotion': curr_emotions[c_idx],
-                    'last_update': now
-                }
-        # Remove old tracks
-        for tid in tracked_ids:
-            if tid not in matched_tracked:
-                del self.tracked_faces[tid]
-        # Output
-        smoothed = []
-        for face in self.tracked_faces.values():
-            det = ((float(face['score']), tuple(map(int, face['box']))), face['landmarks'])
-            if face['emotion'] is not None:
-                det = det + (face['emotion'],)
-            smoothed.append(det)
-        return smoothed
-
 
 class ChristmasTheme(Theme):
     def __init__(self, device: str = "CPU"):
@@ -162,21 +194,30 @@ class ChristmasTheme(Theme):
         self.face_detection_model = None
         self.face_landmarks_model = None
         self.emotions_recognition_model = None
+        self.face_landmarks_queue = None
+        self.emotions_recognition_queue = None
 
         self.load_models(device)
 
-    def load_models(self, device: str):
-        self.device = device
-        self.face_detection_model = self._load_model("face-detection-0205", self.model_precision, device)
-        self.face_landmarks_model = self._load_model("facial-landmarks-35-adas-0002", self.model_precision, device)
-        self.emotions_recognition_model = self._load_model("emotions-recognition-retail-0003", self.model_precision, device)
+    def compile_models(self, device: str) -> dict[str, ov.CompiledModel]:
+        return {
+            "face_detection": self._load_model("face-detection-0205", self.model_precision, device),
+            "face_landmarks": self._load_model("facial-landmarks-35-adas-0002", self.model_precision, device, dynamic_batch=True),
+            "emotions_recognition": self._load_model("emotions-recognition-retail-0003", self.model_precision, device, dynamic_batch=True),
+        }
+
+    def set_models(self, device: str, models: dict[str, ov.CompiledModel]):
+        super().set_models(device, models)
+        self.face_detection_model = models["face_detection"]
+        self.face_landmarks_model = models["face_landmarks"]
+        self.emotions_recognition_model = models["emotions_recognition"]
+        self.face_landmarks_queue = self._create_infer_queue(self.face_landmarks_model)
+        self.emotions_recognition_queue = self._create_infer_queue(self.emotions_recognition_model)
 
     def run_inference(self, frame: np.ndarray) -> Any:
         boxes = self.__detect_faces(frame)
-        landmarks = self.__detect_landmarks(frame, boxes)
-        emotions = self.__recognize_emotions(frame, boxes)
-        detections = list(zip(boxes, landmarks, emotions))
-        return self._smooth_detections(detections)
+        landmarks, emotions = self.__analyze_faces(frame, boxes)
+        return self.__track_faces(boxes, landmarks, emotions)
 
     def draw_results(self, image: np.ndarray, detections: Any) -> np.ndarray:
         # sort by face size
@@ -212,49 +253,45 @@ class ChristmasTheme(Theme):
         return image
 
     def __preprocess_images(self, imgs, width, height):
-        result = []
-        for img in imgs:
+        # one preallocated batch instead of stacking separate arrays
+        batch = np.empty((len(imgs), 3, height, width), dtype=np.uint8)
+        for i, img in enumerate(imgs):
             # Resize the image and change dims to fit neural network input.
             input_img = cv2.resize(src=img, dsize=(width, height), interpolation=cv2.INTER_AREA)
-            input_img = input_img.transpose(2, 0, 1)[np.newaxis, ...]
-            result.append(input_img)
-        return np.array(result)
+            batch[i] = input_img.transpose(2, 0, 1)
+        return batch
 
     def __detect_faces(self, img):
         fd_input, fd_output = self.face_detection_model.input(0), self.face_detection_model.output(0)
         fd_height, fd_width = list(fd_input.shape)[2:4]
 
-        input_img = self.__preprocess_images([img], fd_width, fd_height)[0]
+        input_img = self.__preprocess_images([img], fd_width, fd_height)
         results = self.face_detection_model([input_img])[fd_output]
         return self.__process_detection_results(img, results, fd_width, fd_height, thresh=0.25)
 
-    def __detect_landmarks(self, img, boxes):
-        fl_input, fl_output = self.face_landmarks_model.input(0), self.face_landmarks_model.output(0)
-        fl_height, fl_width = list(fl_input.shape)[2:4]
+    def __analyze_faces(self, img, boxes):
+        if not boxes:
+            return [], []
 
-        # every patch is a face image
-        patches = [img[box[1]:box[1] + box[3], box[0]:box[0] + box[2], :] for _, box in boxes]
-        patches = self.__preprocess_images(patches, fl_width, fl_height)
-        # there are many faces on the image
-        results = [self.face_landmarks_model([patch])[fl_output].squeeze() for patch in patches]
-        return self.__process_landmark_results(boxes, results)
-
-    def __recognize_emotions(self, img, boxes):
-        fe_input, fe_output = self.emotions_recognition_model.input(0), self.emotions_recognition_model.output(0)
-        fe_height, fe_width = list(fe_input.shape)[2:4]
+        # height and width of the model inputs, the batch dimension may be dynamic
+        fl_size = tuple(dim.get_length() for dim in self.face_landmarks_model.input(0).partial_shape[2:4])
+        fe_size = tuple(dim.get_length() for dim in self.emotions_recognition_model.input(0).partial_shape[2:4])
 
-        # every patch is a face image
+        # every patch is a face image (a view, not a copy)
         patches = [img[box[1]:box[1] + box[3], box[0]:box[0] + box[2], :] for _, box in boxes]
-        patches = self.__preprocess_images(patches, fe_width, fe_height)
-        # there are many faces on the image
-        results = [self.emotions_recognition_model([patch])[fe_output].squeeze() for patch in patches]
+        # resize every face once per input resolution, both models share it if the resolution is the same
+        batches = {size: self.__preprocess_images(patches, size[1], size[0]) for size in {fl_size, fe_size}}
 
-        if not results:
-            return []
+        # run both models on all the faces at once
+        landmarks_results = self._start_batch(self.face_landmarks_queue, self.face_landmarks_model, batches[fl_size])
+        emotions_results = self._start_batch(self.emotions_recognition_queue, self.emotions_recognition_model, batches[fe_size])
+        self.face_landmarks_queue.wait_all()
+        self.emotions_recognition_queue.wait_all()
 
+        landmarks = self.__process_landmark_results(boxes, landmarks_results)
         # map result to labels
-        labels = list(map(lambda x: self.emotion_classes[x], np.argmax(results, axis=1)))
-        return labels
+        labels = [self.emotion_classes[x] for x in np.argmax(emotions_results.reshape(len(boxes), -1), axis=1)]
+        return landmarks, labels
 
     def __process_detection_results(self, frame, results, in_width, in_height, thresh=0.5):
         # The size of the original frame.
@@ -287,24 +324,35 @@ class ChristmasTheme(Theme):
         return [(scores[idx], boxes[idx]) for idx in indices.flatten()]
 
     def __process_landmark_results(self, boxes, results):
-        landmarks = []
+        boxes = np.array([box for _, box in boxes])
+        # create a vector of landmarks (35x2) for every face
+        results = results.reshape(len(boxes), -1, 2)
+        # move every landmark according to box origin
+        return (results * boxes[:, None, 2:] + boxes[:, None, :2]).astype(np.int32)
+
+    def __track_faces(self, boxes, landmarks, emotions):
+        if not boxes:
+            self.tracker.reset()
+            return []
 
-        for box, result in zip(boxes, results):
-            # create a vector of landmarks (35x2)
-            result = result.reshape(-1, 2)
-            box = box[1]
-            # move every landmark according to box origin
-            landmarks.append((result * box[2:] + box[:2]).astype(np.int32))
+        # the tracker works with (x1, y1, x2, y2) boxes
+        xyxy_boxes = np.array([box for _, box in boxes], dtype=np.float32)
+        xyxy_boxes[:, 2:] += xyxy_boxes[:, :2]
+        tracks = self.tracker.update(xyxy_boxes, [score for score, _ in boxes],
+                                     landmarks=landmarks, emotions=np.array(emotions, dtype=object))
 
-        return landmarks
+        # smoothed boxes back to (x, y, w, h)
+        smoothed_boxes = tracks.boxes.copy()
+        smoothed_boxes[:, 2:] -= smoothed_boxes[:, :2]
+        smoothed_boxes = smoothed_boxes.astype(np.int32).tolist()
+        return [((float(score), tuple(box)), face_landmarks, emotion) for score, box, face_landmarks, emotion in
+                zip(tracks.scores, smoothed_boxes, tracks.attributes["landmarks"], tracks.attributes["emotions"])]
 
-    def _draw_mask(self, img, mask_img, center, face_size, scale=1.0, offset_coeffs=(0.5, 0.5)):
+    def _draw_mask(self, img, mask_asset, center, face_size, scale=1.0, offset_coeffs=(0.5, 0.5)):
         face_width, face_height = face_size
 
-        # scale mask to fit face size
-        mask_width = max(1.0, face_width * scale)
-        f_scale = mask_width / mask_img.shape[1]
-        mask_img = cv2.resize(mask_img, None, fx=f_scale, fy=f_scale, interpolation=cv2.INTER_AREA)
+        # mask scaled to fit face size
+        mask_img, inverse_alpha = mask_asset.get(face_width * scale)
 
         x_offset_coeff, y_offset_coeff = offset_coeffs
 
@@ -315,18 +363,7 @@ class ChristmasTheme(Theme):
 
         # if points inside image
         if 0 < x2 < img.shape[1] and 0 < y2 < img.shape[0] or 0 < x1 < img.shape[1] and 0 < y1 < img.shape[1]:
-            # face image to be overlayed
-            face_crop = img[max(0, y1):min(y2, img.shape[0]), max(0, x1):min(x2, img.shape[1])]
-            # overlay
-            mask_img = mask_img[max(0, -y1):max(0, -y1) + face_crop.shape[0],
-                       max(0, -x1):max(0, -x1) + face_crop.shape[1]]
-            
-            # alpha channel to blend images
-            alpha_mask = mask_img[:, :, 3:4] / 255.0
-            alpha_bg = 1.0 - alpha_mask
-
-            # blend images
-            face_crop[:] = (alpha_mask * mask_img[:, :, :3] + alpha_bg * face_crop).astype(np.uint8)
+            self._blend(img, mask_img, inverse_alpha, x1, y1)
 
     def __draw_santa(self, img, detection):
         (score, box), landmarks, emotion = detection
@@ -364,8 +401,12 @@ class HalloweenTheme(Theme):
 
         self.load_models(device)
 
-    def load_models(self, device: str):
-        self.pose_estimation_model = self._load_model("human-pose-estimation-0001", self.model_precision, device)
+    def compile_models(self, device: str) -> dict[str, ov.CompiledModel]:
+        return {"pose_estimation": self._load_model("human-pose-estimation-0001", self.model_precision, device)}
+
+    def set_models(self, device: str, models: dict[str, ov.CompiledModel]):
+        super().set_models(device, models)
+        self.pose_estimation_model = models["pose_estimation"]
 
     def run_inference(self, frame: np.ndarray) -> Any:
         pe_input, pe_output_pafs, pe_output_heatmaps = self.pose_estimation_model.input(0), self.pose_estimation_model.output("Mconv7_stage2_L1"), self.pose_estimation_model.output("Mconv7_stage2_L2")
@@ -381,8 +422,7 @@ class HalloweenTheme(Theme):
         poses, scores = self.__process_results(frame, pafs, heatmaps)
         # add additional points to skeletons
         poses = [self.__add_artificial_points(pose, self.point_score_threshold) for pose in poses]
-        detections = list(zip(poses, scores))
-        return self._smooth_detections(detections)
+        return list(zip(poses, scores))
 
     def draw_results(self, image: np.ndarray, poses: Any) -> np.ndarray:
         img = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
@@ -445,25 +485,11 @@ class HalloweenTheme(Theme):
                     face_width = np.linalg.norm(points[left_eye] - points[right_ear]) * face_size_scale
                     face_center = (points[left_eye] + points[right_ear]) // 2
 
-                face_width = max(1.0, face_width)
-                scale = face_width / self.assets["pumpkin"].shape[1]
-                pumpkin_face = cv2.resize(self.assets["pumpkin"], None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+                pumpkin_face, inverse_alpha = self.assets["pumpkin"].get(face_width)
 
-                # left-top and right-bottom points
+                # left-top point
                 x1, y1 = face_center[0] - pumpkin_face.shape[1] // 2, face_center[1] - pumpkin_face.shape[0] * 2 // 3
-                x2, y2 = face_center[0] + pumpkin_face.shape[1] // 2, face_center[1] + pumpkin_face.shape[0] // 3
-
-                # face image to be overlayed
-                face_crop = img[max(0, y1):min(y2, img.shape[0]), max(0, x1):min(x2, img.shape[1])]
-                # overlay
-                pumpkin_face = pumpkin_face[max(0, -y1):max(0, -y1) + face_crop.shape[0],
-                               max(0, -x1):max(0, -x1) + face_crop.shape[1]]
-                # alpha channel to blend images
-                alpha_pumpkin = pumpkin_face[:, :, 3:4] / 255.0
-                alpha_bg = 1.0 - alpha_pumpkin
-
-                # blend images
-                face_crop[:] = (alpha_pumpkin * pumpkin_face)[:, :, :3] + alpha_bg * face_crop
+                self._blend(img, pumpkin_face, inverse_alpha, x1, y1)
 
         return img
 
@@ -496,39 +522,9 @@ class HalloweenTheme(Theme):
         return input_img
 
     def __process_results(self, img, pafs, heatmaps):
-        def heatmap_nms(heatmaps, pooled_heatmaps):
-            return heatmaps * (heatmaps == pooled_heatmaps)
-
-        # 2D pooling in numpy (from: https://stackoverflow.com/a/54966908/1624463)
-        def pool2d(A, kernel_size, stride, padding, pool_mode="max"):
-            # Padding
-            A = np.pad(A, padding, mode="constant")
-
-            # Window view of A
-            output_shape = (
-                (A.shape[0] - kernel_size) // stride + 1,
-                (A.shape[1] - kernel_size) // stride + 1,
-            )
-            kernel_size = (kernel_size, kernel_size)
-            A_w = as_strided(
-                A,
-                shape=output_shape + kernel_size,
-                strides=(stride * A.strides[0], stride * A.strides[1]) + A.strides
-            )
-            A_w = A_w.reshape(-1, *kernel_size)
-
-            # Return the result of pooling.
-            if pool_mode == "max":
-                return A_w.max(axis=(1, 2)).reshape(output_shape)
-            elif pool_mode == "avg":
-                return A_w.mean(axis=(1, 2)).reshape(output_shape)
-
         # This processing comes from
         # https://github.com/openvinotoolkit/open_model_zoo/blob/master/demos/common/python/models/open_pose.py
-        pooled_heatmaps = np.array(
-            [[pool2d(h, kernel_size=3, stride=1, padding=1, pool_mode="max") for h in heatmaps[0]]]
-        )
-        nms_heatmaps = heatmap_nms(heatmaps, pooled_heatmaps)
+        nms_heatmaps = self.decoder.heatmap_nms(heatmaps)
 
         # Decode poses.
         poses, scores = self.decoder(heatmaps, nms_heatmaps, pafs)
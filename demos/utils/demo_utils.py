@@ -3,6 +3,7 @@ import os.path
 import threading
 import time
 import urllib.parse
+from collections import deque
 from os import PathLike
 from pathlib import Path
 from typing import Tuple, Dict
@@ -99,16 +100,26 @@ class VideoPlayer:
     Custom video player to fulfill FPS requirements. You can set target FPS and output size,
     flip the video horizontally or skip first N frames.
 
+    Frames are delivered through a ring of preallocated buffers. The capture thread decodes, resizes
+    and flips straight into a free slot and the consumer borrows the newest slot, so no frame is
+    copied or allocated on the way. The player supports a single consumer, which may hold up to
+    `max_borrowed` most recent frames at once (e.g. while they are in an inference pipeline).
+
     :param source: Video source. It could be either camera device or video file.
     :param size: Output frame size.
     :param flip: Flip source horizontally.
     :param fps: Target FPS.
     :param skip_first_frames: Skip first N frames.
+    :param buffer_size: Number of preallocated frames in the ring (at least `max_borrowed` + 2).
+    :param max_borrowed: Number of most recent frames that stay valid for the consumer.
     """
 
-    def __init__(self, source, size=None, flip=False, fps=None, skip_first_frames=0):
+    def __init__(self, source, size=None, flip=False, fps=None, skip_first_frames=0, buffer_size=3, max_borrowed=1):
         import cv2
 
+        if buffer_size < max_borrowed + 2:
+            raise ValueError("`buffer_size` must be at least `max_borrowed` + 2: frames held by the consumer, one published and one being written")
+
         self.__cap = cv2.VideoCapture(source)
         if not self.__cap.isOpened():
             raise RuntimeError(
@@ -136,16 +147,41 @@ class VideoPlayer:
                 if size[0] < self.__cap.get(cv2.CAP_PROP_FRAME_WIDTH)
                 else cv2.INTER_LINEAR
             )
-        # first frame
-        _, self.__frame = self.__cap.read()
-        self.__lock = threading.Lock()
-        self.__thread = None
-        self.__stop = False
 
         self.fps = self.__input_fps
         self.width = int(self.__cap.get(cv2.CAP_PROP_FRAME_WIDTH))
         self.height = int(self.__cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
 
+        # first frame
+        ret, frame = self.__cap.read()
+        out_w, out_h = self.__size if self.__size is not None else (self.width, self.height)
+        channels = frame.shape[2:] if ret else (3,)
+        if ret and self.__size is None:
+            out_h, out_w = frame.shape[:2]
+        # the ring of output frames, every slot is a contiguous view of this array
+        self.__buffers = np.empty((buffer_size, out_h, out_w, *channels), dtype=np.uint8)
+        # decode straight into the ring if no resizing or flipping is needed, otherwise into a scratch frame
+        self.__decode_in_place = ret and not flip and frame.shape == self.__buffers.shape[1:]
+        self.__decode_buffer = frame
+        # intermediate frame between resizing and flipping
+        self.__resize_buffer = np.empty_like(self.__buffers[0]) if flip and ret and frame.shape != self.__buffers.shape[1:] else None
+
+        self.__cond = threading.Condition()
+        # index of the newest published slot and the slots borrowed by the consumer (oldest first)
+        self.__latest = 0
+        self.__borrowed = deque()
+        self.__max_borrowed = max_borrowed
+        # sequence number of the newest published frame and the last one given to the consumer
+        self.__seq = 0
+        self.__last_seq = 0
+        self.__ended = not ret
+        if ret:
+            self.__fill(frame, self.__buffers[0])
+            self.__seq = 1
+
+        self.__thread = None
+        self.__stop = False
+
     """
     Start playing.
     """
@@ -164,21 +200,49 @@ class VideoPlayer:
         if self.__thread is not None:
             self.__thread.join()
         self.__cap.release()
+        with self.__cond:
+            self.__ended = True
+            self.__cond.notify_all()
+
+    def __free_slot(self) -> int:
+        # the consumer may only hold the latest or the borrowed slots, so any other one is safe to write
+        for i in range(len(self.__buffers)):
+            if i != self.__latest and i not in self.__borrowed:
+                return i
+        raise RuntimeError("No free frame buffer")
+
+    def __fill(self, frame: np.ndarray, out: np.ndarray) -> None:
+        import cv2
+
+        src = frame
+        if src.shape[:2] != out.shape[:2]:
+            dst = self.__resize_buffer if self.__flip else out
+            src = cv2.resize(src, (out.shape[1], out.shape[0]), dst=dst, interpolation=self.__interpolation)
+        if self.__flip:
+            cv2.flip(src, 1, dst=out)
+        elif not np.shares_memory(src, out):
+            np.copyto(out, src)
 
     def __run(self):
         prev_time = 0
         while not self.__stop:
             t1 = time.time()
-            ret, frame = self.__cap.read()
+            with self.__cond:
+                slot = self.__free_slot()
+            target = self.__buffers[slot] if self.__decode_in_place else self.__decode_buffer
+            ret, frame = self.__cap.read(target)
             if not ret:
                 break
 
             # fulfill target fps
             if 1 / self.__output_fps < time.time() - prev_time:
                 prev_time = time.time()
-                # replace by current frame
-                with self.__lock:
-                    self.__frame = frame
+                # resize and flip into the free slot, then publish it as the current frame
+                self.__fill(frame, self.__buffers[slot])
+                with self.__cond:
+                    self.__latest = slot
+                    self.__seq += 1
+                    self.__cond.notify_all()
 
             t2 = time.time()
             # time to wait [s] to fulfill input fps
@@ -186,24 +250,49 @@ class VideoPlayer:
             # wait until
             time.sleep(max(0, wait_time))
 
-        self.__frame = None
+        with self.__cond:
+            self.__ended = True
+            self.__cond.notify_all()
+
+    def __borrow(self, timeout: float | None) -> Tuple[int, np.ndarray] | None:
+        with self.__cond:
+            # give the oldest frame back to the ring
+            if len(self.__borrowed) == self.__max_borrowed:
+                self.__borrowed.popleft()
+            self.__cond.wait_for(lambda: self.__ended or self.__seq > self.__last_seq, timeout=timeout)
+            # a frame published before the end is still delivered
+            if self.__seq == self.__last_seq:
+                return None
+            self.__borrowed.append(self.__latest)
+            self.__last_seq = self.__seq
+            return self.__seq, self.__buffers[self.__latest]
+
+    def read(self, timeout: float | None = None) -> Tuple[int, np.ndarray] | None:
+        """
+        Borrow the newest frame without copying it. The frame stays valid for the next `max_borrowed` - 1
+        calls to `read()` or `next()`.
+
+        :param timeout: Maximum time [s] to wait for a new frame. None means waiting until one is available
+        :return: Sequence number and read-only view of the frame, or None if the source ended or the wait timed out
+        """
+        borrowed = self.__borrow(timeout)
+        if borrowed is None:
+            return None
+        seq, frame = borrowed
+        frame = frame.view()
+        frame.flags.writeable = False
+        return seq, frame
 
     """
-    Get current frame.
+    Get next frame. The frame is a slot of the ring owned by the caller for the next `max_borrowed` - 1 calls,
+    so it can be drawn on but must be copied if it is needed for longer.
     """
 
     def next(self):
-        import cv2
-        with self.__lock:
-            if self.__frame is None:
-                return None
-            # need to copy frame, because can be cached and reused if fps is low
-            frame = self.__frame.copy()
-        if self.__size is not None:
-            frame = cv2.resize(frame, self.__size, interpolation=self.__interpolation)
-        if self.__flip:
-            frame = cv2.flip(frame, 1)
-        return frame
+        borrowed = self.__borrow(None)
+        if borrowed is None:
+            return None
+        return borrowed[1]
 
 
 def available_devices(exclude: list | tuple | None = None) -> Dict[str, str]:
@@ -0,0 +1,112 @@
+import time
+from typing import Dict, NamedTuple, Optional
+
+import numpy as np
+from scipy.optimize import linear_sum_assignment
+
+
+class Tracks(NamedTuple):
+    ids: np.ndarray  # (N,) int64
+    boxes: np.ndarray  # (N, 4) float32, xyxy
+    scores: np.ndarray  # (N,) float32
+    attributes: Dict[str, np.ndarray]  # every array has N rows
+
+
+def iou_matrix(boxes1: np.ndarray, boxes2: np.ndarray) -> np.ndarray:
+    """
+    IoU of all pairs of boxes
+
+    :param boxes1: (N, 4) boxes in xyxy format
+    :param boxes2: (M, 4) boxes in xyxy format
+    :return: (N, M) IoU matrix
+    """
+    top_left = np.maximum(boxes1[:, None, :2], boxes2[None, :, :2])
+    bottom_right = np.minimum(boxes1[:, None, 2:], boxes2[None, :, 2:])
+    inter_area = np.prod(np.clip(bottom_right - top_left, 0, None), axis=2)
+    area1 = np.prod(boxes1[:, 2:] - boxes1[:, :2], axis=1)
+    area2 = np.prod(boxes2[:, 2:] - boxes2[:, :2], axis=1)
+    return inter_area / (area1[:, None] + area2[None, :] - inter_area + 1e-6)
+
+
+class IoUTracker:
+    """
+    Lightweight tracker matching detections to tracks by IoU. The assignment is solved optimally
+    (Hungarian algorithm) and the boxes of matched tracks are smoothed exponentially in time.
+    All the tracks are kept as arrays, so every step is vectorized.
+
+    :param iou_threshold: Minimal IoU of a detection and a track to match them
+    :param smoothing_tau: Time constant of the box smoothing in seconds, the bigger the smoother
+    :param max_age: How long (in seconds) a track without detections is kept. With 0 it's dropped immediately
+    """
+
+    def __init__(self, iou_threshold: float = 0.5, smoothing_tau: float = 0.3, max_age: float = 0.0):
+        self.iou_threshold = iou_threshold
+        self.smoothing_tau = smoothing_tau
+        self.max_age = max_age
+        self.__next_id = 0
+        self.reset()
+
+    def update(self, boxes: np.ndarray, scores: np.ndarray, timestamp: Optional[float] = None,
+               **attributes: np.ndarray) -> Tracks:
+        """
+        Update the tracks with detections from a new frame
+
+        :param boxes: (N, 4) detected boxes in xyxy format
+        :param scores: (N,) detection scores
+        :param timestamp: Time of the frame in seconds, the current time if None
+        :param attributes: Other per-detection arrays with N rows (e.g. landmarks), stored with the tracks.
+            The same attributes must be given as long as tracks from previous frames are kept
+        :return: Current tracks. Tracks with detections come first, in the order of the detections
+        """
+        now = time.time() if timestamp is None else timestamp
+        boxes = np.asarray(boxes, dtype=np.float32).reshape(-1, 4)
+        scores = np.asarray(scores, dtype=np.float32).reshape(-1)
+        attributes = {name: np.asarray(values) for name, values in attributes.items()}
+        for name, values in attributes.items():
+            if len(values) != len(boxes):
+                raise ValueError(f"Attribute {name} has {len(values)} rows, but there are {len(boxes)} detections")
+
+        ious = iou_matrix(self.boxes, boxes)
+        track_idx, det_idx = linear_sum_assignment(ious, maximize=True)
+        matched = ious[track_idx, det_idx] >= self.iou_threshold
+        track_idx, det_idx = track_idx[matched], det_idx[matched]
+
+        # smooth all matched boxes at once
+        alpha = np.exp(-(now - self.timestamps[track_idx]) / self.smoothing_tau)[:, None].astype(np.float32)
+        new_boxes = boxes.copy()
+        new_boxes[det_idx] = self.boxes[track_idx] * alpha + boxes[det_idx] * (1 - alpha)
+
+        # matched detections keep the ids of their tracks, others start new tracks
+        new_ids = np.empty(len(boxes), dtype=np.int64)
+        new_ids[det_idx] = self.ids[track_idx]
+        unmatched = np.ones(len(boxes), dtype=bool)
+        unmatched[det_idx] = False
+        new_ids[unmatched] = np.arange(self.__next_id, self.__next_id + np.count_nonzero(unmatched))
+        self.__next_id += np.count_nonzero(unmatched)
+
+        # keep unmatched tracks that aren't too old
+        kept = np.ones(len(self.ids), dtype=bool)
+        kept[track_idx] = False
+        kept &= now - self.timestamps < self.max_age
+        # kept tracks need a value of every attribute
+        if kept.any() and attributes.keys() != self.attributes.keys():
+            raise ValueError(f"Attributes {sorted(attributes)} differ from {sorted(self.attributes)} of the kept tracks")
+
+        self.ids = np.concatenate([new_ids, self.ids[kept]])
+        self.boxes = np.concatenate([new_boxes, self.boxes[kept]])
+        self.scores = np.concatenate([scores, self.scores[kept]])
+        self.timestamps = np.concatenate([np.full(len(boxes), now), self.timestamps[kept]])
+        self.attributes = {name: np.concatenate([values, self.attributes[name][kept]]) if kept.any() else values
+                           for name, values in attributes.items()}
+
+        return Tracks(self.ids, self.boxes, self.scores, self.attributes)
+
+    def reset(self) -> None:
+        """
+        Remove all tracks
+        """
+        self.ids = np.empty(0, dtype=np.int64)
+        self.boxes = np.empty((0, 4), dtype=np.float32)
+        self.scores = np.empty(0, dtype=np.float32)
+        self.timestamps = np.empty(0, dtype=np.float64)
+        self.attributes = {}
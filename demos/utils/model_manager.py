@@ -0,0 +1,106 @@
+import logging as log
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Hashable, Optional, Tuple
+
+
+class ModelManager:
+    """
+    Keeps serving the current model while another one (e.g. a different precision or device) is compiled
+    on a background thread, then swaps them atomically. Compiled models are kept in an LRU cache,
+    so switching back to a recently used one is instant.
+
+    :param loader: Function returning a ready-to-use model for the given key, e.g. (precision, device)
+    :param key: Key of the initial model
+    :param model: The initial model. If None, it's loaded synchronously with the loader
+    :param max_cached: Maximum number of compiled models kept in memory
+    """
+
+    def __init__(self, loader: Callable[[Hashable], Any], key: Hashable, model: Any = None, max_cached: int = 3):
+        self.__loader = loader
+        self.__max_cached = max(1, max_cached)
+        self.__lock = threading.Lock()
+
+        self.__cache = OrderedDict()
+        self.__cache[key] = model if model is not None else loader(key)
+        self.__key = key
+        self.__requested_key = key
+        self.__loading_key = None
+
+    @property
+    def current(self) -> Tuple[Hashable, Any]:
+        """
+        Key and model currently serving, taken together.
+        """
+        with self.__lock:
+            return self.__key, self.__cache[self.__key]
+
+    @property
+    def key(self) -> Hashable:
+        return self.__key
+
+    @property
+    def model(self) -> Any:
+        return self.current[1]
+
+    @property
+    def requested_key(self) -> Hashable:
+        """
+        Key of the model that will be served once loaded (the current one if nothing is pending).
+        """
+        return self.__requested_key
+
+    @property
+    def loading_key(self) -> Optional[Hashable]:
+        """
+        Key of the model being compiled in the background, None if nothing is being compiled.
+        """
+        return self.__loading_key
+
+    def request(self, key: Hashable) -> None:
+        """
+        Switch to the model for the key. Cached models are swapped immediately, others are compiled in
+        the background and swapped when ready. If several keys are requested during one compilation,
+        only the last one is loaded afterwards.
+        """
+        with self.__lock:
+            self.__requested_key = key
+            if key in self.__cache:
+                self.__swap(key)
+            elif self.__loading_key is None:
+                self.__start_loading(key)
+
+    def __start_loading(self, key: Hashable) -> None:
+        self.__loading_key = key
+        threading.Thread(target=self.__load, args=(key,), daemon=True).start()
+
+    def __load(self, key: Hashable) -> None:
+        try:
+            model = self.__loader(key)
+        except Exception as e:
+            log.error(f"Loading model {key} failed: {e}")
+            model = None
+
+        with self.__lock:
+            self.__loading_key = None
+            if model is not None:
+                self.__cache[key] = model
+            elif self.__requested_key == key:
+                # stay with the current model
+                self.__requested_key = self.__key
+
+            if self.__requested_key in self.__cache:
+                self.__swap(self.__requested_key)
+            else:
+                # something else was requested during loading
+                self.__start_loading(self.__requested_key)
+
+    def __swap(self, key: Hashable) -> None:
+        self.__key = key
+        self.__cache.move_to_end(key)
+        # drop the least recently used models, but never the one serving
+        for old_key in list(self.__cache.keys()):
+            if len(self.__cache) <= self.__max_cached:
+                break
+            if old_key != self.__key:
+                del self.__cache[old_key]
@@ -0,0 +1,298 @@
+import threading
+import time
+from os import PathLike
+from pathlib import Path
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+
+# boxes of different classes are shifted by this offset, so one NMS pass never suppresses across classes
+MAX_WH = 7680
+
+
+class YOLOResult(NamedTuple):
+    # boxes in the original frame coordinates, (N, 4) as x1, y1, x2, y2
+    xyxy: np.ndarray
+    # (N,) scores
+    confidence: np.ndarray
+    # (N,) class indices
+    class_id: np.ndarray
+    # (N, K, 3) keypoints as x, y, score (pose models only)
+    keypoints: Optional[np.ndarray]
+    # (N, H, W) boolean masks at the frame resolution (segmentation models only)
+    mask: Optional[np.ndarray]
+    # preprocess, inference and postprocess times [ms]
+    speed: Dict[str, float]
+
+
+def letterbox(image: np.ndarray, new_shape: Tuple[int, int], color: int = 114) -> Tuple[np.ndarray, float, Tuple[int, int]]:
+    """
+    Resize the image keeping the aspect ratio and pad it to the new shape, the same way Ultralytics does.
+
+    :param image: BGR image (H, W, 3)
+    :param new_shape: Target (height, width)
+    :param color: Padding value
+    :return: Letterboxed image, scale ratio and (left, top) padding
+    """
+    import cv2
+
+    h, w = image.shape[:2]
+    ratio = min(new_shape[0] / h, new_shape[1] / w)
+    new_w, new_h = round(w * ratio), round(h * ratio)
+    pad_w, pad_h = (new_shape[1] - new_w) / 2, (new_shape[0] - new_h) / 2
+    top, left = round(pad_h - 0.1), round(pad_w - 0.1)
+
+    canvas = np.full((new_shape[0], new_shape[1], 3), color, dtype=np.uint8)
+    cv2.resize(image, (new_w, new_h), dst=canvas[top:top + new_h, left:left + new_w], interpolation=cv2.INTER_LINEAR)
+    return canvas, ratio, (left, top)
+
+
+def nms(boxes: np.ndarray, scores: np.ndarray, iou_threshold: float) -> np.ndarray:
+    """
+    Greedy non-maximum suppression, every step suppresses all boxes overlapping the best remaining one at once.
+
+    :param boxes: (N, 4) boxes as x1, y1, x2, y2
+    :param scores: (N,) scores
+    :param iou_threshold: Boxes overlapping more than this are suppressed
+    :return: Indices of the kept boxes sorted by score
+    """
+    x1, y1, x2, y2 = boxes.T
+    areas = (x2 - x1) * (y2 - y1)
+    order = scores.argsort()[::-1]
+
+    keep = []
+    while order.size > 0:
+        best, rest = order[0], order[1:]
+        keep.append(best)
+        inter_w = np.clip(np.minimum(x2[best], x2[rest]) - np.maximum(x1[best], x1[rest]), 0, None)
+        inter_h = np.clip(np.minimum(y2[best], y2[rest]) - np.maximum(y1[best], y1[rest]), 0, None)
+        inter = inter_w * inter_h
+        iou = inter / (areas[best] + areas[rest] - inter + 1e-9)
+        order = rest[iou <= iou_threshold]
+    return np.array(keep, dtype=np.int64)
+
+
+class YOLOPipeline:
+    """
+    Pipelined inference of Ultralytics YOLO models exported to OpenVINO (detection, segmentation and pose).
+    The IR is compiled directly with the THROUGHPUT hint and several infer requests are kept in flight
+    with AsyncInferQueue. Color conversion and normalization are folded into the model, letterboxing
+    and NMS are done in NumPy in the completion callbacks. Results are returned in the submission order.
+
+    :param model_path: Path to the exported model directory or the xml file
+    :param device: Device to run inference on
+    :param conf: Confidence threshold
+    :param iou: IoU threshold for NMS
+    :param max_det: Maximum number of detections per frame
+    :param classes: Class indices to keep, all if None
+    :param num_requests: Number of infer requests kept in flight, 0 means the device's optimal number
+    :param with_masks: Whether to compute masks for segmentation models
+    :param cache_dir: Directory for the OpenVINO model cache
+    """
+
+    def __init__(self, model_path: PathLike, device: str = "AUTO", conf: float = 0.25, iou: float = 0.7, max_det: int = 300,
+                 classes: Optional[List[int]] = None, num_requests: int = 0, with_masks: bool = True, cache_dir: str = "cache"):
+        import openvino as ov
+        from openvino.preprocess import PrePostProcessor, ColorFormat
+
+        model_path = Path(model_path)
+        xml_path = model_path if model_path.suffix == ".xml" else next(model_path.glob("*.xml"))
+        metadata = self.__load_metadata(xml_path.parent / "metadata.yaml")
+
+        core = ov.Core()
+        model = core.read_model(xml_path)
+        # accept BGR uint8 frames as they are, the conversion to normalized RGB runs inside the graph
+        ppp = PrePostProcessor(model)
+        ppp.input().tensor().set_element_type(ov.Type.u8).set_layout(ov.Layout("NHWC")).set_color_format(ColorFormat.BGR)
+        ppp.input().model().set_layout(ov.Layout("NCHW"))
+        ppp.input().preprocess().convert_element_type(ov.Type.f32).convert_color(ColorFormat.RGB).scale(255.0)
+        model = ppp.build()
+
+        config = {"PERFORMANCE_HINT": "THROUGHPUT", "CACHE_DIR": cache_dir}
+        if num_requests > 0:
+            config["PERFORMANCE_HINT_NUM_REQUESTS"] = num_requests
+        self.__compiled_model = core.compile_model(model, device, config)
+        self.__queue = ov.AsyncInferQueue(self.__compiled_model, num_requests)
+        self.__queue.set_callback(self.__on_done)
+
+        self.input_shape = tuple(self.__compiled_model.input(0).shape[1:3])
+        self.names = metadata.get("names", {})
+        self.task = metadata.get("task", "segment" if len(self.__compiled_model.outputs) > 1 else "detect")
+        self.kpt_shape = tuple(metadata.get("kpt_shape", (17, 3))) if self.task == "pose" else None
+        self.num_requests = len(self.__queue)
+
+        self.__conf = conf
+        self.__iou = iou
+        self.__max_det = max_det
+        self.__classes = np.array(classes) if classes is not None else None
+        self.__with_masks = with_masks and self.task == "segment"
+
+        self.__cond = threading.Condition()
+        self.__results = {}
+        self.__next_id = 0
+        self.__next_out = 0
+
+    @staticmethod
+    def __load_metadata(path: Path) -> Dict[str, Any]:
+        if not path.exists():
+            return {}
+        import yaml
+
+        with open(path) as f:
+            return yaml.safe_load(f) or {}
+
+    @property
+    def pending(self) -> int:
+        """
+        Number of submitted frames whose results haven't been taken yet.
+        """
+        return self.__next_id - self.__next_out
+
+    def submit(self, frame: np.ndarray, userdata: Any = None) -> int:
+        """
+        Start inference on the frame. Blocks only if all infer requests are busy.
+
+        :param frame: BGR frame. It must stay unchanged until its result is taken with `get()`
+        :param userdata: Any object returned together with the result
+        :return: Id of the frame
+        """
+        start_time = time.perf_counter()
+        frame_id = self.__next_id
+        self.__next_id += 1
+
+        input_image, ratio, pad = letterbox(frame, self.input_shape)
+        preprocess_time = (time.perf_counter() - start_time) * 1000
+
+        self.__queue.start_async({0: input_image[None]}, (frame_id, frame, userdata, ratio, pad, preprocess_time))
+        return frame_id
+
+    def get(self, block: bool = True, timeout: Optional[float] = None) -> Optional[Tuple[np.ndarray, Any, YOLOResult]]:
+        """
+        Take the result of the oldest submitted frame.
+
+        :param block: Wait for the result if it's not ready yet
+        :param timeout: Maximum time [s] to wait
+        :return: The frame, its userdata and the result, or None if nothing is pending or ready
+        """
+        with self.__cond:
+            if self.pending == 0:
+                return None
+            if block:
+                self.__cond.wait_for(lambda: self.__next_out in self.__results, timeout=timeout)
+            if self.__next_out not in self.__results:
+                return None
+            output = self.__results.pop(self.__next_out)
+            self.__next_out += 1
+
+        if isinstance(output, Exception):
+            raise output
+        return output
+
+    def __call__(self, frame: np.ndarray) -> YOLOResult:
+        """
+        Run inference on a single frame synchronously. Results of frames submitted before are dropped.
+        """
+        self.__queue.wait_all()
+        while self.get(block=False) is not None:
+            pass
+        self.submit(frame)
+        return self.get()[2]
+
+    def wait_all(self) -> None:
+        self.__queue.wait_all()
+
+    def clear(self) -> None:
+        """
+        Drop all pending results, e.g. when the pipeline is used again after serving another stream.
+        """
+        self.__queue.wait_all()
+        with self.__cond:
+            self.__results.clear()
+            self.__next_out = self.__next_id
+
+    def __on_done(self, request, userdata) -> None:
+        frame_id, frame, frame_userdata, ratio, pad, preprocess_time = userdata
+        # measured from the start of the request, so waiting for a free one isn't counted
+        inference_time = request.latency
+        try:
+            start_time = time.perf_counter()
+            # the request is reused after the callback, so the outputs are consumed here
+            outputs = [request.get_output_tensor(i).data for i in range(len(self.__compiled_model.outputs))]
+            result = self.__postprocess(outputs, frame.shape[:2], ratio, pad)
+            speed = {"preprocess": preprocess_time, "inference": inference_time, "postprocess": (time.perf_counter() - start_time) * 1000}
+            output = frame, frame_userdata, result._replace(speed=speed)
+        except Exception as e:
+            output = e
+
+        with self.__cond:
+            self.__results[frame_id] = output
+            self.__cond.notify_all()
+
+    def __postprocess(self, outputs: List[np.ndarray], frame_shape: Tuple[int, int], ratio: float, pad: Tuple[int, int]) -> YOLOResult:
+        # (1, 4 + classes + extra, anchors) -> (anchors, 4 + classes + extra)
+        pred = outputs[0][0].T
+        num_classes = len(self.names) if self.names else pred.shape[1] - 4 - (32 if self.task == "segment" else 0)
+        if self.task == "pose":
+            num_classes = 1
+
+        class_scores = pred[:, 4:4 + num_classes]
+        scores = class_scores.max(axis=1)
+        candidates = scores > self.__conf
+        pred, class_scores, scores = pred[candidates], class_scores[candidates], scores[candidates]
+        class_ids = class_scores.argmax(axis=1)
+
+        if self.__classes is not None:
+            selected = np.isin(class_ids, self.__classes)
+            pred, scores, class_ids = pred[selected], scores[selected], class_ids[selected]
+
+        # xywh -> xyxy
+        boxes = np.empty((len(pred), 4), dtype=np.float32)
+        boxes[:, :2] = pred[:, :2] - pred[:, 2:4] / 2
+        boxes[:, 2:] = pred[:, :2] + pred[:, 2:4] / 2
+
+        keep = nms(boxes + class_ids[:, None] * MAX_WH, scores, self.__iou)[:self.__max_det]
+        boxes, scores, class_ids, extra = boxes[keep], scores[keep], class_ids[keep], pred[keep, 4 + num_classes:]
+
+        # letterbox coordinates -> frame coordinates
+        h, w = frame_shape
+        offset = np.array([pad[0], pad[1], pad[0], pad[1]], dtype=np.float32)
+        xyxy = (boxes - offset) / ratio
+        xyxy[:, [0, 2]] = xyxy[:, [0, 2]].clip(0, w)
+        xyxy[:, [1, 3]] = xyxy[:, [1, 3]].clip(0, h)
+
+        keypoints = None
+        if self.task == "pose":
+            keypoints = extra.reshape(len(extra), *self.kpt_shape).copy()
+            keypoints[..., :2] = (keypoints[..., :2] - offset[:2]) / ratio
+
+        masks = None
+        if self.__with_masks:
+            masks = self.__process_masks(outputs[1][0], extra[:, -32:], xyxy, frame_shape, ratio, pad)
+
+        return YOLOResult(xyxy, scores, class_ids, keypoints, masks, {})
+
+    def __process_masks(self, protos: np.ndarray, coefficients: np.ndarray, xyxy: np.ndarray, frame_shape: Tuple[int, int],
+                        ratio: float, pad: Tuple[int, int]) -> np.ndarray:
+        import cv2
+
+        h, w = frame_shape
+        if len(coefficients) == 0:
+            return np.zeros((0, h, w), dtype=bool)
+
+        num_protos, proto_h, proto_w = protos.shape
+        # all masks at once as (proto_h, proto_w, N) logits
+        masks = (coefficients @ protos.reshape(num_protos, -1)).reshape(-1, proto_h, proto_w).transpose(1, 2, 0)
+
+        # cut out the letterbox padding and scale to the frame, cv2 handles up to 512 channels at once
+        scale = proto_w / self.input_shape[1]
+        top, left = int(round(pad[1] * scale)), int(round(pad[0] * scale))
+        bottom, right = int(round(top + h * ratio * scale)), int(round(left + w * ratio * scale))
+        masks = np.ascontiguousarray(masks[top:bottom, left:right])
+        resized = [cv2.resize(masks[..., i:i + 512], (w, h), interpolation=cv2.INTER_LINEAR) for i in range(0, masks.shape[2], 512)]
+        masks = np.concatenate([m.reshape(h, w, -1) for m in resized], axis=2)
+
+        # sigmoid(x) > 0.5 <=> x > 0, and nothing outside the box
+        ys = np.arange(h, dtype=np.float32)[:, None, None]
+        xs = np.arange(w, dtype=np.float32)[None, :, None]
+        inside = (xs >= xyxy[:, 0]) & (xs < xyxy[:, 2]) & (ys >= xyxy[:, 1]) & (ys < xyxy[:, 3])
+        return ((masks > 0) & inside).transpose(2, 0, 1)
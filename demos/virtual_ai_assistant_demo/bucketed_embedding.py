@@ -0,0 +1,138 @@
+import threading
+from pathlib import Path
+from typing import Any, List, Optional, Sequence
+
+import numpy as np
+import openvino as ov
+from llama_index.core.base.embeddings.base import BaseEmbedding
+from llama_index.core.bridge.pydantic import Field, PrivateAttr
+from transformers import AutoTokenizer
+
+
+class BucketedOpenVINOEmbedding(BaseEmbedding):
+    """
+    Embedding model compiled for a few static shapes (buckets) of batch_size x sequence length, so it still runs on NPU,
+    which doesn't support dynamic shapes. Texts are sorted by their token length and packed into batches, each
+    batch is padded only to the shortest bucket it fits into. Every sequence length is compiled for a batch of 1 too,
+    so a single text (e.g. a query) doesn't pay for the whole batch. Batches are run on an async infer queue
+    per bucket, so several of them are in flight at once.
+
+    :param model_path: Directory with the embedding model exported to OpenVINO IR (openvino_model.xml) and its tokenizer
+    :param device: Device to run the model on
+    :param batch_size: Number of texts in one inference
+    :param sequence_lengths: Sequence lengths of the buckets. Longer texts are truncated to the longest one
+    :param pooling: "cls" or "mean"
+    :param normalize: Whether to normalize the embeddings
+    """
+
+    model_path: str = Field(description="Path to the embedding model")
+    device: str = Field(default="CPU", description="Device the model runs on")
+    batch_size: int = Field(default=8, description="Number of texts in one inference")
+    sequence_lengths: List[int] = Field(default=[128, 256, 512], description="Sequence lengths of the compiled buckets")
+    pooling: str = Field(default="cls", description="Pooling strategy, cls or mean")
+    normalize: bool = Field(default=True, description="Whether to normalize the embeddings")
+    query_instruction: Optional[str] = Field(default=None, description="Instruction to prepend to the query")
+    text_instruction: Optional[str] = Field(default=None, description="Instruction to prepend to the text")
+
+    _tokenizer: Any = PrivateAttr()
+    _infer_queues: dict = PrivateAttr()
+    _execution_devices: list = PrivateAttr()
+    _hidden_size: int = PrivateAttr()
+    _input_names: list = PrivateAttr()
+    _lock: threading.Lock = PrivateAttr()
+
+    def __init__(self, model_path: str, device: str = "CPU", batch_size: int = 8, sequence_lengths: Sequence[int] = (128, 256, 512),
+                 pooling: str = "cls", normalize: bool = True, embed_batch_size: int = 128, **kwargs: Any):
+        super().__init__(model_path=model_path, device=device, batch_size=batch_size, sequence_lengths=sorted(sequence_lengths),
+                         pooling=pooling, normalize=normalize, embed_batch_size=embed_batch_size, model_name=model_path, **kwargs)
+
+        if pooling not in ("cls", "mean"):
+            raise ValueError(f"Pooling {pooling} is not supported, use cls or mean")
+
+        self._tokenizer = AutoTokenizer.from_pretrained(model_path)
+        self._lock = threading.Lock()
+
+        core = ov.Core()
+        model = core.read_model(Path(model_path) / "openvino_model.xml")
+        self._input_names = [model_input.get_any_name() for model_input in model.inputs]
+        self._hidden_size = model.output(0).get_partial_shape()[-1].get_length()
+
+        # (batch size, sequence length) -> infer queue
+        self._infer_queues = {}
+        for rows in sorted({1, batch_size}):
+            for sequence_length in self.sequence_lengths:
+                model.reshape({name: [rows, sequence_length] for name in self._input_names})
+                compiled_model = core.compile_model(model, device, {"PERFORMANCE_HINT": "THROUGHPUT", "CACHE_DIR": "cache"})
+                self._infer_queues[rows, sequence_length] = ov.AsyncInferQueue(compiled_model)
+                self._infer_queues[rows, sequence_length].set_callback(self._on_result)
+        self._execution_devices = compiled_model.get_property("EXECUTION_DEVICES")
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "BucketedOpenVINOEmbedding"
+
+    @property
+    def execution_devices(self) -> List[str]:
+        return self._execution_devices
+
+    def _pool(self, hidden_state: np.ndarray, attention_mask: np.ndarray) -> np.ndarray:
+        if self.pooling == "cls":
+            return hidden_state[:, 0]
+        mask = attention_mask[..., None].astype(np.float32)
+        return (hidden_state * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+
+    def _on_result(self, request: ov.InferRequest, userdata: tuple) -> None:
+        results, indices, attention_mask = userdata
+        embeddings = self._pool(request.get_output_tensor(0).data, attention_mask)
+        # the rows after the texts are only padding of the batch
+        results[indices] = embeddings[:len(indices)]
+
+    def _embed(self, sentences: List[str]) -> List[List[float]]:
+        max_length = self.sequence_lengths[-1]
+        input_ids = self._tokenizer(sentences, truncation=True, max_length=max_length, padding=False)["input_ids"]
+
+        results = np.zeros((len(sentences), self._hidden_size), dtype=np.float32)
+        with self._lock:
+            # the longest texts first, so texts of similar length land in the same batch
+            order = np.argsort([-len(ids) for ids in input_ids], kind="stable")
+            for start in range(0, len(order), self.batch_size):
+                indices = order[start:start + self.batch_size]
+                longest = len(input_ids[indices[0]])
+                sequence_length = next(length for length in self.sequence_lengths if length >= longest)
+                rows = 1 if len(indices) == 1 else self.batch_size
+
+                batch_ids = np.full((rows, sequence_length), self._tokenizer.pad_token_id, dtype=np.int64)
+                attention_mask = np.zeros((rows, sequence_length), dtype=np.int64)
+                for row, index in enumerate(indices):
+                    batch_ids[row, :len(input_ids[index])] = input_ids[index]
+                    attention_mask[row, :len(input_ids[index])] = 1
+
+                inputs = {"input_ids": batch_ids, "attention_mask": attention_mask, "token_type_ids": np.zeros_like(batch_ids)}
+                # returns when a request of the queue is free, so the batches overlap
+                self._infer_queues[rows, sequence_length].start_async({name: inputs[name] for name in self._input_names}, (results, indices, attention_mask))
+
+            for infer_queue in self._infer_queues.values():
+                infer_queue.wait_all()
+
+        if self.normalize:
+            results /= np.clip(np.linalg.norm(results, axis=1, keepdims=True), 1e-12, None)
+        return results.tolist()
+
+    def _get_query_embedding(self, query: str) -> List[float]:
+        if self.query_instruction:
+            query = f"{self.query_instruction} {query}".strip()
+        return self._embed([query])[0]
+
+    async def _aget_query_embedding(self, query: str) -> List[float]:
+        return self._get_query_embedding(query)
+
+    async def _aget_text_embedding(self, text: str) -> List[float]:
+        return self._get_text_embedding(text)
+
+    def _get_text_embedding(self, text: str) -> List[float]:
+        return self._get_text_embeddings([text])[0]
+
+    def _get_text_embeddings(self, texts: List[str]) -> List[List[float]]:
+        if self.text_instruction:
+            texts = [f"{self.text_instruction} {text}".strip() for text in texts]
+        return self._embed(texts)
@@ -0,0 +1,161 @@
+import itertools
+import threading
+import time
+from pathlib import Path
+from typing import Any, Iterator, Optional, Sequence, Tuple
+
+import openvino_genai as genai
+from llama_index.core.base.llms.types import ChatMessage, CompletionResponse, CompletionResponseGen, LLMMetadata
+from llama_index.core.bridge.pydantic import PrivateAttr
+from llama_index.core.constants import DEFAULT_CONTEXT_WINDOW
+from llama_index.core.llms.callbacks import llm_completion_callback
+from llama_index.core.llms.custom import CustomLLM
+
+
+class ContinuousBatchingServer:
+    """
+    Generates responses of all chat sessions with one ContinuousBatchingPipeline. A background thread steps the pipeline,
+    and every step schedules the next tokens of all running requests together, so a long answer doesn't block others.
+    The KV cache is bounded by cache_size, requests that don't fit wait for free cache blocks.
+
+    :param model_path: Directory with the model and tokenizer in OpenVINO format
+    :param device: Device to run the model on
+    :param generation_config: Generation config for all requests
+    :param cache_size: Size of the KV cache in GB
+    :param max_num_seqs: Maximum number of requests generated at once
+    :param properties: Properties to compile the model with
+    """
+
+    def __init__(self, model_path: Path, device: str, generation_config: genai.GenerationConfig, cache_size: int = 2, max_num_seqs: int = 8,
+                 properties: Optional[dict] = None):
+        scheduler_config = genai.SchedulerConfig()
+        scheduler_config.cache_size = cache_size
+        scheduler_config.max_num_seqs = max_num_seqs
+
+        self.device = device
+        self.generation_config = generation_config
+        self.__pipeline = genai.ContinuousBatchingPipeline(str(model_path), scheduler_config, device, properties or {})
+        self.tokenizer = self.__pipeline.get_tokenizer()
+
+        self.__request_ids = itertools.count()
+        self.__condition = threading.Condition()
+        threading.Thread(target=self.__run, daemon=True).start()
+
+    @property
+    def cache_usage(self) -> float:
+        """
+        Usage of the KV cache in percent
+        """
+        return self.__pipeline.get_metrics().cache_usage
+
+    def messages_to_prompt(self, messages: Sequence[ChatMessage]) -> str:
+        return self.tokenizer.apply_chat_template([{"role": message.role.value, "content": message.content or ""} for message in messages],
+                                                  add_generation_prompt=True)
+
+    def generate(self, prompt: str) -> Iterator[Tuple[str, int]]:
+        """
+        Generate the response to the prompt
+
+        :return: Iterator of (new text, number of new tokens)
+        """
+        # the chat template already contains special tokens
+        input_ids = self.tokenizer.encode(prompt, add_special_tokens=False).input_ids
+        with self.__condition:
+            handle = self.__pipeline.add_request(next(self.__request_ids), input_ids, self.generation_config)
+            self.__condition.notify_all()
+
+        tokens = []
+        text = ""
+        try:
+            while True:
+                with self.__condition:
+                    while not handle.can_read() and handle.get_status() == genai.GenerationStatus.RUNNING:
+                        self.__condition.wait()
+                    finished = handle.get_status() != genai.GenerationStatus.RUNNING
+
+                if handle.can_read():
+                    new_tokens = [token for output in handle.read().values() for token in output.generated_ids]
+                    tokens += new_tokens
+                    new_text = self.tokenizer.decode(tokens)
+                    # wait for the rest of a multi-token character
+                    if not new_text.endswith("\ufffd"):
+                        yield new_text[len(text):], len(new_tokens)
+                        text = new_text
+                    elif new_tokens:
+                        yield "", len(new_tokens)
+                elif finished:
+                    break
+        finally:
+            # the consumer is gone before the end, e.g. the user closed the page
+            if handle.get_status() == genai.GenerationStatus.RUNNING:
+                handle.stop()
+
+    def __run(self) -> None:
+        while True:
+            with self.__condition:
+                while not self.__pipeline.has_non_finished_requests():
+                    self.__condition.wait()
+            self.__pipeline.step()
+            with self.__condition:
+                self.__condition.notify_all()
+
+
+class SessionLLM(CustomLLM):
+    """
+    LLM of one chat session generating on the shared server. It keeps the time to first token and tokens/s of its last response.
+    """
+
+    _server: ContinuousBatchingServer = PrivateAttr()
+    _first_token_time: float = PrivateAttr(default=0.0)
+    _tokens_per_second: float = PrivateAttr(default=0.0)
+
+    def __init__(self, server: ContinuousBatchingServer, **kwargs: Any):
+        super().__init__(messages_to_prompt=server.messages_to_prompt, **kwargs)
+        self._server = server
+
+    @property
+    def metadata(self) -> LLMMetadata:
+        return LLMMetadata(context_window=DEFAULT_CONTEXT_WINDOW, num_output=self._server.generation_config.max_new_tokens, is_chat_model=True)
+
+    @property
+    def first_token_time(self) -> float:
+        """
+        Time to the first token of the last response in seconds
+        """
+        return self._first_token_time
+
+    @property
+    def tokens_per_second(self) -> float:
+        """
+        Generation speed after the first token of the last (or current) response
+        """
+        return self._tokens_per_second
+
+    @llm_completion_callback()
+    def complete(self, prompt: str, formatted: bool = False, **kwargs: Any) -> CompletionResponse:
+        response = CompletionResponse(text="")
+        for response in self.stream_complete(prompt, formatted, **kwargs):
+            pass
+        return response
+
+    @llm_completion_callback()
+    def stream_complete(self, prompt: str, formatted: bool = False, **kwargs: Any) -> CompletionResponseGen:
+        if not formatted:
+            prompt = self.completion_to_prompt(prompt)
+
+        start_time = time.perf_counter()
+        self._first_token_time = 0.0
+        self._tokens_per_second = 0.0
+        first_token_end = None
+        tokens = 0
+        text = ""
+        for delta, new_tokens in self._server.generate(prompt):
+            now = time.perf_counter()
+            if first_token_end is None:
+                self._first_token_time = now - start_time
+                first_token_end = now
+            else:
+                tokens += new_tokens
+                self._tokens_per_second = tokens / max(now - first_token_end, 1e-6)
+            text += delta
+            yield CompletionResponse(text=text, delta=delta)
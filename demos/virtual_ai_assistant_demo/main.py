@@ -1,27 +1,27 @@
 import argparse
+import hashlib
 import logging as log
 import os
 import sys
 import threading
 import time
 from pathlib import Path
-from typing import List, Optional, Set, Tuple
+from typing import Dict, List, Optional, Set, Tuple
 
 import chromadb
 import fitz
 import gradio as gr
 import numpy as np
 import openvino as ov
+import openvino_genai as genai
 import yaml
 from langchain_text_splitters import RecursiveCharacterTextSplitter
-from llama_index.core import Document, VectorStoreIndex, Settings, StorageContext
-from llama_index.core.chat_engine import SimpleChatEngine
-from llama_index.core.chat_engine.types import BaseChatEngine, ChatMode
+from llama_index.core import Document, VectorStoreIndex, Settings
+from llama_index.core.chat_engine import ContextChatEngine, SimpleChatEngine
+from llama_index.core.chat_engine.types import BaseChatEngine
 from llama_index.core.memory import ChatMemoryBuffer
 from llama_index.core.node_parser import LangchainNodeParser
-from llama_index.embeddings.huggingface_openvino import OpenVINOEmbedding
-from llama_index.llms.openvino_genai import OpenVINOGenAILLM
-from llama_index.postprocessor.openvino_rerank import OpenVINORerank
+from llama_index.core.vector_stores import FilterOperator, MetadataFilter, MetadataFilters
 from llama_index.vector_stores.chroma import ChromaVectorStore
 from openvino.runtime import opset10 as ops
 from openvino.runtime import passes
@@ -29,6 +29,10 @@ from optimum.exporters.openvino.convert import export_tokenizer
 from optimum.intel import OVModelForCausalLM, OVModelForFeatureExtraction, OVWeightQuantizationConfig, OVModelForSequenceClassification
 from transformers import AutoTokenizer
 
+from bucketed_embedding import BucketedOpenVINOEmbedding
+from llm_serving import ContinuousBatchingServer, SessionLLM
+from two_stage_rerank import TwoStageOpenVINORerank
+
 SCRIPT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "utils")
 sys.path.append(os.path.dirname(SCRIPT_DIR))
 
@@ -36,13 +40,26 @@ from utils import demo_utils as utils
 
 # Global variables initialization
 MODEL_DIR = Path("model")
-inference_lock = threading.Lock()
+VECTOR_STORE_DIR = Path("cache") / "vector_store"
+CHUNK_SIZE = 500
+CHUNK_OVERLAP = 100
+# static shapes the embedding model is compiled for (1 or batch x each sequence length), NPU doesn't support dynamic ones
+EMBEDDING_BATCH_SIZE = 8
+EMBEDDING_SEQUENCE_LENGTHS = (128, 256, 512)
+# passages retrieved for every question, the reranker picks the best 3 of them
+RETRIEVED_PASSAGES = 10
 
 # Initialize Model variables
-ov_llm: Optional[OpenVINOGenAILLM] = None
-ov_embedding: Optional[OpenVINOEmbedding] = None
-ov_reranker: Optional[OpenVINORerank] = None
-ov_chat_engine: Optional[BaseChatEngine] = None
+llm_server: Optional[ContinuousBatchingServer] = None
+ov_embedding: Optional[BucketedOpenVINOEmbedding] = None
+ov_reranker: Optional[TwoStageOpenVINORerank] = None
+# chat engine (with its memory) and LLM (with its stats) of every session
+chat_engines: Dict[str, Tuple[BaseChatEngine, SessionLLM]] = {}
+
+embedding_model_id = ""
+chroma_client: Optional[chromadb.ClientAPI] = None
+# a lock per file hash, so sessions uploading the same file don't embed it twice
+indexing_locks: Dict[str, threading.Lock] = {}
 
 chatbot_config = {}
 
@@ -52,7 +69,7 @@ def get_available_devices() -> Set[str]:
     return {device.split(".")[0] for device in core.available_devices}
 
 
-def load_chat_model(model_name: str, token: str = None) -> OpenVINOGenAILLM:
+def load_chat_model(model_name: str, token: str = None, kv_cache_size: int = 2, max_sessions: int = 8) -> ContinuousBatchingServer:
     model_path = MODEL_DIR / model_name    
 
     # tokenizers are disabled anyway, this allows to avoid warning
@@ -60,7 +77,7 @@ def load_chat_model(model_name: str, token: str = None) -> OpenVINOGenAILLM:
     if token is not None:
         os.environ["HUGGING_FACE_HUB_TOKEN"] = token
 
-    ov_config = {"PERFORMANCE_HINT": "LATENCY", "CACHE_DIR": ""}
+    ov_config = {"CACHE_DIR": ""}
     # load llama model and its tokenizer
     if not model_path.exists():
         log.info(f"Downloading {model_name}... It may take up to 1h depending on your Internet connection and model size.")     
@@ -84,18 +101,15 @@ def load_chat_model(model_name: str, token: str = None) -> OpenVINOGenAILLM:
 
     device = "GPU" if "GPU" in get_available_devices() else "CPU"
 
-    llm = OpenVINOGenAILLM(model_path=str(model_path), device=device, config=ov_config)
-
-    # change number of tokens to be generated in one step
-    llm._streamer.tokens_len = 1
-
-    llm.config.max_new_tokens = 1024
-    llm.config.do_sample = True
-    llm.config.temperature = 0.7
-    llm.config.top_k = 50
-    llm.config.top_p = 0.95
+    config = genai.GenerationConfig()
+    config.max_new_tokens = 1024
+    config.do_sample = True
+    config.temperature = 0.7
+    config.top_k = 50
+    config.top_p = 0.95
 
-    return llm
+    # tokens of all sessions are generated together, the KV cache is shared and limited to kv_cache_size GB
+    return ContinuousBatchingServer(model_path, device, config, cache_size=kv_cache_size, max_num_seqs=max_sessions, properties=ov_config)
 
 
 def optimize_model_for_npu(model: OVModelForFeatureExtraction):
@@ -130,7 +144,7 @@ def optimize_model_for_npu(model: OVModelForFeatureExtraction):
     model.reshape(1, 512)
 
 
-def load_embedding_model(model_name: str) -> OpenVINOEmbedding:
+def load_embedding_model(model_name: str) -> BucketedOpenVINOEmbedding:
     model_path = MODEL_DIR / model_name
 
     if not model_path.exists():
@@ -141,10 +155,10 @@ def load_embedding_model(model_name: str) -> OpenVINOEmbedding:
         embedding_tokenizer.save_pretrained(model_path)
 
     device = "NPU" if "NPU" in get_available_devices() else "CPU"
-    return OpenVINOEmbedding(str(model_path), device=device, embed_batch_size=1, model_kwargs={"dynamic_shapes": False})
+    return BucketedOpenVINOEmbedding(str(model_path), device=device, batch_size=EMBEDDING_BATCH_SIZE, sequence_lengths=EMBEDDING_SEQUENCE_LENGTHS)
 
 
-def load_reranker_model(model_name: str) -> OpenVINORerank:
+def load_reranker_model(model_name: str) -> TwoStageOpenVINORerank:
     model_path = MODEL_DIR / model_name
 
     if not model_path.exists():
@@ -153,25 +167,25 @@ def load_reranker_model(model_name: str) -> OpenVINORerank:
         reranker_tokenizer = AutoTokenizer.from_pretrained(model_name, use_fast=True)
         reranker_tokenizer.save_pretrained(model_path)
 
-    return OpenVINORerank(model_id_or_path=str(model_path), device="CPU", top_n=3)
+    # sessions share the reranker, it serializes the inferences itself
+    return TwoStageOpenVINORerank(model_id_or_path=str(model_path), device="CPU", top_n=3, max_candidates=RETRIEVED_PASSAGES)
 
 
-def load_chat_models(chat_model_name: str, embedding_model_name: str, reranker_model_name: str, personality_file_path: Path, auth_token: str = None) -> None:
-    global ov_llm, ov_chat_engine, ov_embedding, chatbot_config, ov_reranker
+def load_chat_models(chat_model_name: str, embedding_model_name: str, reranker_model_name: str, personality_file_path: Path, auth_token: str = None,
+                     kv_cache_size: int = 2, max_sessions: int = 8) -> None:
+    global llm_server, ov_embedding, chatbot_config, ov_reranker, embedding_model_id
 
     with open(personality_file_path, "rb") as f:
         chatbot_config = yaml.safe_load(f)
 
-    ov_llm = load_chat_model(chat_model_name, auth_token)
-    log.info(f"Running {chat_model_name} on {ov_llm.device}")
+    llm_server = load_chat_model(chat_model_name, auth_token, kv_cache_size, max_sessions)
+    log.info(f"Running {chat_model_name} on {llm_server.device}")
     ov_embedding = load_embedding_model(embedding_model_name)
-    log.info(f"Running {embedding_model_name} on {ov_embedding._model.request.get_property('EXECUTION_DEVICES')}")   
+    embedding_model_id = embedding_model_name
+    log.info(f"Running {embedding_model_name} on {','.join(ov_embedding.execution_devices)}")
     ov_reranker = load_reranker_model(reranker_model_name)
     log.info(f"Running {reranker_model_name} on {','.join(ov_reranker._model.request.get_property('EXECUTION_DEVICES'))}")
 
-    ov_chat_engine = SimpleChatEngine.from_defaults(llm=ov_llm, system_prompt=chatbot_config["system_configuration"],
-                                                    memory=ChatMemoryBuffer.from_defaults())
-
 
 def load_files(file_paths: List[str]) -> list[Document]:
     documents = []
@@ -199,31 +213,98 @@ def load_files(file_paths: List[str]) -> list[Document]:
     return documents
 
 
-def load_context(file_paths: List[str]) -> None:
-    global ov_chat_engine
+def get_file_hash(file_path: Path) -> str:
+    sha256 = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(2 ** 20), b""):
+            sha256.update(block)
+    return sha256.hexdigest()
+
+
+def get_chunk_collection() -> chromadb.Collection:
+    global chroma_client
 
+    if chroma_client is None:
+        chroma_client = chromadb.PersistentClient(path=str(VECTOR_STORE_DIR))
+
+    # chunks and their embeddings depend on the splitting parameters and the embedding model, so every combination has its own collection
+    params_hash = hashlib.sha256(f"{embedding_model_id}|{CHUNK_SIZE}|{CHUNK_OVERLAP}".encode()).hexdigest()[:16]
+    return chroma_client.get_or_create_collection(f"chunks_{params_hash}")
+
+
+def is_file_indexed(chroma_collection: chromadb.Collection, file_hash: str) -> bool:
+    # chunks are inserted in batches, so a file whose indexing was interrupted has only some of them
+    num_chunks = len(chroma_collection.get(where={"file_hash": file_hash}, include=[])["ids"])
+    if num_chunks == 0:
+        return False
+    metadata = chroma_collection.get(where={"file_hash": file_hash}, limit=1, include=["metadatas"])["metadatas"][0]
+    return metadata.get("num_chunks") == num_chunks
+
+
+def create_chat_engine(file_paths: Optional[List[str]], llm: SessionLLM) -> BaseChatEngine:
+    # every session has its own memory and LLM (for the session's stats), the generation server is shared
     # limit chat history to 1024 tokens
     memory = ChatMemoryBuffer.from_defaults(token_limit=2048)
 
     if not file_paths:
-        ov_chat_engine = SimpleChatEngine.from_defaults(llm=ov_llm, system_prompt=chatbot_config["system_configuration"], memory=memory)
-        return
+        return SimpleChatEngine.from_defaults(llm=llm, system_prompt=chatbot_config["system_configuration"], memory=memory)
 
-    documents = load_files(file_paths)
+    # chunks are stored on disk by the content of the file, so every file is split and embedded only once
+    file_hashes = {Path(file_path): get_file_hash(Path(file_path)) for file_path in file_paths}
+    chroma_collection = get_chunk_collection()
+
+    vector_store = ChromaVectorStore(chroma_collection=chroma_collection)
+    index = VectorStoreIndex.from_vector_store(vector_store, embed_model=ov_embedding)
 
     # a splitter to divide document into chunks
-    splitter = LangchainNodeParser(RecursiveCharacterTextSplitter(chunk_size=500, chunk_overlap=100))
+    splitter = LangchainNodeParser(RecursiveCharacterTextSplitter(chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP))
+
+    for file_path, file_hash in file_hashes.items():
+        with indexing_locks.setdefault(file_hash, threading.Lock()):
+            if is_file_indexed(chroma_collection, file_hash):
+                log.info(f"Using stored chunks of {file_path.name}")
+                continue
+            # remove the chunks of an interrupted indexing
+            chroma_collection.delete(where={"file_hash": file_hash})
+
+            documents = load_files([file_path])
+            for document in documents:
+                document.metadata["file_hash"] = file_hash
+                # these are only for lookups, so they don't change what's embedded or given to the LLM
+                document.excluded_embed_metadata_keys.extend(["file_hash", "num_chunks"])
+                document.excluded_llm_metadata_keys.extend(["file_hash", "num_chunks"])
+
+            nodes = splitter.get_nodes_from_documents(documents)
+            for i, node in enumerate(nodes):
+                node.id_ = f"{file_hash}-{i}"
+                # the number of chunks tells if all of them were stored
+                node.metadata["num_chunks"] = len(nodes)
+
+            start_time = time.perf_counter()
+            index.insert_nodes(nodes)
+            log.info(f"{file_path.name} split into {len(nodes)} chunks and embedded in {time.perf_counter() - start_time:.1f}s")
+
+    # the collection keeps chunks of all files ever uploaded, only the current ones are searched
+    filters = MetadataFilters(filters=[MetadataFilter(key="file_hash", value=list(set(file_hashes.values())), operator=FilterOperator.IN)])
+    # create a RAG pipeline
+    return ContextChatEngine.from_defaults(retriever=index.as_retriever(filters=filters, similarity_top_k=RETRIEVED_PASSAGES), llm=llm, system_prompt=chatbot_config["system_configuration"],
+                                           memory=memory, node_postprocessors=[ov_reranker])
 
-    chroma_client = chromadb.EphemeralClient()
-    chroma_collection = chroma_client.create_collection("ai_assistant_collection")
 
-    vector_store = ChromaVectorStore(chroma_collection=chroma_collection)
-    storage_context = StorageContext.from_defaults(vector_store=vector_store)
+def load_context(file_paths: List[str], request: gr.Request) -> None:
+    llm = SessionLLM(llm_server)
+    chat_engines[request.session_hash] = create_chat_engine(file_paths, llm), llm
+
+
+def get_chat_engine(session_id: str) -> Tuple[BaseChatEngine, SessionLLM]:
+    if session_id not in chat_engines:
+        llm = SessionLLM(llm_server)
+        chat_engines[session_id] = create_chat_engine(None, llm), llm
+    return chat_engines[session_id]
 
-    index = VectorStoreIndex.from_documents(documents, storage_context, embed_model=ov_embedding, transformations=[splitter])
-    # create a RAG pipeline
-    ov_chat_engine = index.as_chat_engine(llm=ov_llm, chat_mode=ChatMode.CONTEXT, system_prompt=chatbot_config["system_configuration"],
-                                          memory=memory, node_postprocessors=[ov_reranker])
+
+def close_session(request: gr.Request) -> None:
+    chat_engines.pop(request.session_hash, None)
 
 
 # this is necessary for thinking models e.g. deepseek
@@ -233,37 +314,26 @@ def emphasize_thinking_mode(token: str) -> str:
 
 def generate_initial_greeting() -> str:
     response = ""
-    for token in ov_chat_engine.stream_chat(chatbot_config["greet_the_user_prompt"]).response_gen:
+    for token in create_chat_engine(None, SessionLLM(llm_server)).stream_chat(chatbot_config["greet_the_user_prompt"]).response_gen:
         response += emphasize_thinking_mode(token)
     return response
 
 
-def chat(history: List[List[str]]) -> Tuple[List[List[str]], float]:
+def chat(history: List[List[str]], request: gr.Request) -> Tuple[List[List[str]], str]:
+    chat_engine, session_llm = get_chat_engine(request.session_hash)
+
     # get token by token and merge to the final response
     history[-1][1] = ""
-    with inference_lock:
-        chat_streamer = ov_chat_engine.stream_chat(history[-1][0]).response_gen
-
-        # generate first token independently
-        first_token = next(chat_streamer)
-        history[-1][1] += emphasize_thinking_mode(first_token)
-        yield history, 0.0
+    start_time = time.time()
+    for partial_text in chat_engine.stream_chat(history[-1][0]).response_gen:
+        history[-1][1] += emphasize_thinking_mode(partial_text)
+        # "return" partial response
+        yield history, f"{session_llm.first_token_time:.2f} s to first token, {session_llm.tokens_per_second:.2f} tokens/s"
 
-        # generate next tokens
-        tokens = ov_chat_engine._llm._streamer.tokens_len
-        start_time = time.time()
-        for partial_text in chat_streamer:
-            history[-1][1] += emphasize_thinking_mode(partial_text)
-            processing_time = time.time() - start_time
-            tokens += ov_chat_engine._llm._streamer.tokens_len
-            # "return" partial response
-            yield history, round(tokens / processing_time, 2)
-
-        end_time = time.time()
-
-        processing_time = end_time - start_time
-        log.info(f"Chat model response time: {processing_time:.2f} seconds ({tokens / processing_time:.2f} tokens/s)")
-        yield history, round(tokens / processing_time, 2)
+    processing_time = time.time() - start_time
+    log.info(f"Session {request.session_hash}: response time {processing_time:.2f} seconds, {session_llm.first_token_time:.2f} s to first token "
+             f"({session_llm.tokens_per_second:.2f} tokens/s), KV cache usage {llm_server.cache_usage:.0f}%")
+    yield history, f"{session_llm.first_token_time:.2f} s to first token, {session_llm.tokens_per_second:.2f} tokens/s"
 
 
 def transcribe(prompt: str, conversation: List[List[str]]) -> List[List[str]]:
@@ -271,9 +341,9 @@ def transcribe(prompt: str, conversation: List[List[str]]) -> List[List[str]]:
     return conversation
 
 
-def extra_action(conversation: List) -> Tuple[str, float]:
+def extra_action(conversation: List, request: gr.Request) -> Tuple[str, str]:
     conversation.append([chatbot_config["extra_action_prompt"], None])
-    for partial_summary, performance in chat(conversation):
+    for partial_summary, performance in chat(conversation, request):
         yield f"## Summary\n\n" + partial_summary[-1][1], performance
 
 
@@ -296,7 +366,7 @@ def create_UI(initial_message: str, action_name: str) -> gr.Blocks:
                     input_text_ui = gr.Textbox(label="Your text input", scale=6)
                     submit_btn = gr.Button("Submit", variant="primary", interactive=False, scale=1)
                 with gr.Row():
-                    tps_text_ui = gr.Text("", label="Performance (tokens/s)", type="text", scale=6)
+                    tps_text_ui = gr.Text("", label="Performance", type="text", scale=6)
                     with gr.Column(scale=1):
                         clear_btn = gr.Button("Start over", variant="secondary")
                         extra_action_button = gr.Button(action_name, variant="primary", interactive=False)
@@ -331,14 +401,18 @@ def create_UI(initial_message: str, action_name: str) -> gr.Blocks:
             .then(lambda: gr.Button(interactive=True), outputs=clear_btn) \
             .then(lambda: gr.Button(interactive=True), outputs=extra_action_button)
 
+        # the session's chat engine and memory aren't needed anymore
+        demo.unload(close_session)
+
         return demo
 
 
-def run(chat_model_name: str, embedding_model_name: str, reranker_model_name: str, personality_file_path: Path, hf_token: str = None, local_network: bool = False, public_interface: bool = False) -> None:
+def run(chat_model_name: str, embedding_model_name: str, reranker_model_name: str, personality_file_path: Path, hf_token: str = None, local_network: bool = False, public_interface: bool = False,
+        kv_cache_size: int = 2, max_sessions: int = 8) -> None:
     server_name = "0.0.0.0" if local_network else None
 
     # load chat models
-    load_chat_models(chat_model_name, embedding_model_name, reranker_model_name, personality_file_path, hf_token)
+    load_chat_models(chat_model_name, embedding_model_name, reranker_model_name, personality_file_path, hf_token, kv_cache_size, max_sessions)
 
     # get initial greeting
     initial_message = generate_initial_greeting()
@@ -347,7 +421,8 @@ def run(chat_model_name: str, embedding_model_name: str, reranker_model_name: st
     demo = create_UI(initial_message, chatbot_config["extra_action_name"])
     # launch demo
     print("Demo is ready!", flush=True) # Required for the CI to detect readiness
-    demo.queue().launch(server_name=server_name, share=public_interface)
+    # sessions are handled concurrently, the server generates their responses together
+    demo.queue(default_concurrency_limit=max_sessions).launch(server_name=server_name, share=public_interface)
 
 
 if __name__ == "__main__":
@@ -362,6 +437,8 @@ if __name__ == "__main__":
     parser.add_argument("--hf_token", type=str, help="HuggingFace access token to get Llama3")
     parser.add_argument("--public", default=False, action="store_true", help="Whether interface should be available publicly")
     parser.add_argument("--local_network", action="store_true", help="Whether demo should be available in local network")
+    parser.add_argument("--kv_cache_size", type=int, default=2, help="Size of the KV cache (in GB) shared by all chat sessions")
+    parser.add_argument("--max_sessions", type=int, default=8, help="Maximum number of chat sessions generating responses at once")
 
     args = parser.parse_args()
-    run(args.chat_model, args.embedding_model, args.reranker_model, Path(args.personality), args.hf_token, args.local_network, args.public)
+    run(args.chat_model, args.embedding_model, args.reranker_model, Path(args.personality), args.hf_token, args.local_network, args.public, args.kv_cache_size, args.max_sessions)